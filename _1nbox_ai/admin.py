@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Organization, User, Topic, Summary, Comment,
     ChatConversation, ChatMessage, GenieAnalysis,
-    BitesSubscription, BitesDigest
+    BitesSubscription, BitesDigest, ClusterSummaryCache, LLMUsage,
+    TopicVectorIndex, ChunkSummaryCheckpoint
 )
 
 admin.site.register(Organization)
@@ -15,3 +16,7 @@ admin.site.register(ChatMessage)
 admin.site.register(GenieAnalysis)
 admin.site.register(BitesSubscription)
 admin.site.register(BitesDigest)
+admin.site.register(ClusterSummaryCache)
+admin.site.register(LLMUsage)
+admin.site.register(TopicVectorIndex)
+admin.site.register(ChunkSummaryCheckpoint)
@@ -1,7 +1,11 @@
 from _1nbox_ai.models import User, Topic  # Adjust the import to your actual module path
-import os
 import json
-from google import generativeai as genai
+from _1nbox_ai import llm
+from _1nbox_ai import retrieval
+
+# Cluster summary passages and articles picked for the question from the topic's vector index
+ANSWER_TOP_PASSAGES = 6
+ANSWER_TOP_ARTICLES = 10
 
 def generate_answer(topic, body, context):
     print("GENERATING ANSWER")
@@ -11,18 +15,23 @@ def generate_answer(topic, body, context):
 
     # Fetch the topic and related summaries
     chosen_topic = Topic.objects.get(id=topic)
-    summary = repr(chosen_topic.summaries.first().final_summary)
-    cluster_summaries = repr(chosen_topic.summaries.first().cluster_summaries)
-
-    # Set up Gemini API
-    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found in environment variables. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    # Use gemini-2.5-flash-lite (cheapest smart model)
-    model = genai.GenerativeModel("gemini-2.5-flash-lite")
+    latest_summary = chosen_topic.summaries.first()
+    summary = repr(latest_summary.final_summary)
+
+    # Only the passages relevant to the question; the full cluster summaries without an index
+    retrieved = retrieval.search_topic(
+        chosen_topic,
+        body,
+        {'cluster': ANSWER_TOP_PASSAGES, 'article': ANSWER_TOP_ARTICLES},
+        summary_id=latest_summary.id
+    )
+    if retrieved is not None:
+        cluster_summaries = "\n\n".join(passage['text'] for passage in retrieved['cluster'])
+        cluster_summaries += "\n\nRelated articles:\n" + "\n".join(
+            f"- {passage['title']} ({passage['link']})" for passage in retrieved['article']
+        )
+    else:
+        cluster_summaries = repr(latest_summary.cluster_summaries)
 
     # Construct context for prompt
     context_text = ""
@@ -41,8 +50,8 @@ def generate_answer(topic, body, context):
         "If no article supports your answer, just answer without a link."
     )
 
-    # Call Gemini
-    response = model.generate_content(prompt)
-    answer = response.text.strip()
+    # Call Gemini (gemini-2.5-flash-lite, cheapest smart model, failing over to gemini-2.5-flash)
+    with llm.usage_scope(organization_id=chosen_topic.organization_id, topic_id=chosen_topic.id):
+        answer = llm.generate_text(prompt, route="bulk", caller="answer")
     return answer
 
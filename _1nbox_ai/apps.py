@@ -8,6 +8,10 @@ class MyAppConfig(AppConfig):
     name = '_1nbox_ai'
 
     def ready(self):
+        from . import llm_usage
+        if llm_usage.LLM_USAGE_TRACKING:
+            llm_usage.enable()
+
         if not firebase_admin._apps:
             try:
                 firebase_creds = settings.FIREBASE_CREDENTIALS
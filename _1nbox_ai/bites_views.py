@@ -1,5 +1,4 @@
 import json
-import os
 from datetime import datetime, timedelta, time as datetime_time
 import pytz
 from django.http import JsonResponse
@@ -7,7 +6,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from firebase_admin import auth
 from functools import wraps
-from google import generativeai as genai
+from . import llm
 
 from .models import User, Topic, BitesSubscription, BitesDigest
 from .bubbles import process_feeds_and_cluster
@@ -35,6 +34,51 @@ def firebase_auth_required(view_func):
     return wrapped_view
 
 
+# Response schema of a digest (Gemini JSON mode)
+DIGEST_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "sections": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "category": {"type": "STRING"},
+                    "headline": {"type": "STRING"},
+                    "summary": {"type": "STRING"},
+                    "article_count": {"type": "INTEGER"},
+                    "sentiment": {"type": "STRING", "enum": ["positive", "neutral", "negative", "mixed"]},
+                    "key_articles": {
+                        "type": "ARRAY",
+                        "items": {
+                            "type": "OBJECT",
+                            "properties": {
+                                "title": {"type": "STRING"},
+                                "url": {"type": "STRING"},
+                                "why_important": {"type": "STRING"},
+                            },
+                            "required": ["title", "why_important"],
+                        },
+                    },
+                },
+                "required": ["category", "headline", "summary", "article_count", "sentiment", "key_articles"],
+            },
+        },
+        "stats": {
+            "type": "OBJECT",
+            "properties": {
+                "total_articles": {"type": "INTEGER"},
+                "categories_covered": {"type": "INTEGER"},
+                "top_themes": {"type": "ARRAY", "items": {"type": "STRING"}},
+            },
+            "required": ["total_articles", "categories_covered", "top_themes"],
+        },
+    },
+    "required": ["summary", "sections", "stats"],
+}
+
+
 def generate_digest_content(topic, frequency='daily'):
     days_back = 1 if frequency == 'daily' else 7
 
@@ -68,15 +112,6 @@ def generate_digest_content(topic, frequency='daily'):
         for article in articles[:5]:
             cluster_text += f"- {article.get('title', 'Untitled')}\n"
 
-    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    # Use gemini-2.5-flash-lite (cheapest smart model)
-    model = genai.GenerativeModel("gemini-2.5-flash-lite")
-
     period = "today" if frequency == "daily" else "this week"
 
     prompt = f"""You are a news digest curator. Summarize the following article clusters into a clear, scannable digest.
@@ -120,17 +155,11 @@ GUIDELINES:
 - Be specific, not vague
 - Make it scannable"""
 
-    response = model.generate_content(prompt)
-    response_text = response.text.strip()
-
-    start_idx = response_text.find('{')
-    end_idx = response_text.rfind('}')
-    if start_idx != -1 and end_idx != -1:
-        response_text = response_text[start_idx:end_idx + 1]
-
+    # Use gemini-2.5-flash-lite (cheapest smart model), failing over to gemini-2.5-flash
     try:
-        digest_data = json.loads(response_text)
-    except json.JSONDecodeError:
+        with llm.usage_scope(organization_id=topic.organization_id, topic_id=topic.id):
+            digest_data = llm.generate_json(prompt, DIGEST_SCHEMA, route="bulk", caller="bites.digest")
+    except llm.StructuredOutputError:
         digest_data = {
             "summary": f"Summary of {total_articles} articles from {topic.name}",
             "sections": [],
@@ -1,12 +1,22 @@
 import feedparser
 import requests
 import re
+import os
+import json
+import time
+import hashlib
+import threading
 import pytz
 from datetime import datetime, timedelta
 import logging
 from collections import Counter
 import concurrent.futures
+from urllib.parse import urlsplit, urlunsplit
 from bs4 import BeautifulSoup
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .clustering import cluster_articles_density, build_cluster_hierarchy
 
 # ---------------------------------------------
 #   Logging Configuration (Optional)
@@ -354,39 +364,11 @@ def merge_clusters_by_percentage(clusters, join_percentage):
 # ---------------------------------------------
 #   Main Clustering Workflow Function
 # ---------------------------------------------
-def process_feeds_and_cluster(
-    rss_urls,
-    days_back=1,
-    common_word_threshold=2,
-    top_words_to_consider=3,
-    merge_threshold=2,
-    min_articles=3,
-    join_percentage=0.5,
-    final_merge_percentage=0.5,
-    title_only=False,
-    all_words=False
-):
+def extract_words_for_articles(all_articles, title_only=False, all_words=False):
     """
-    High-level function that:
-      1. Fetches articles from all `rss_urls` in parallel
-      2. Extracts significant words for each article
-      3. Clusters articles based on common words
-      4. Returns a dict with "clusters" + "failed_sources"
+    Set 'significant_words' on every article (in parallel), then sort each article's words
+    by rarity across the whole set.
     """
-    # 1. Fetch RSS feeds in parallel
-    all_articles, successful_sources, failed_sources = fetch_rss_parallel(rss_urls, days_back)
-    
-    if not all_articles:
-        logging.warning("No articles found from the provided RSS URLs.")
-        return {
-            "clusters": [],
-            "failed_sources": failed_sources
-        }
-    
-    logging.info(f"Total articles collected: {len(all_articles)}")
-    
-    # 2. Extract significant words
-    from collections import Counter
     word_counts = Counter()
 
     def extract_words_for_article(article):
@@ -411,17 +393,63 @@ def process_feeds_and_cluster(
                 logging.error(f"Word extraction failed: {exc}")
                 article['significant_words'] = []
 
-    # 3. Sort words by rarity within each article
+    # Sort words by rarity within each article
     for article in all_articles:
         if 'significant_words' in article:
             article['significant_words'] = sort_words_by_rarity(article['significant_words'], word_counts)
 
+    return word_counts
+
+def process_feeds_and_cluster(
+    rss_urls,
+    days_back=1,
+    common_word_threshold=2,
+    top_words_to_consider=3,
+    merge_threshold=2,
+    min_articles=3,
+    join_percentage=0.5,
+    final_merge_percentage=0.5,
+    title_only=False,
+    all_words=False,
+    clustering_mode='greedy'
+):
+    """
+    High-level function that:
+      1. Fetches articles from all `rss_urls` in parallel
+      2. Extracts significant words for each article
+      3. Clusters articles based on common words (or TF-IDF + HDBSCAN when
+         `clustering_mode='density'`)
+      4. Returns a dict with "clusters" + "failed_sources"
+    """
+    # 1. Fetch RSS feeds in parallel
+    all_articles, successful_sources, failed_sources = fetch_rss_parallel(rss_urls, days_back)
+    
+    if not all_articles:
+        logging.warning("No articles found from the provided RSS URLs.")
+        return {
+            "clusters": [],
+            "failed_sources": failed_sources
+        }
+    
+    logging.info(f"Total articles collected: {len(all_articles)}")
+    
+    # 2 + 3. Extract significant words, sorted by rarity within each article
+    extract_words_for_articles(all_articles, title_only, all_words)
+
     # 4. Clustering
     try:
-        clusters = cluster_articles(all_articles, common_word_threshold, top_words_to_consider)
-        clusters = merge_clusters(clusters, merge_threshold)
-        clusters = apply_minimum_articles_and_reassign(clusters, min_articles, join_percentage)
-        clusters = merge_clusters_by_percentage(clusters, final_merge_percentage)
+        if clustering_mode == 'density':
+            clusters = cluster_articles_density(
+                all_articles,
+                min_cluster_size=max(2, min_articles),
+                top_words=top_words_to_consider,
+                title_only=title_only
+            )
+        else:
+            clusters = cluster_articles(all_articles, common_word_threshold, top_words_to_consider)
+            clusters = merge_clusters(clusters, merge_threshold)
+            clusters = apply_minimum_articles_and_reassign(clusters, min_articles, join_percentage)
+            clusters = merge_clusters_by_percentage(clusters, final_merge_percentage)
 
         # 5. Build final cleaned_data structure
         cleaned_data = []
@@ -452,3 +480,135 @@ def process_feeds_and_cluster(
             "error": str(e)
         }
 
+
+
+# ---------------------------------------------
+#   Result Cache (shared across requests/users)
+# ---------------------------------------------
+BUBBLES_CACHE_TTL = int(os.environ.get('BUBBLES_CACHE_TTL', 300))
+BUBBLES_CACHE_VERSION = 1
+# How long a request waits for an identical in-flight computation before computing itself
+BUBBLES_WAIT_TIMEOUT = 120
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def normalize_rss_url(url):
+    """Lowercase scheme/host and drop fragments and trailing slashes so equivalent URLs share a key."""
+    parts = urlsplit(str(url).strip())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+
+
+def bubbles_cache_key(rss_urls, **params):
+    normalized = sorted(set(normalize_rss_url(url) for url in rss_urls if url))
+    payload = json.dumps({'urls': normalized, 'params': params}, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return f"bubbles:v{BUBBLES_CACHE_VERSION}:{digest}"
+
+
+def _wait_for_cached(key, wait_timeout):
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        payload = cache.get(key)
+        if payload is not None:
+            return payload
+        time.sleep(0.25)
+    return None
+
+
+def cached_single_flight(key, compute):
+    """
+    Return (value, cache_hit) for `key`, calling compute() on a miss. compute() returns
+    (value, cacheable); only cacheable values are stored, for BUBBLES_CACHE_TTL seconds.
+
+    Identical concurrent requests are coalesced: within a worker process followers wait on
+    the leader's event, and across workers (with a shared cache backend) a cache.add lock
+    lets one worker compute while the others poll for its result.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value, True
+
+    def compute_and_store():
+        value, cacheable = compute()
+        if cacheable:
+            cache.set(key, value, BUBBLES_CACHE_TTL)
+        return value
+
+    with _inflight_lock:
+        event = _inflight.get(key)
+        leader = event is None
+        if leader:
+            event = threading.Event()
+            _inflight[key] = event
+
+    if not leader:
+        event.wait(BUBBLES_WAIT_TIMEOUT)
+        value = cache.get(key)
+        if value is not None:
+            return value, True
+        return compute_and_store(), False
+
+    try:
+        lock_key = f"{key}:lock"
+        if not cache.add(lock_key, 1, BUBBLES_WAIT_TIMEOUT):
+            value = _wait_for_cached(key, BUBBLES_WAIT_TIMEOUT)
+            if value is not None:
+                return value, True
+            return compute_and_store(), False
+        try:
+            return compute_and_store(), False
+        finally:
+            cache.delete(lock_key)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        event.set()
+
+
+def get_bubbles_json(rss_urls, **params):
+    """
+    Cached front for process_feeds_and_cluster, keyed by the normalized URL set plus every
+    clustering parameter. Returns (json_payload, cache_hit).
+    """
+    def compute():
+        result = process_feeds_and_cluster(rss_urls=rss_urls, **params)
+        # Don't pin failures or empty results for the whole TTL
+        cacheable = bool(result.get("clusters")) and "error" not in result
+        return json.dumps(result, cls=DjangoJSONEncoder), cacheable
+
+    return cached_single_flight(bubbles_cache_key(rss_urls, **params), compute)
+
+
+def build_feeds_hierarchy(rss_urls, days_back=1, title_only=False, all_words=False):
+    """
+    Fetch the feeds once and precompute the cluster dendrogram for the Bubbles canvas
+    (see clustering.build_cluster_hierarchy). Returns the hierarchy plus "failed_sources".
+    """
+    all_articles, successful_sources, failed_sources = fetch_rss_parallel(rss_urls, days_back)
+    if not all_articles:
+        logging.warning("No articles found from the provided RSS URLs.")
+        return {"articles": [], "linkage": [], "failed_sources": failed_sources}
+
+    extract_words_for_articles(all_articles, title_only, all_words)
+    hierarchy = build_cluster_hierarchy(all_articles, title_only=title_only)
+    hierarchy["failed_sources"] = failed_sources
+    logging.info(f"Built cluster hierarchy over {len(hierarchy['articles'])} articles")
+    return hierarchy
+
+
+def get_cached_hierarchy(rss_urls, days_back=1, title_only=False, all_words=False):
+    """
+    Cached hierarchy for an article set. Thresholds are not part of the key: every cut is
+    served from the same entry. Returns (hierarchy, cache_hit).
+    """
+    def compute():
+        hierarchy = build_feeds_hierarchy(rss_urls, days_back, title_only, all_words)
+        return hierarchy, bool(hierarchy["articles"])
+
+    key = bubbles_cache_key(
+        rss_urls, kind='hierarchy', days_back=days_back, title_only=title_only, all_words=all_words
+    )
+    return cached_single_flight(key, compute)
@@ -0,0 +1,101 @@
+"""
+Chat context snapshots.
+
+The context a chat turn sends about a topic (its latest summary's stories and cluster
+summaries) plus the list of source articles only depend on that Summary, and summaries are
+never edited once created. So they are rendered once per Summary id - when the summary is
+created (warm_chat_context) or on the first chat turn after it - and kept in the shared
+Django cache (Redis in production), where every chat turn reads them instead of walking the
+summary's clusters again.
+"""
+import os
+import logging
+
+from django.core.cache import cache
+
+from .models import Summary
+
+CHAT_CONTEXT_SNAPSHOT_TTL = int(os.environ.get('CHAT_CONTEXT_SNAPSHOT_TTL_SECONDS', 24 * 3600))
+# Bump when the snapshot layout changes so snapshots of the old layout are not read
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_key(summary_id):
+    return f"chat-context:v{SNAPSHOT_VERSION}:{summary_id}"
+
+
+def render_chat_context(summary, topic_name):
+    """
+    Context text, stories-only context (without the cluster summaries, for prompts that add
+    retrieved passages instead) and article list of a summary, as sent to the chat model.
+    """
+    articles = []
+    if summary.clusters:
+        for cluster in summary.clusters:
+            for article in cluster.get('articles', []):
+                articles.append({
+                    'title': article.get('title', ''),
+                    'link': article.get('link', ''),
+                })
+
+    summary_text = ""
+    if summary.final_summary:
+        if isinstance(summary.final_summary, dict):
+            for item in summary.final_summary.get('summary', []):
+                summary_text += f"**{item.get('title', '')}**\n{item.get('content', '')}\n\n"
+        elif isinstance(summary.final_summary, list):
+            for item in summary.final_summary:
+                summary_text += f"**{item.get('title', '')}**\n{item.get('content', '')}\n\n"
+
+    cluster_summaries = summary.cluster_summaries or []
+
+    stories = f"Topic: {topic_name}\n\n"
+    stories += f"Summary:\n{summary_text}\n\n"
+    context = stories
+    if cluster_summaries:
+        context += "Detailed Cluster Summaries:\n"
+        for cs in cluster_summaries[:5]:
+            context += f"{cs}\n\n"
+
+    return context, stories, articles
+
+
+def warm_chat_context(summary, topic=None):
+    """Render the summary's chat context and store it; returns the snapshot."""
+    topic = topic or summary.topic
+    context, stories, articles = render_chat_context(summary, topic.name)
+    snapshot = {'context': context, 'stories': stories, 'articles': articles}
+    try:
+        cache.set(snapshot_key(summary.id), snapshot, CHAT_CONTEXT_SNAPSHOT_TTL)
+    except Exception as e:
+        logging.warning(f"Could not cache chat context of summary {summary.id}: {str(e)}")
+    return snapshot
+
+
+def get_topic_snapshot(topic):
+    """Chat context snapshot of the topic's latest summary and that summary's id; (None, None) without a summary."""
+    summary_id = topic.summaries.values_list('id', flat=True).first()
+    if summary_id is None:
+        return None, None
+
+    try:
+        snapshot = cache.get(snapshot_key(summary_id))
+    except Exception as e:
+        logging.warning(f"Chat context cache unavailable: {str(e)}")
+        snapshot = None
+
+    if snapshot is None:
+        summary = Summary.objects.filter(id=summary_id).first()
+        if summary is None:
+            return None, None
+        snapshot = warm_chat_context(summary, topic)
+
+    return snapshot, summary_id
+
+
+def get_topic_context(topic):
+    """Context text and article list of the topic's latest summary, plus that summary's id."""
+    snapshot, summary_id = get_topic_snapshot(topic)
+    if snapshot is None:
+        return "", [], None
+    return snapshot['context'], snapshot['articles'], summary_id
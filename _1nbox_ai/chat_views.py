@@ -1,13 +1,16 @@
 import json
 import os
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from firebase_admin import auth
 from functools import wraps
-from google import generativeai as genai
 
 from .models import User, Topic, ChatConversation, ChatMessage
+from . import llm
+from . import retrieval
+from .chat_context import get_topic_snapshot
 
 
 def firebase_auth_required(view_func):
@@ -32,6 +35,17 @@ def firebase_auth_required(view_func):
     return wrapped_view
 
 
+# Chat goes through the 'interactive' route of llm.MODEL_ROUTES: gemini-2.0-flash-exp for
+# small contexts, 2.5 models for large ones, with failover and a hedged request when slow
+CHAT_ROUTE = 'interactive'
+CHAT_DEADLINE = int(os.environ.get('CHAT_DEADLINE_SECONDS', 60))
+CHAT_HEDGE_AFTER = float(os.environ.get('CHAT_HEDGE_AFTER_SECONDS', 12))
+# The topic context of a summary is cached by the provider for this long between chat turns
+CHAT_CONTEXT_TTL = int(os.environ.get('CHAT_CONTEXT_CACHE_TTL_SECONDS', 3600))
+# Cluster summary passages and articles picked per question from the topic's vector index
+CHAT_TOP_PASSAGES = int(os.environ.get('CHAT_TOP_PASSAGES', 6))
+CHAT_TOP_ARTICLES = int(os.environ.get('CHAT_TOP_ARTICLES', 20))
+
 DOCUMENT_TYPE_PROMPTS = {
     'executive_brief': """Generate an Executive Brief with: Headline + 5-8 key bullets + 3 key risks + 3 opportunities + 3 recommended actions. Be concise and high-signal.""",
 
@@ -55,71 +69,65 @@ DOCUMENT_TYPE_PROMPTS = {
 }
 
 
-def get_topic_context(topic):
-    latest_summary = topic.summaries.first()
-    if not latest_summary:
-        return "", []
-
-    articles = []
-    if latest_summary.clusters:
-        for cluster in latest_summary.clusters:
-            for article in cluster.get('articles', []):
-                articles.append({
-                    'title': article.get('title', ''),
-                    'link': article.get('link', ''),
-                })
-
-    summary_text = ""
-    if latest_summary.final_summary:
-        if isinstance(latest_summary.final_summary, dict):
-            for item in latest_summary.final_summary.get('summary', []):
-                summary_text += f"**{item.get('title', '')}**\n{item.get('content', '')}\n\n"
-        elif isinstance(latest_summary.final_summary, list):
-            for item in latest_summary.final_summary:
-                summary_text += f"**{item.get('title', '')}**\n{item.get('content', '')}\n\n"
-
-    cluster_summaries = latest_summary.cluster_summaries or []
-
-    context = f"Topic: {topic.name}\n\n"
-    context += f"Summary:\n{summary_text}\n\n"
-    if cluster_summaries:
-        context += "Detailed Cluster Summaries:\n"
-        for cs in cluster_summaries[:5]:
-            context += f"{cs}\n\n"
-
-    return context, articles
-
-
-def generate_chat_response(topic, user_message, conversation_history, document_type=None):
-    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found in environment variables. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    # Use gemini-2.0-flash-exp for better performance
-    model = genai.GenerativeModel("gemini-2.0-flash-exp")
-
-    context, articles = get_topic_context(topic)
+def build_chat_prompt(topic, user_message, conversation_history, document_type=None):
+    """
+    The chat request as (prompt, news_context, context_key, articles): the per-turn prompt,
+    the topic's news context sent as cached context, its cache key and the source articles.
+    With a vector index (see retrieval) the prompt carries the passages and articles most
+    relevant to the question; otherwise the context has the first cluster summaries and articles.
+    """
+    snapshot, summary_id = get_topic_snapshot(topic)
 
     history_text = ""
     for msg in conversation_history[-10:]:  # Only last 10 messages for context
         role = "User" if msg.role == "user" else "Assistant"
         history_text += f"{role}: {msg.content}\n\n"
 
-    # Build comprehensive article list for context
-    articles_context = "\n\nAVAILABLE ARTICLES:\n"
-    for i, article in enumerate(articles[:20], 1):  # Include up to 20 articles
-        articles_context += f"{i}. {article.get('title', 'Untitled')}\n   URL: {article.get('link', 'N/A')}\n"
+    retrieved = None
+    if snapshot is not None:
+        retrieved = retrieval.search_topic(
+            topic,
+            user_message,
+            {'cluster': CHAT_TOP_PASSAGES, 'article': CHAT_TOP_ARTICLES},
+            summary_id=summary_id
+        )
 
-    if document_type and document_type in DOCUMENT_TYPE_PROMPTS:
-        prompt = f"""You are Briefed Chat, an AI assistant specialized in analyzing news content for consultants, analysts, and executives.
+    if retrieved is not None:
+        # The stories stay in the cached context; the passages and articles relevant to this
+        # question, picked from all of the summary's clusters and articles, go in the prompt.
+        context = snapshot['stories']
+        articles = [{'title': a['title'], 'link': a['link']} for a in retrieved['article']]
+        articles_context = ""
+        passages_text = "RELEVANT CLUSTER SUMMARY EXCERPTS:\n"
+        for passage in retrieved['cluster']:
+            passages_text += f"{passage['text']}\n\n"
+        passages_text += "RELEVANT ARTICLES:\n"
+        for i, article in enumerate(articles, 1):
+            passages_text += f"{i}. {article.get('title', 'Untitled')}\n   URL: {article.get('link', 'N/A')}\n"
+        context_key = f"chat-stories-{summary_id}"
+    else:
+        context = snapshot['context'] if snapshot else ""
+        articles = snapshot['articles'] if snapshot else []
+        # Build comprehensive article list for context
+        articles_context = "\n\nAVAILABLE ARTICLES:\n"
+        for i, article in enumerate(articles[:20], 1):  # Include up to 20 articles
+            articles_context += f"{i}. {article.get('title', 'Untitled')}\n   URL: {article.get('link', 'N/A')}\n"
+        passages_text = ""
+        context_key = f"chat-summary-{summary_id}" if summary_id else None
+
+    # The news context only changes with a new summary, so it is sent as cached context keyed by
+    # the summary id; each turn only sends the history and the question.
+    news_context = f"""You are Briefed Chat, an AI assistant specialized in analyzing and discussing news content for consultants, analysts, and executives.
 
 TOPIC: {topic.name}
 
 NEWS CONTEXT:
 {context}{articles_context}
+"""
 
+    if document_type and document_type in DOCUMENT_TYPE_PROMPTS:
+        prompt = f"""
+{passages_text}
 CONVERSATION HISTORY:
 {history_text}
 
@@ -130,13 +138,8 @@ USER REQUEST: {user_message}
 
 Generate the requested document based on the news context provided. Include relevant article citations with URLs when making specific claims."""
     else:
-        prompt = f"""You are Briefed Chat, an AI assistant specialized in analyzing and discussing news content.
-
-TOPIC: {topic.name}
-
-NEWS CONTEXT:
-{context}{articles_context}
-
+        prompt = f"""
+{passages_text}
 CONVERSATION HISTORY:
 {history_text}
 
@@ -152,8 +155,48 @@ USER QUESTION: {user_message}
 
 Respond with a helpful, factual answer with citations."""
 
-    response = model.generate_content(prompt)
-    return response.text.strip(), articles
+    return prompt, news_context, context_key, articles
+
+
+def generate_chat_response(topic, user_message, conversation_history, document_type=None):
+    prompt, news_context, context_key, articles = build_chat_prompt(
+        topic, user_message, conversation_history, document_type
+    )
+
+    with llm.usage_scope(organization_id=topic.organization_id, topic_id=topic.id):
+        response_text = llm.generate_text(
+            prompt,
+            route=CHAT_ROUTE,
+            deadline=CHAT_DEADLINE,
+            hedge_after=CHAT_HEDGE_AFTER,
+            caller="chat",
+            context=news_context,
+            context_key=context_key,
+            context_ttl=CHAT_CONTEXT_TTL
+        )
+    return response_text, articles
+
+
+def stream_chat_response(topic, user_message, conversation_history, document_type=None):
+    """Generator variant of generate_chat_response: returns (text chunk iterator, articles)."""
+    prompt, news_context, context_key, articles = build_chat_prompt(
+        topic, user_message, conversation_history, document_type
+    )
+    chunks = llm.generate_stream(
+        prompt,
+        route=CHAT_ROUTE,
+        deadline=CHAT_DEADLINE,
+        caller="chat.stream",
+        context=news_context,
+        context_key=context_key,
+        context_ttl=CHAT_CONTEXT_TTL
+    )
+    return chunks, articles
+
+
+def sse_event(event, data):
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
 
 
 @csrf_exempt
@@ -262,99 +305,181 @@ def conversation_detail(request, conversation_id):
         return JsonResponse({'error': 'An internal error occurred'}, status=500)
 
 
-@csrf_exempt
-@firebase_auth_required
-@require_http_methods(["POST"])
-def send_message(request, conversation_id):
-    try:
-        firebase_user = request.firebase_user
-        email = firebase_user['email']
-        user = User.objects.get(email=email)
+def start_message(request, conversation_id):
+    """
+    Validate a new message and store it: returns (conversation, user_message, document_type,
+    conversation_history) or a JsonResponse with the error.
+    """
+    firebase_user = request.firebase_user
+    email = firebase_user['email']
+    user = User.objects.get(email=email)
 
-        conversation = ChatConversation.objects.filter(
-            id=conversation_id,
-            user=user
+    conversation = ChatConversation.objects.filter(
+        id=conversation_id,
+        user=user
+    ).first()
+
+    if not conversation:
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+
+    data = json.loads(request.body)
+    message_content = data.get('message')
+    document_type = data.get('document_type')
+    topic_id = data.get('topic_id')
+
+    if not message_content:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+
+    if topic_id and not conversation.topic:
+        topic = Topic.objects.filter(
+            id=topic_id,
+            organization=user.organization
         ).first()
+        if topic:
+            conversation.topic = topic
+            conversation.save()
 
-        if not conversation:
-            return JsonResponse({'error': 'Conversation not found'}, status=404)
+    if not conversation.topic:
+        return JsonResponse({'error': 'No topic associated with conversation'}, status=400)
+
+    user_message = ChatMessage.objects.create(
+        conversation=conversation,
+        role='user',
+        content=message_content,
+        document_type=document_type
+    )
+
+    conversation_history = conversation.messages.exclude(id=user_message.id).order_by('created_at')[:10]
+
+    return conversation, user_message, document_type, list(conversation_history)
+
+
+def finish_message(conversation, user_message, response_content, document_type, articles):
+    """Store the assistant's answer and title new conversations; returns the response payload."""
+    assistant_message = ChatMessage.objects.create(
+        conversation=conversation,
+        role='assistant',
+        content=response_content,
+        document_type=document_type,
+        metadata={
+            'sources': articles[:10],
+            'article_count': len(articles),
+        }
+    )
+
+    message_content = user_message.content
+    if not conversation.title or conversation.title == 'New Conversation':
+        conversation.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
+        conversation.save()
+
+    return {
+        'user_message': {
+            'id': user_message.id,
+            'role': 'user',
+            'content': user_message.content,
+            'created_at': user_message.created_at,
+        },
+        'assistant_message': {
+            'id': assistant_message.id,
+            'role': 'assistant',
+            'content': assistant_message.content,
+            'document_type': assistant_message.document_type,
+            'metadata': assistant_message.metadata,
+            'created_at': assistant_message.created_at,
+        }
+    }
 
-        data = json.loads(request.body)
-        message_content = data.get('message')
-        document_type = data.get('document_type')
-        topic_id = data.get('topic_id')
-
-        if not message_content:
-            return JsonResponse({'error': 'Message is required'}, status=400)
-
-        if topic_id and not conversation.topic:
-            topic = Topic.objects.filter(
-                id=topic_id,
-                organization=user.organization
-            ).first()
-            if topic:
-                conversation.topic = topic
-                conversation.save()
-
-        if not conversation.topic:
-            return JsonResponse({'error': 'No topic associated with conversation'}, status=400)
-
-        user_message = ChatMessage.objects.create(
-            conversation=conversation,
-            role='user',
-            content=message_content,
-            document_type=document_type
-        )
 
-        conversation_history = conversation.messages.exclude(id=user_message.id).order_by('created_at')[:10]
+@csrf_exempt
+@firebase_auth_required
+@require_http_methods(["POST"])
+def send_message(request, conversation_id):
+    try:
+        started = start_message(request, conversation_id)
+        if isinstance(started, JsonResponse):
+            return started
+        conversation, user_message, document_type, conversation_history = started
 
         response_content, articles = generate_chat_response(
             conversation.topic,
-            message_content,
-            list(conversation_history),
+            user_message.content,
+            conversation_history,
             document_type
         )
 
-        assistant_message = ChatMessage.objects.create(
-            conversation=conversation,
-            role='assistant',
-            content=response_content,
-            document_type=document_type,
-            metadata={
-                'sources': articles[:10],
-                'article_count': len(articles),
-            }
-        )
+        return JsonResponse(finish_message(conversation, user_message, response_content, document_type, articles))
 
-        if not conversation.title or conversation.title == 'New Conversation':
-            conversation.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
-            conversation.save()
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        print(f"Error in send_message: {str(e)}")
+        return JsonResponse({'error': 'An internal error occurred'}, status=500)
 
-        return JsonResponse({
-            'user_message': {
-                'id': user_message.id,
-                'role': 'user',
-                'content': user_message.content,
-                'created_at': user_message.created_at,
-            },
-            'assistant_message': {
-                'id': assistant_message.id,
-                'role': 'assistant',
-                'content': assistant_message.content,
-                'document_type': assistant_message.document_type,
-                'metadata': assistant_message.metadata,
-                'created_at': assistant_message.created_at,
-            }
-        })
 
+@csrf_exempt
+@firebase_auth_required
+@require_http_methods(["POST"])
+def send_message_stream(request, conversation_id):
+    """
+    send_message over Server-Sent Events: a `user_message` event, `token` events with the
+    answer as Gemini generates it, then `done` with the stored messages (as send_message
+    returns them) or `error`. The assistant message is saved once the stream completes.
+    """
+    try:
+        started = start_message(request, conversation_id)
+        if isinstance(started, JsonResponse):
+            return started
+        conversation, user_message, document_type, conversation_history = started
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
-        print(f"Error in send_message: {str(e)}")
+        print(f"Error in send_message_stream: {str(e)}")
         return JsonResponse({'error': 'An internal error occurred'}, status=500)
 
+    topic = conversation.topic
+    endpoint = request.path
+
+    def event_stream():
+        yield sse_event('user_message', {
+            'id': user_message.id,
+            'role': 'user',
+            'content': user_message.content,
+            'created_at': user_message.created_at,
+        })
+
+        # The body is consumed after the middleware returned, so the usage scope is set here
+        with llm.usage_scope(endpoint=endpoint, organization_id=topic.organization_id, topic_id=topic.id):
+            try:
+                chunks, articles = stream_chat_response(
+                    topic,
+                    user_message.content,
+                    conversation_history,
+                    document_type
+                )
+                parts = []
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield sse_event('token', {'text': chunk})
+
+                response_content = ''.join(parts).strip()
+                if not response_content:
+                    raise ValueError("Gemini API returned an empty response")
+
+                yield sse_event('done', finish_message(conversation, user_message, response_content, document_type, articles))
+            except Exception as e:
+                print(f"Error in send_message_stream: {str(e)}")
+                yield sse_event('error', {'error': 'An internal error occurred'})
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 
 @csrf_exempt
 @firebase_auth_required
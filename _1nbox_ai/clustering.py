@@ -0,0 +1,490 @@
+import re
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+
+# scikit-learn and hdbscan are only needed for the density clustering mode.
+# Import them defensively so the greedy pipeline keeps working without them.
+try:
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+except ImportError:
+    np = None
+    TfidfVectorizer = None
+    TruncatedSVD = None
+    normalize = None
+
+try:
+    import hdbscan
+except ImportError:
+    hdbscan = None
+
+try:
+    from scipy.cluster.hierarchy import linkage as scipy_linkage
+    from scipy.spatial.distance import pdist
+except ImportError:
+    scipy_linkage = None
+    pdist = None
+
+CLUSTERING_MODES = ('greedy', 'density')
+DEFAULT_MAX_ARTICLES = 777
+
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def strip_html(text):
+    """Cheap tag stripper for feed content (much faster than BeautifulSoup on large corpora)."""
+    if not text:
+        return ""
+    return WHITESPACE_RE.sub(' ', HTML_TAG_RE.sub(' ', text)).strip()
+
+
+def parse_datetime_safe(date_str):
+    """Parse a datetime string and ensure it's timezone-aware (UTC if naive)"""
+    if not date_str:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    try:
+        # Try to parse with timezone info
+        dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        # If it's naive, make it UTC-aware
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+    except (ValueError, AttributeError):
+        # Fallback to minimum datetime if parsing fails
+        return datetime.min.replace(tzinfo=timezone.utc)
+
+
+def select_recent_articles(articles, max_articles=DEFAULT_MAX_ARTICLES):
+    """
+    De-duplicate articles by link and keep the `max_articles` most recent ones, instead of
+    whichever feeds happened to be fetched first. Articles without a date sort last.
+    """
+    unique = {}
+    for article in articles:
+        link = article.get('link')
+        if link and link not in unique:
+            unique[link] = article
+
+    ranked = sorted(
+        unique.values(),
+        key=lambda a: parse_datetime_safe(a.get('published')),
+        reverse=True
+    )
+    if len(ranked) > max_articles:
+        logging.info(f"Keeping the {max_articles} most recent of {len(ranked)} unique articles")
+    return ranked[:max_articles]
+
+
+def article_text(article, title_only=False):
+    """Text used to vectorize an article: the title, plus the extracted content unless title_only."""
+    title = article.get('title', '') or ''
+    if title_only:
+        return title
+    # Repeat the title so headline terms weigh more than boilerplate in the body
+    return f"{title}. {title}. {strip_html(article.get('content', '') or article.get('summary', ''))}"
+
+
+def derive_common_words(articles, top_words=3):
+    """
+    Build a `common_words` label for a cluster from its members' significant words.
+    Prefers words shared by at least half of the members; falls back to the most frequent ones.
+    """
+    counts = Counter()
+    for article in articles:
+        counts.update(article.get('significant_words', []))
+
+    if not counts:
+        return []
+
+    majority = max(1, len(articles) // 2)
+    shared = [word for word, count in counts.most_common() if count >= majority]
+    if len(shared) >= top_words:
+        return shared[:top_words]
+    return [word for word, _ in counts.most_common(top_words)]
+
+
+def vectorize_articles(articles, title_only=False, max_features=50000, svd_components=100):
+    """
+    TF-IDF vectors for the articles, optionally reduced with TruncatedSVD and L2-normalized
+    so that euclidean distance behaves like cosine distance.
+    Returns a dense float32 matrix (or sparse if no reduction was applied).
+    """
+    texts = [article_text(article, title_only) for article in articles]
+
+    vectorizer = TfidfVectorizer(
+        max_features=max_features,
+        stop_words='english',
+        sublinear_tf=True,
+        min_df=2 if len(texts) >= 50 else 1,
+        max_df=0.5 if len(texts) >= 50 else 1.0,
+        dtype=np.float32,
+    )
+    matrix = vectorizer.fit_transform(texts)
+
+    if svd_components and matrix.shape[1] > svd_components:
+        svd = TruncatedSVD(n_components=svd_components, random_state=42)
+        matrix = svd.fit_transform(matrix).astype(np.float32)
+
+    return normalize(matrix)
+
+
+def cluster_articles_density(articles, min_cluster_size=3, min_samples=None, top_words=3,
+                             title_only=False, max_features=50000, svd_components=100,
+                             cluster_selection_method='eom'):
+    """
+    Density-based clustering: TF-IDF vectors (optionally SVD-reduced) clustered with HDBSCAN.
+
+    Returns clusters in the same shape as the greedy pipeline:
+        [{'common_words': [...], 'articles': [...]}, ...]
+    with HDBSCAN noise collected into a trailing 'Miscellaneous' cluster, so downstream
+    consumers (get_final_summary, clean_clusters_for_storage, the frontend) are unaffected.
+    """
+    if TfidfVectorizer is None or hdbscan is None:
+        raise ImportError(
+            "Density clustering requires 'scikit-learn' and 'hdbscan'. "
+            "Install them with: pip install scikit-learn hdbscan"
+        )
+
+    if not articles:
+        return []
+
+    if len(articles) < max(min_cluster_size, 2) * 2:
+        logging.info(f"Only {len(articles)} articles, too few for density clustering; returning one Miscellaneous cluster")
+        return [{'common_words': ['Miscellaneous'], 'articles': list(articles)}]
+
+    vectors = vectorize_articles(
+        articles, title_only=title_only, max_features=max_features, svd_components=svd_components
+    )
+
+    # Dense reduced vectors can use the fast tree-based algorithms; sparse input needs the generic one
+    if hasattr(vectors, 'toarray'):
+        # Small vocabularies skip the SVD; the generic algorithm only accepts float64 input
+        vectors = vectors.astype(np.float64)
+        clusterer = hdbscan.HDBSCAN(
+            min_cluster_size=min_cluster_size,
+            min_samples=min_samples,
+            metric='cosine',
+            algorithm='generic',
+            cluster_selection_method=cluster_selection_method,
+        )
+    else:
+        clusterer = hdbscan.HDBSCAN(
+            min_cluster_size=min_cluster_size,
+            min_samples=min_samples,
+            metric='euclidean',
+            cluster_selection_method=cluster_selection_method,
+            core_dist_n_jobs=-1,
+        )
+
+    labels = clusterer.fit_predict(vectors)
+
+    grouped = {}
+    noise = []
+    for article, label in zip(articles, labels):
+        if label == -1:
+            noise.append(article)
+        else:
+            grouped.setdefault(int(label), []).append(article)
+
+    clusters = [
+        {'common_words': derive_common_words(members, top_words), 'articles': members}
+        for members in sorted(grouped.values(), key=len, reverse=True)
+    ]
+
+    if noise:
+        clusters.append({'common_words': ['Miscellaneous'], 'articles': noise})
+
+    logging.info(f"Density clustering: {len(grouped)} clusters, {len(noise)} noise articles out of {len(articles)}")
+    return clusters
+
+
+###############################################################################
+# Hierarchical (multi-resolution) clustering
+###############################################################################
+HIERARCHY_MAX_ARTICLES = 5000
+HIERARCHY_WORDS_PER_ARTICLE = 10
+
+
+def build_cluster_hierarchy(articles, title_only=False, max_features=50000, svd_components=100):
+    """
+    Average-linkage dendrogram over the articles' TF-IDF vectors (cosine distance).
+
+    Computed once per article set; any granularity is then a cut of the dendrogram
+    (see cut_cluster_hierarchy), so changing thresholds needs no re-fetching or re-clustering.
+    Returns a JSON-serializable dict:
+        {'articles': [{'title', 'link', 'favicon', 'significant_words'}, ...],
+         'linkage': [[left, right, distance, size], ...]}
+    where linkage follows scipy's convention (row i creates node n + i).
+    Only the HIERARCHY_MAX_ARTICLES most recent articles are kept (the pairwise distances are O(n^2)).
+    """
+    if TfidfVectorizer is None or scipy_linkage is None:
+        raise ImportError(
+            "Hierarchical clustering requires 'scikit-learn' and 'scipy'. "
+            "Install them with: pip install scikit-learn scipy"
+        )
+
+    articles = select_recent_articles(articles, HIERARCHY_MAX_ARTICLES)
+    compact = [
+        {
+            'title': article.get('title', ''),
+            'link': article.get('link', ''),
+            'favicon': article.get('favicon', ''),
+            'significant_words': article.get('significant_words', [])[:HIERARCHY_WORDS_PER_ARTICLE],
+        }
+        for article in articles
+    ]
+
+    if len(articles) < 2:
+        return {'articles': compact, 'linkage': []}
+
+    vectors = vectorize_articles(
+        articles, title_only=title_only, max_features=max_features, svd_components=svd_components
+    )
+    if hasattr(vectors, 'toarray'):
+        vectors = vectors.toarray()
+
+    # Zero vectors (every term pruned by min_df, stop-word-only titles) give NaN cosine
+    # distances, which linkage rejects; treat them as maximally distant
+    distances = np.nan_to_num(pdist(vectors, 'cosine'), nan=2.0)
+    matrix = scipy_linkage(distances, method='average')
+
+    return {
+        'articles': compact,
+        'linkage': [
+            [int(left), int(right), round(float(distance), 4), int(size)]
+            for left, right, distance, size in matrix
+        ],
+    }
+
+
+def cut_cluster_hierarchy(hierarchy, threshold, min_articles=3, top_words=3):
+    """
+    Flat clusters from a precomputed hierarchy: merges with distance <= threshold are applied,
+    groups smaller than min_articles are collected into a trailing 'Miscellaneous' cluster.
+    Pure Python over the linkage rows, so it is cheap enough to serve per request.
+    """
+    articles = hierarchy['articles']
+    n = len(articles)
+    members = {i: [i] for i in range(n)}
+
+    # Average linkage is monotonic, so the rows are already in increasing distance order
+    for step, (left, right, distance, _) in enumerate(hierarchy['linkage']):
+        if distance > threshold:
+            break
+        members[n + step] = members.pop(int(left)) + members.pop(int(right))
+
+    clusters = []
+    miscellaneous = []
+    for group in sorted(members.values(), key=len, reverse=True):
+        group_articles = [articles[i] for i in group]
+        if len(group_articles) >= min_articles:
+            clusters.append({
+                'common_words': derive_common_words(group_articles, top_words),
+                'articles': group_articles,
+            })
+        else:
+            miscellaneous.extend(group_articles)
+
+    if miscellaneous:
+        clusters.append({'common_words': ['Miscellaneous'], 'articles': miscellaneous})
+    return clusters
+
+
+###############################################################################
+# Online (incremental) clustering
+###############################################################################
+ONLINE_STATE_VERSION = 1
+ONLINE_WORDS_PER_ARTICLE = 10
+
+
+def _article_timestamp(article, default_ts):
+    """Epoch seconds for an article's 'published' string, or default_ts if it has none."""
+    published = article.get('published')
+    if not published:
+        return default_ts
+    try:
+        dt = datetime.fromisoformat(str(published).replace('Z', '+00:00'))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    except ValueError:
+        return default_ts
+
+
+def empty_online_state():
+    return {
+        'version': ONLINE_STATE_VERSION,
+        'next_id': 1,
+        'word_counts': {},
+        'clusters': {},
+        'articles': {},
+    }
+
+
+def _centroid_words(cluster, limit):
+    """Words shared by at least a third of the cluster's members, most common first."""
+    size = max(1, len(cluster['members']))
+    min_count = max(1, size // 3)
+    ranked = sorted(cluster['word_counts'].items(), key=lambda item: (-item[1], item[0]))
+    return [word for word, count in ranked if count >= min_count][:limit]
+
+
+def _add_words(counts, words, delta):
+    for word in words:
+        value = counts.get(word, 0) + delta
+        if value > 0:
+            counts[word] = value
+        else:
+            counts.pop(word, None)
+
+
+def update_online_clusters(state, articles, window_start, common_word_threshold=2,
+                           top_words_to_consider=3, min_articles=3):
+    """
+    Incrementally maintain clusters across runs.
+
+    `state` is the JSON-serializable dict persisted on Topic.cluster_state (empty/None on the
+    first run). `articles` is the current fetch; each article needs 'significant_words'
+    (unsorted is fine) for articles whose link is not already in the state.
+
+    Per run this only:
+      1. expires articles published before `window_start` (datetime),
+      2. assigns articles whose link is new to the best matching existing cluster
+         (by overlap of their rarest words with the cluster's centroid words) or seeds a new one.
+    Cost therefore scales with the number of new articles, not with the window size.
+
+    Returns (state, clusters) where clusters are in the usual
+    [{'common_words', 'articles', 'cluster_id'}, ...] shape; clusters below min_articles are
+    folded into a trailing Miscellaneous cluster (they stay in the state and may grow later).
+    """
+    if not state or state.get('version') != ONLINE_STATE_VERSION:
+        state = empty_online_state()
+
+    now_ts = datetime.now(timezone.utc).timestamp()
+    window_start_ts = window_start.timestamp()
+    records = state['articles']
+    clusters = state['clusters']
+    word_counts = state['word_counts']
+
+    # 1. Expire articles that left the window
+    expired = [link for link, record in records.items() if record['timestamp'] < window_start_ts]
+    for link in expired:
+        record = records.pop(link)
+        _add_words(word_counts, record['words'], -1)
+        cluster = clusters.get(record['cluster'])
+        if cluster:
+            cluster['members'] = [member for member in cluster['members'] if member != link]
+            _add_words(cluster['word_counts'], record['words'], -1)
+            if not cluster['members']:
+                clusters.pop(record['cluster'])
+
+    # 2. Register new articles; their word document-frequencies feed the rarity ordering
+    new_articles = []
+    for article in articles:
+        link = article.get('link')
+        if not link or link in records:
+            continue
+        timestamp = _article_timestamp(article, now_ts)
+        if timestamp < window_start_ts:
+            continue
+        words = list(dict.fromkeys(article.get('significant_words', [])))
+        _add_words(word_counts, words, 1)
+        new_articles.append((article, words, timestamp))
+
+    # Inverted index from centroid word to cluster ids, kept up to date as new clusters are seeded
+    index = {}
+    for cluster_id, cluster in clusters.items():
+        for word in _centroid_words(cluster, ONLINE_WORDS_PER_ARTICLE):
+            index.setdefault(word, set()).add(cluster_id)
+
+    for article, words, timestamp in new_articles:
+        ranked = sorted(words, key=lambda word: word_counts.get(word, 0))
+        top_words = ranked[:top_words_to_consider]
+        stored_words = ranked[:ONLINE_WORDS_PER_ARTICLE]
+
+        overlap = Counter()
+        for word in top_words:
+            for cluster_id in index.get(word, ()):
+                overlap[cluster_id] += 1
+
+        best_id = None
+        if overlap:
+            candidate_id, shared = max(overlap.items(), key=lambda item: (item[1], len(clusters[item[0]]['members'])))
+            if shared >= common_word_threshold:
+                best_id = candidate_id
+
+        if best_id is None:
+            best_id = f"c{state['next_id']}"
+            state['next_id'] += 1
+            clusters[best_id] = {'members': [], 'word_counts': {}}
+
+        cluster = clusters[best_id]
+        cluster['members'].append(article['link'])
+        _add_words(cluster['word_counts'], stored_words, 1)
+        for word in _centroid_words(cluster, ONLINE_WORDS_PER_ARTICLE):
+            index.setdefault(word, set()).add(best_id)
+
+        records[article['link']] = {
+            'title': article.get('title', ''),
+            'link': article['link'],
+            'favicon': article.get('favicon', ''),
+            'published': article.get('published'),
+            'summary': (article.get('summary') or '')[:500],
+            'words': stored_words,
+            'timestamp': timestamp,
+            'cluster': best_id,
+        }
+
+    logging.info(
+        f"Online clustering: {len(new_articles)} new, {len(expired)} expired, "
+        f"{len(records)} in window, {len(clusters)} clusters"
+    )
+
+    return state, build_online_clusters(state, articles, top_words_to_consider, min_articles)
+
+
+def build_online_clusters(state, articles, top_words_to_consider=3, min_articles=3):
+    """
+    Materialize the clusters held in an online state. Members are mapped back to the full
+    article dicts from the current fetch when available (so summaries see their content),
+    otherwise to the compact record stored in the state.
+    """
+    fetched = {article.get('link'): article for article in articles}
+    records = state['articles']
+
+    output = []
+    miscellaneous = {'common_words': ['Miscellaneous'], 'articles': []}
+    for cluster_id, cluster in state['clusters'].items():
+        members = []
+        for link in cluster['members']:
+            article = fetched.get(link)
+            if article is None:
+                record = records[link]
+                article = {
+                    'title': record['title'],
+                    'link': record['link'],
+                    'favicon': record['favicon'],
+                    'published': record['published'],
+                    'summary': record['summary'],
+                    'content': '',
+                    'significant_words': record['words'],
+                }
+            members.append(article)
+
+        if len(members) >= min_articles:
+            output.append({
+                'common_words': _centroid_words(cluster, top_words_to_consider) or records[cluster['members'][0]]['words'][:top_words_to_consider],
+                'articles': members,
+                'cluster_id': cluster_id,
+            })
+        else:
+            miscellaneous['articles'].extend(members)
+
+    output.sort(key=lambda cluster: len(cluster['articles']), reverse=True)
+    if miscellaneous['articles']:
+        output.append(miscellaneous)
+    return output
@@ -0,0 +1,318 @@
+"""
+Background execution of Genie analyses.
+
+genie_views.analyze stores the request on a 'pending' GenieAnalysis and returns its id right
+away; the analysis (news context, waiting for Deep Research, the report) runs outside the
+HTTP request:
+  - GENIE_JOB_RUNNER=thread (default): on a small thread pool inside the web process,
+  - GENIE_JOB_RUNNER=worker: only in the `rungeniejobs` command.
+A job is claimed by atomically moving it from 'pending' to 'processing', so a job submitted to
+the thread pool and also seen by `rungeniejobs` still runs once. `rungeniejobs` requeues
+'processing' jobs whose worker died (started more than GENIE_JOB_TIMEOUT seconds ago) and, run
+with --once from cron, picks up jobs a restarted web process never ran. Clients follow
+progress on genie/analyses/<id>/, long-polling with ?wait=<seconds>.
+
+A Deep Research analysis doesn't hold a thread while the research runs: its job parks it as
+'researching' and returns. One poller (a thread of `rungeniejobs`, or in 'thread' mode a
+thread in the web process that exits once nothing is researching) checks the due
+interactions in batches, backing off exponentially with jitter per analysis, and hands
+finished research back to the queue as 'pending' for the report.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, close_old_connections, transaction
+from django.utils import timezone
+
+from . import llm
+from .models import GenieAnalysis
+
+GENIE_JOB_RUNNER = os.environ.get('GENIE_JOB_RUNNER', 'thread').lower()
+GENIE_JOB_THREADS = int(os.environ.get('GENIE_JOB_THREADS', 2))
+# A 'processing' job older than this is considered abandoned by its worker
+GENIE_JOB_TIMEOUT = int(os.environ.get('GENIE_JOB_TIMEOUT_SECONDS', 1800))
+DEEP_RESEARCH_TIMEOUT_MINUTES = 15
+# Deep Research polling: the first check after DEEP_RESEARCH_POLL_BASE seconds, then twice as
+# long after every check up to DEEP_RESEARCH_POLL_MAX, each delay jittered down by up to half
+DEEP_RESEARCH_POLL_BASE = 10
+DEEP_RESEARCH_POLL_MAX = 60
+DEEP_RESEARCH_POLL_BATCH = 20
+# Rows being polled are pushed this far ahead so a second poller skips them
+DEEP_RESEARCH_POLL_LEASE = 120
+POLLER_IDLE_SECONDS = 5
+
+_executor_lock = threading.Lock()
+_executor = None
+_poller_lock = threading.Lock()
+_poller_thread = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GENIE_JOB_THREADS, thread_name_prefix='genie-job')
+        return _executor
+
+
+def enqueue(analysis):
+    """Schedule a pending analysis once the current transaction commits."""
+    if GENIE_JOB_RUNNER != 'thread':
+        return
+    analysis_id = analysis.id
+    transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, analysis_id))
+
+
+def _run_in_thread(analysis_id):
+    try:
+        run_job(analysis_id)
+    finally:
+        # Pool threads outlive the job; don't keep a connection open per idle thread
+        connection.close()
+
+
+def claim(analysis_id):
+    """Move a pending analysis to 'processing'; False if another worker got it first."""
+    return GenieAnalysis.objects.filter(id=analysis_id, status='pending').update(
+        status='processing', started_at=timezone.now()
+    ) == 1
+
+
+def claim_next():
+    """Claim the oldest pending analysis; returns its id or None."""
+    pending = GenieAnalysis.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:10]
+    for analysis_id in pending:
+        if claim(analysis_id):
+            return analysis_id
+    return None
+
+
+def requeue_stale():
+    """Return abandoned 'processing' jobs to the queue; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=GENIE_JOB_TIMEOUT)
+    requeued = GenieAnalysis.objects.filter(status='processing', started_at__lt=cutoff).update(
+        status='pending', started_at=None
+    )
+    if requeued:
+        logging.warning(f"Requeued {requeued} abandoned Genie analyses")
+    return requeued
+
+
+def run_job(analysis_id, claimed=False):
+    """Claim (unless already claimed) and run one analysis; returns False if it was not ours to run."""
+    if not claimed and not claim(analysis_id):
+        return False
+    analysis = GenieAnalysis.objects.select_related('organization').get(id=analysis_id)
+    with llm.usage_scope(organization_id=analysis.organization_id, endpoint='genie.job'):
+        run_analysis(analysis)
+    return True
+
+
+def run_analysis(analysis):
+    """
+    Gather the context and store the report on `analysis`. A Deep Research analysis whose
+    research hasn't been collected yet is parked for the poller instead.
+    """
+    from .genie_views import (
+        get_news_context,
+        extract_images_and_sources_from_deep_research,
+        generate_analysis,
+    )
+
+    # Deep Research still running: park the analysis for the poller instead of waiting here
+    if analysis.research_type == 'deep' and analysis.deep_research_id and analysis.deep_research_results is None:
+        wait_for_deep_research(analysis)
+        return
+
+    organization = analysis.organization
+    try:
+        # Get news context from selected topics (returns context and sources)
+        news_context, topic_sources = get_news_context(organization, analysis.topic_ids or None)
+
+        # Deep Research results handed over by the poller (or its timeout notice)
+        deep_research_results = analysis.deep_research_results or ""
+        deep_research_images = []
+        deep_research_sources = []
+        if deep_research_results:
+            deep_research_images, deep_research_sources = extract_images_and_sources_from_deep_research(deep_research_results)
+
+        # Combine all sources (topics + deep research), without duplicate URLs
+        seen_urls = set()
+        unique_sources = []
+        for source in topic_sources + deep_research_sources:
+            if source['url'] not in seen_urls:
+                seen_urls.add(source['url'])
+                unique_sources.append(source)
+
+        results = generate_analysis(
+            organization,
+            analysis.query,
+            analysis.questionnaire_answers,
+            news_context,
+            deep_research_results,
+            deep_research_images,
+            unique_sources
+        )
+
+        analysis.results = results
+        analysis.status = 'completed'
+        analysis.completed_at = timezone.now()
+        analysis.save(update_fields=['results', 'status', 'completed_at'])
+
+    except Exception as e:
+        logging.error(f"Analysis {analysis.id} generation failed: {str(e)}")
+        analysis.status = 'failed'
+        analysis.results = {'error': f'Analysis generation failed: {str(e)}'}
+        analysis.save(update_fields=['status', 'results'])
+
+
+def work(poll_interval=5, stop_when_idle=False, stop_event=None):
+    """Worker loop: claim and run pending analyses one at a time until stopped (or idle)."""
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        analysis_id = claim_next()
+        if analysis_id is None:
+            if stop_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(analysis_id, claimed=True)
+        except Exception as e:
+            logging.error(f"Genie job {analysis_id} crashed: {str(e)}")
+
+
+###############################################################################
+# Deep Research poller
+###############################################################################
+def next_poll_delay(attempts):
+    """Seconds until the next check of a research already checked `attempts` times."""
+    delay = min(DEEP_RESEARCH_POLL_MAX, DEEP_RESEARCH_POLL_BASE * 2 ** min(attempts, 10))
+    return random.uniform(delay / 2, delay)
+
+
+def wait_for_deep_research(analysis):
+    """Park a claimed analysis as 'researching' until the poller has its Deep Research results."""
+    GenieAnalysis.objects.filter(id=analysis.id).update(
+        status='researching',
+        poll_attempts=0,
+        next_poll_at=timezone.now() + timedelta(seconds=DEEP_RESEARCH_POLL_BASE),
+    )
+    logging.info(f"Analysis {analysis.id} waiting for Deep Research {analysis.deep_research_id}")
+    ensure_poller()
+
+
+def _check_research(interaction_id):
+    from .genie_views import poll_deep_research
+    try:
+        return poll_deep_research(interaction_id)
+    except Exception as e:
+        return 'error', str(e)
+
+
+def _hand_over(analysis, deep_research_results):
+    """Give the research text to the analysis stage; False if another poller got there first."""
+    handed_over = GenieAnalysis.objects.filter(id=analysis.id, status='researching').update(
+        status='pending',
+        deep_research_results=deep_research_results,
+        next_poll_at=None,
+    ) == 1
+    if handed_over:
+        enqueue(analysis)
+    return handed_over
+
+
+def poll_due_research(batch_size=DEEP_RESEARCH_POLL_BATCH):
+    """Check the 'researching' analyses that are due, concurrently; returns how many were checked."""
+    now = timezone.now()
+    due = list(
+        GenieAnalysis.objects.filter(status='researching', next_poll_at__lte=now)
+        .order_by('next_poll_at')
+        .values_list('id', 'next_poll_at')[:batch_size]
+    )
+    lease_until = now + timedelta(seconds=DEEP_RESEARCH_POLL_LEASE)
+    leased = [
+        analysis_id for analysis_id, next_poll_at in due
+        if GenieAnalysis.objects.filter(id=analysis_id, status='researching', next_poll_at=next_poll_at)
+        .update(next_poll_at=lease_until) == 1
+    ]
+    if not leased:
+        return 0
+
+    analyses = list(GenieAnalysis.objects.filter(id__in=leased))
+    with ThreadPoolExecutor(max_workers=min(8, len(analyses))) as executor:
+        outcomes = list(executor.map(_check_research, [analysis.deep_research_id for analysis in analyses]))
+
+    timeout = timedelta(minutes=DEEP_RESEARCH_TIMEOUT_MINUTES)
+    for analysis, (state, payload) in zip(analyses, outcomes):
+        if state == 'completed':
+            logging.info(f"Deep Research {analysis.deep_research_id} completed ({len(payload)} chars)")
+            _hand_over(analysis, payload)
+        elif state == 'failed':
+            logging.error(f"Analysis {analysis.id}: {payload}")
+            GenieAnalysis.objects.filter(id=analysis.id, status='researching').update(
+                status='failed', results={'error': payload}, next_poll_at=None
+            )
+        elif timezone.now() - analysis.created_at > timeout:
+            # As before, a timed out research doesn't fail the analysis; the report is built without it
+            message = f"Deep Research timed out after {DEEP_RESEARCH_TIMEOUT_MINUTES} minutes (still processing)"
+            logging.warning(f"Analysis {analysis.id}: {message}")
+            _hand_over(analysis, message)
+        else:
+            if state == 'error':
+                logging.warning(f"Checking Deep Research {analysis.deep_research_id} failed: {payload}")
+            attempts = analysis.poll_attempts + 1
+            GenieAnalysis.objects.filter(id=analysis.id, status='researching').update(
+                poll_attempts=attempts,
+                next_poll_at=timezone.now() + timedelta(seconds=next_poll_delay(attempts)),
+            )
+    return len(leased)
+
+
+def poll_loop(stop_event=None, until_idle=False):
+    """Poller loop; with until_idle it returns once no analysis is 'researching'."""
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        try:
+            checked = poll_due_research()
+        except Exception as e:
+            logging.error(f"Deep Research poller error: {str(e)}")
+            checked = 0
+        if until_idle and _poller_idle():
+            return
+        if not checked:
+            time.sleep(POLLER_IDLE_SECONDS)
+
+
+def _poller_idle():
+    """True (and the thread deregistered) when nothing is researching; checked under the lock
+    so ensure_poller() never sees a thread that is about to exit."""
+    global _poller_thread
+    with _poller_lock:
+        if GenieAnalysis.objects.filter(status='researching').exists():
+            return False
+        _poller_thread = None
+        return True
+
+
+def _run_poller_thread():
+    try:
+        poll_loop(until_idle=True)
+    finally:
+        connection.close()
+
+
+def ensure_poller():
+    """In 'thread' mode, start this process's poller thread unless it is running."""
+    global _poller_thread
+    if GENIE_JOB_RUNNER != 'thread':
+        return
+    with _poller_lock:
+        if _poller_thread is None or not _poller_thread.is_alive():
+            _poller_thread = threading.Thread(target=_run_poller_thread, name='deep-research-poller', daemon=True)
+            _poller_thread.start()
@@ -1,27 +1,21 @@
 import json
-import os
 import time
 import re
 from datetime import datetime
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.utils import timezone
 from firebase_admin import auth
 from functools import wraps
-from google import generativeai as genai
 from urllib.parse import urlparse
 
-# Import genai_client only when needed (for Deep Research Interactions API)
-# This avoids import errors if the package isn't available
-try:
-    from google import genai as genai_client
-except ImportError:
-    # If google.genai is not available, set to None
-    # Deep Research functions will handle this gracefully
-    genai_client = None
-
 from .models import User, Organization, GenieAnalysis, Topic
+from . import llm
+from . import genie_jobs
+
+# Longest ?wait= accepted by analysis_detail, and how often it re-reads the analysis meanwhile
+ANALYSIS_MAX_WAIT = 30
+ANALYSIS_POLL_INTERVAL = 1
 
 
 def firebase_auth_required(view_func):
@@ -197,17 +191,7 @@ def start_deep_research(query, organization):
     Returns:
         interaction_id: String ID to track the research task
     """
-    if genai_client is None:
-        raise ImportError(
-            "Deep Research requires the 'google-genai' package. "
-            "Install it with: pip install google-genai"
-        )
-    
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found. Set GEMINI_API_KEY or GEMINI_KEY.")
-    
-    client = genai_client.Client(api_key=gemini_key)
+    client = llm.get_client()
     
     # Build comprehensive research prompt focused on decision-making
     research_prompt = f"""You are conducting comprehensive deep research to support a critical business decision.
@@ -289,79 +273,161 @@ Format your research with clear sections, bullet points, and citations. Include
         raise
 
 
-def get_deep_research_results(interaction_id, timeout_minutes=15):
-    """Poll for Deep Research completion and return results.
-    
+def poll_deep_research(interaction_id):
+    """Check a Deep Research interaction once.
+
     Args:
         interaction_id: The interaction ID from start_deep_research
-        timeout_minutes: Maximum time to wait (default 15 minutes)
-    
+
     Returns:
-        research_results: String containing the research findings
+        (status, payload): ('completed', research text), ('failed', error message) or
+        ('running', None). genie_jobs polls all running interactions from one poller.
     """
-    if genai_client is None:
-        raise ImportError(
-            "Deep Research requires the 'google-genai' package. "
-            "Install it with: pip install google-genai"
-        )
-    
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found.")
-    
-    client = genai_client.Client(api_key=gemini_key)
-    
-    start_time = time.time()
-    timeout_seconds = timeout_minutes * 60
-    poll_interval = 10  # Poll every 10 seconds
-    
-    print(f"Polling for Deep Research results: {interaction_id}")
-    
-    while True:
-        try:
-            interaction = client.interactions.get(interaction_id)
-            
-            if interaction.status == "completed":
-                print(f"Deep Research completed: {interaction_id}")
-                # Get the final output text
-                if interaction.outputs and len(interaction.outputs) > 0:
-                    return interaction.outputs[-1].text
-                else:
-                    return "Deep Research completed but no output was generated."
-            
-            elif interaction.status == "failed":
-                error_msg = f"Deep Research failed: {getattr(interaction, 'error', 'Unknown error')}"
-                print(error_msg)
-                raise Exception(error_msg)
-            
-            # Check timeout
-            elapsed = time.time() - start_time
-            if elapsed > timeout_seconds:
-                timeout_msg = f"Deep Research exceeded {timeout_minutes} minute timeout (still processing)"
-                print(timeout_msg)
-                raise TimeoutError(timeout_msg)
-            
-            # Log progress
-            remaining = timeout_seconds - elapsed
-            print(f"Deep Research still processing... {remaining:.0f}s remaining")
-            
-            # Wait before next poll
-            time.sleep(poll_interval)
-            
-        except (TimeoutError, Exception) as e:
-            # Re-raise the exception to be handled by caller
-            raise
+    client = llm.get_client()
+    interaction = client.interactions.get(interaction_id)
+
+    if interaction.status == "completed":
+        # Get the final output text
+        if interaction.outputs and len(interaction.outputs) > 0:
+            return 'completed', interaction.outputs[-1].text
+        return 'completed', "Deep Research completed but no output was generated."
+
+    if interaction.status == "failed":
+        return 'failed', f"Deep Research failed: {getattr(interaction, 'error', 'Unknown error')}"
+
+    return 'running', None
+
+
+# Response schemas of the questionnaire and the analysis report (Gemini JSON mode)
+QUESTIONNAIRE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "questions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "INTEGER"},
+                    "question": {"type": "STRING"},
+                    "type": {"type": "STRING", "enum": ["multiple_choice", "text"]},
+                    "options": {"type": "ARRAY", "items": {"type": "STRING"}},
+                },
+                "required": ["id", "question", "type", "options"],
+            },
+        },
+    },
+    "required": ["questions"],
+}
+
+_STRING_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+_SCENARIO = {
+    "type": "OBJECT",
+    "properties": {"name": {"type": "STRING"}, "probability": {"type": "STRING"}},
+    "required": ["name", "probability"],
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "top_insight": {
+            "type": "OBJECT",
+            "properties": {
+                "title": {"type": "STRING"},
+                "summary": {"type": "STRING"},
+                "relevance_badge": {"type": "STRING"},
+            },
+            "required": ["title", "summary", "relevance_badge"],
+        },
+        "key_takeaways": _STRING_LIST,
+        "featured_quote": {
+            "type": "OBJECT",
+            "properties": {"text": {"type": "STRING"}, "attribution": {"type": "STRING"}},
+            "required": ["text", "attribution"],
+        },
+        "sources_analyzed": {"type": "INTEGER"},
+        "images": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "url": {"type": "STRING"},
+                    "source": {"type": "STRING"},
+                    "alt": {"type": "STRING"},
+                },
+                "required": ["url"],
+            },
+        },
+        "sources": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "url": {"type": "STRING"},
+                    "domain": {"type": "STRING"},
+                    "name": {"type": "STRING"},
+                    "type": {"type": "STRING"},
+                },
+                "required": ["url"],
+            },
+        },
+        "full_analysis": {
+            "type": "OBJECT",
+            "properties": {
+                "executive_summary": {"type": "STRING"},
+                "current_dynamics": {"type": "STRING"},
+                "positive_indicators": _STRING_LIST,
+                "negative_indicators": _STRING_LIST,
+                "neutral_factors": _STRING_LIST,
+                "historical_context": {"type": "STRING"},
+                "risk_assessment": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "category": {"type": "STRING"},
+                            "description": {"type": "STRING"},
+                            "severity": {"type": "STRING", "enum": ["low", "medium", "high", "critical"]},
+                        },
+                        "required": ["category", "description", "severity"],
+                    },
+                },
+                "probability_assessment": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "scenario_1": _SCENARIO,
+                        "scenario_2": _SCENARIO,
+                        "scenario_3": _SCENARIO,
+                    },
+                    "required": ["scenario_1", "scenario_2", "scenario_3"],
+                },
+            },
+            "required": [
+                "executive_summary", "current_dynamics", "positive_indicators", "negative_indicators",
+                "neutral_factors", "historical_context", "risk_assessment", "probability_assessment",
+            ],
+        },
+        "recommendations": {
+            "type": "OBJECT",
+            "properties": {
+                "strategic_planning": {"type": "STRING"},
+                "risk_management": {"type": "STRING"},
+                "timing": {"type": "STRING"},
+            },
+            "required": ["strategic_planning", "risk_management", "timing"],
+        },
+        "further_questions": _STRING_LIST,
+        "confidence_score": {"type": "NUMBER"},
+        "data_freshness": {"type": "STRING"},
+    },
+    "required": [
+        "top_insight", "key_takeaways", "featured_quote", "sources_analyzed", "full_analysis",
+        "recommendations", "further_questions", "confidence_score", "data_freshness",
+    ],
+}
 
 
 def generate_questionnaire(query):
     """Generate a questionnaire based on user's query to gather more context."""
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    model = genai.GenerativeModel("gemini-3-flash-preview")
-
     prompt = f"""You are helping a user make an important strategic decision. Based on their question, generate 3-5 clarifying questions that will help them make the best possible decision.
 
 USER QUERY: {query}
@@ -402,18 +468,11 @@ RULES:
 - Questions should be specific and actionable
 - Focus on clarifying the strategic context"""
 
-    response = model.generate_content(prompt)
-    response_text = response.text.strip()
-
-    # Extract JSON
-    start_idx = response_text.find('{')
-    end_idx = response_text.rfind('}')
-    if start_idx != -1 and end_idx != -1:
-        response_text = response_text[start_idx:end_idx + 1]
-
     try:
-        questionnaire = json.loads(response_text)
-    except json.JSONDecodeError:
+        questionnaire = llm.generate_json(
+            prompt, QUESTIONNAIRE_SCHEMA, model="gemini-3-flash-preview", caller="genie.questionnaire"
+        )
+    except llm.StructuredOutputError:
         # Fallback questionnaire
         questionnaire = {
             "questions": [
@@ -442,15 +501,6 @@ RULES:
 
 
 def generate_analysis(organization, query, questionnaire_answers, news_context, deep_research_results="", images=None, sources=None):
-    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
-    if not gemini_key:
-        raise ValueError("Gemini API key not found. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    # Use gemini-3-pro-preview for comprehensive decision support
-    model = genai.GenerativeModel("gemini-3-pro-preview")
-
     org_context = f"""
 ORGANIZATION CONTEXT:
 - Name: {organization.name}
@@ -578,17 +628,13 @@ IMPORTANT:
 - potential_impact should be: low, medium, or high
 - timeline should be: Immediate, Short-term, Medium-term, or Long-term"""
 
-    response = model.generate_content(prompt)
-    response_text = response.text.strip()
-
-    start_idx = response_text.find('{')
-    end_idx = response_text.rfind('}')
-    if start_idx != -1 and end_idx != -1:
-        response_text = response_text[start_idx:end_idx + 1]
-
+    # Use gemini-3-pro-preview for comprehensive decision support
     try:
-        analysis_data = json.loads(response_text)
-    except json.JSONDecodeError:
+        analysis_data = llm.generate_json(
+            prompt, ANALYSIS_SCHEMA, model="gemini-3-pro-preview", timeout=600, caller="genie.analysis"
+        )
+    except llm.StructuredOutputError as e:
+        response_text = e.text or ""
         analysis_data = {
             "top_insight": {
                 "title": "Analysis generated",
@@ -732,7 +778,8 @@ def questionnaire(request):
 
         try:
             # Generate questionnaire
-            questionnaire_data = generate_questionnaire(query)
+            with llm.usage_scope(organization_id=organization.id):
+                questionnaire_data = generate_questionnaire(query)
             
             # Start Deep Research if research_type is 'deep'
             deep_research_id = None
@@ -778,7 +825,10 @@ def questionnaire(request):
 @firebase_auth_required
 @require_http_methods(["POST"])
 def analyze(request):
-    """Generate final analysis with questionnaire answers, selected topics, and optional Deep Research."""
+    """
+    Queue the final analysis (questionnaire answers, selected topics and optional Deep Research)
+    and return its id right away; follow it on analysis_detail (see genie_jobs).
+    """
     try:
         firebase_user = request.firebase_user
         email = firebase_user['email']
@@ -799,102 +849,21 @@ def analyze(request):
             user=user,
             organization=organization,
             query=query,
-            status='processing',
+            status='pending',
             research_type=research_type,
-            deep_research_id=deep_research_id
+            deep_research_id=deep_research_id,
+            questionnaire_answers=questionnaire_answers,
+            topic_ids=topic_ids
         )
+        genie_jobs.enqueue(analysis)
 
-        try:
-            # Get news context from selected topics (returns context and sources)
-            news_context, topic_sources = get_news_context(organization, topic_ids if topic_ids else None)
-            
-            # Wait for Deep Research to complete if this is a deep research request
-            deep_research_results = ""
-            deep_research_images = []
-            deep_research_sources = []
-            if research_type == 'deep' and deep_research_id:
-                try:
-                    print(f"Waiting for Deep Research to complete: {deep_research_id}")
-                    deep_research_results = get_deep_research_results(deep_research_id, timeout_minutes=15)
-                    analysis.deep_research_results = deep_research_results
-                    analysis.save()
-                    print(f"Deep Research completed successfully. Length: {len(deep_research_results)} chars")
-                    
-                    # Extract images and sources from Deep Research
-                    deep_research_images, deep_research_sources = extract_images_and_sources_from_deep_research(deep_research_results)
-                    print(f"Extracted {len(deep_research_images)} images and {len(deep_research_sources)} sources from Deep Research")
-                except TimeoutError as te:
-                    # Deep Research timed out - continue with other sources instead of failing
-                    error_msg = f"Deep Research timed out after 15 minutes: {str(te)}"
-                    print(error_msg)
-                    deep_research_results = error_msg
-                    # Continue with analysis using other data sources
-                except Exception as dr_error:
-                    # Deep Research failed - continue with other sources instead of failing
-                    import traceback
-                    traceback.print_exc()
-                    error_msg = f"Deep Research encountered an error: {str(dr_error)}"
-                    print(error_msg)
-                    deep_research_results = error_msg
-                    # Continue with analysis using other data sources
-                    error_msg = f"Deep Research failed: {str(dr_error)}"
-                    print(error_msg)
-                    analysis.status = 'failed'
-                    analysis.results = {'error': error_msg}
-                    analysis.save()
-                    return JsonResponse({
-                        'id': analysis.id,
-                        'status': 'failed',
-                        'error': error_msg
-                    }, status=500)
-            
-            # Combine all sources (topics + deep research)
-            all_sources = topic_sources + deep_research_sources
-            # Remove duplicates based on URL
-            seen_urls = set()
-            unique_sources = []
-            for source in all_sources:
-                if source['url'] not in seen_urls:
-                    seen_urls.add(source['url'])
-                    unique_sources.append(source)
-            
-            # Generate final analysis with all context including deep research
-            results = generate_analysis(
-                organization, 
-                query, 
-                questionnaire_answers, 
-                news_context,
-                deep_research_results,  # Pass deep research results
-                deep_research_images,   # Pass images
-                unique_sources          # Pass all sources
-            )
-
-            analysis.results = results
-            analysis.status = 'completed'
-            analysis.completed_at = timezone.now()
-            analysis.save()
-
-            return JsonResponse({
-                'id': analysis.id,
-                'status': 'completed',
-                'query': analysis.query,
-                'results': results,
-                'research_type': analysis.research_type,
-                'deep_research_included': bool(deep_research_results),
-                'created_at': analysis.created_at,
-                'completed_at': analysis.completed_at,
-            })
-
-        except Exception as e:
-            analysis.status = 'failed'
-            analysis.results = {'error': str(e)}
-            analysis.save()
-            print(f"Analysis generation failed: {str(e)}")
-            return JsonResponse({
-                'id': analysis.id,
-                'status': 'failed',
-                'error': f'Analysis generation failed: {str(e)}'
-            }, status=500)
+        return JsonResponse({
+            'id': analysis.id,
+            'status': analysis.status,
+            'query': analysis.query,
+            'research_type': analysis.research_type,
+            'created_at': analysis.created_at,
+        }, status=202)
 
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
@@ -922,13 +891,29 @@ def analysis_detail(request, analysis_id):
         if not analysis:
             return JsonResponse({'error': 'Analysis not found'}, status=404)
 
+        # ?wait=<seconds> long-polls until the analysis finishes or the wait is over
+        try:
+            wait = min(max(float(request.GET.get('wait', 0)), 0), ANALYSIS_MAX_WAIT)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid wait'}, status=400)
+        deadline = time.monotonic() + wait
+        if analysis.status == 'researching':
+            # Restarts the web process's poller if it was lost with a restart
+            genie_jobs.ensure_poller()
+        while analysis.status in ('pending', 'processing', 'researching') and time.monotonic() < deadline:
+            time.sleep(min(ANALYSIS_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+            analysis.refresh_from_db()
+
         return JsonResponse({
             'id': analysis.id,
             'status': analysis.status,
             'query': analysis.query,
             'results': analysis.results,
             'sources': analysis.sources,
+            'research_type': analysis.research_type,
+            'deep_research_included': bool(analysis.deep_research_results),
             'created_at': analysis.created_at,
+            'started_at': analysis.started_at,
             'completed_at': analysis.completed_at,
         })
 
@@ -0,0 +1,867 @@
+"""
+Single gateway for Gemini calls.
+
+Every module that talks to Gemini goes through generate()/generate_text() instead of calling
+genai.configure() and building a GenerativeModel per request. The gateway:
+  - configures the SDK once per API key (under a lock, so concurrent callers never race
+    on the global configuration) and reuses one GenerativeModel per model name,
+  - applies a uniform request timeout and retries transient errors (429/5xx/timeouts),
+  - paces requests through a process-wide token bucket matched to the Gemini quota,
+  - accounts latency and prompt/output tokens per caller and model (see usage_summary()) and
+    reports every call, attributed to the current usage_scope() (organization, topic,
+    endpoint), to registered usage sinks (see llm_usage),
+  - generates structured output in JSON mode against a per-call response schema
+    (generate_json()), parsed once instead of extracted and repaired,
+  - sends long stable prompt prefixes (`context=`) as provider-side cached content, so
+    repeated calls only pay for the part of the prompt that changes,
+  - routes calls of a `route` to a model by input size and deadline, fails over to the next
+    model on throttling or timeouts and can hedge slow requests (see MODEL_ROUTES),
+  - records and replays model calls for offline runs (LLM_MODE, see llm_replay) and can be
+    pointed at another endpoint such as `runfakegemini` (GEMINI_API_ENDPOINT),
+  - streams responses chunk by chunk for interactive callers (generate_stream()),
+  - embeds texts for the retrieval index (embed()).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import timedelta
+
+from tenacity import Retrying, stop_after_attempt, wait_exponential, retry_if_exception
+from google import generativeai as genai
+
+from . import llm_replay
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+try:
+    from google.generativeai import caching as genai_caching
+except ImportError:
+    genai_caching = None
+
+# google-genai (Interactions API, used by Deep Research) is optional
+try:
+    from google import genai as genai_client
+except ImportError:
+    genai_client = None
+
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+DEFAULT_TIMEOUT = int(os.environ.get('LLM_TIMEOUT_SECONDS', 120))
+DEFAULT_RETRIES = int(os.environ.get('LLM_RETRIES', 3))
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', 60))
+# Alternative API endpoint (e.g. the local fake from `runfakegemini` for load tests)
+API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT')
+DEFAULT_CONTEXT_TTL = int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', 3600))
+# Gemini rejects cached content below a minimum size; smaller prefixes are sent inline
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get('CONTEXT_CACHE_MIN_TOKENS', 1024))
+# After a failed cache creation the prefix is sent inline for this long before trying again
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+# Model routes: ordered candidates per kind of call. A candidate is used for inputs up to
+# max_input_tokens; its expected latency (base_latency + seconds_per_1k_tokens per 1k input
+# tokens) decides whether it fits a call's deadline. Later candidates are the failover targets.
+# LLM_ROUTES (JSON, same shape) overrides or adds routes.
+MODEL_ROUTES = {
+    # Batch summarization: the cheapest model, a larger one when it is throttled or slow
+    'bulk': [
+        {'model': 'gemini-2.5-flash-lite', 'max_input_tokens': 1000000, 'base_latency': 2.0, 'seconds_per_1k_tokens': 0.02},
+        {'model': 'gemini-2.5-flash', 'max_input_tokens': 1000000, 'base_latency': 4.0, 'seconds_per_1k_tokens': 0.04},
+    ],
+    # Interactive chat: the fast experimental model for small contexts, 2.5 models for large ones
+    'interactive': [
+        {'model': 'gemini-2.0-flash-exp', 'max_input_tokens': 32000, 'base_latency': 1.5, 'seconds_per_1k_tokens': 0.02},
+        {'model': 'gemini-2.5-flash', 'max_input_tokens': 1000000, 'base_latency': 3.0, 'seconds_per_1k_tokens': 0.03},
+        {'model': 'gemini-2.5-flash-lite', 'max_input_tokens': 1000000, 'base_latency': 2.0, 'seconds_per_1k_tokens': 0.02},
+    ],
+}
+MODEL_ROUTES.update(json.loads(os.environ.get('LLM_ROUTES', '{}')))
+HEDGE_WORKERS = int(os.environ.get('LLM_HEDGE_WORKERS', 16))
+EMBEDDING_MODEL = os.environ.get('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004')
+EMBED_BATCH_SIZE = 100  # texts per embedding request (the API maximum)
+
+
+###############################################################################
+# Rate limiting
+###############################################################################
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every Gemini call in the process. acquire() blocks
+    until a request may be sent; tokens refill continuously at `rate_per_minute` up to
+    `burst` (about 10 seconds of quota by default). A rate <= 0 disables limiting.
+    """
+    def __init__(self, rate_per_minute, burst=None):
+        self._lock = threading.Lock()
+        self.configure(rate_per_minute, burst)
+
+    def configure(self, rate_per_minute, burst=None):
+        with self._lock:
+            self.rate = rate_per_minute / 60.0 if rate_per_minute > 0 else None
+            self.capacity = float(burst or max(1, rate_per_minute // 6))
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = TokenBucket(DEFAULT_REQUESTS_PER_MINUTE)
+
+
+def configure_rate_limit(requests_per_minute, burst=None):
+    """Match the shared limiter to the Gemini quota (requests per minute)."""
+    rate_limiter.configure(requests_per_minute, burst)
+    logging.info(f"Gemini rate limit: {requests_per_minute} requests/minute")
+
+
+###############################################################################
+# Clients
+###############################################################################
+_config_lock = threading.Lock()
+_configured_key = None
+_models = {}
+_client = None
+
+
+def get_api_key():
+    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
+    gemini_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GEMINI_KEY")
+    if not gemini_key and llm_replay.LLM_MODE == 'replay':
+        return 'replay'
+    if not gemini_key:
+        raise ValueError("Gemini API key not found in environment variables. Set GEMINI_API_KEY or GEMINI_KEY.")
+    return gemini_key
+
+
+def _configure_sdk():
+    """Configure the SDK for the current API key (once per key)."""
+    global _configured_key
+    gemini_key = get_api_key()
+    if _configured_key == gemini_key:
+        return
+    with _config_lock:
+        if _configured_key != gemini_key:
+            if API_ENDPOINT:
+                genai.configure(api_key=gemini_key, transport='rest', client_options={'api_endpoint': API_ENDPOINT})
+            else:
+                genai.configure(api_key=gemini_key)
+            _configured_key = gemini_key
+            _models.clear()
+
+
+def get_model(model_name=DEFAULT_MODEL):
+    """Shared GenerativeModel for `model_name`, configuring the SDK on first use."""
+    _configure_sdk()
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _config_lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            _models[model_name] = model
+        return model
+
+
+def get_client():
+    """Shared google-genai Client (Interactions API)."""
+    global _client
+    if genai_client is None:
+        raise ImportError(
+            "Deep Research requires the 'google-genai' package. "
+            "Install it with: pip install google-genai"
+        )
+    if _client is None:
+        with _config_lock:
+            if _client is None:
+                _client = genai_client.Client(api_key=get_api_key())
+    return _client
+
+
+###############################################################################
+# Usage accounting
+###############################################################################
+_usage_lock = threading.Lock()
+_usage = {}
+
+
+def _record_usage(caller, model_name, latency, response=None, error=None):
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage_metadata, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(usage_metadata, 'candidates_token_count', 0) or 0
+    cached_tokens = getattr(usage_metadata, 'cached_content_token_count', 0) or 0
+
+    with _usage_lock:
+        entry = _usage.setdefault((caller, model_name), {
+            'calls': 0, 'errors': 0, 'latency': 0.0, 'max_latency': 0.0,
+            'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0,
+        })
+        entry['calls'] += 1
+        entry['latency'] += latency
+        entry['max_latency'] = max(entry['max_latency'], latency)
+        entry['prompt_tokens'] += prompt_tokens
+        entry['output_tokens'] += output_tokens
+        entry['cached_tokens'] += cached_tokens
+        if error is not None:
+            entry['errors'] += 1
+
+    if error is None:
+        logging.info(
+            f"LLM {caller} [{model_name}] {latency:.2f}s, "
+            f"{prompt_tokens} prompt ({cached_tokens} cached) / {output_tokens} output tokens"
+        )
+    else:
+        logging.warning(f"LLM {caller} [{model_name}] failed after {latency:.2f}s: {error}")
+
+
+def usage_summary():
+    """Copy of the accumulated usage as {(caller, model): {...}}."""
+    with _usage_lock:
+        return {key: dict(value) for key, value in _usage.items()}
+
+
+def log_usage_summary():
+    for (caller, model_name), entry in sorted(usage_summary().items()):
+        average = entry['latency'] / entry['calls'] if entry['calls'] else 0
+        logging.info(
+            f"{caller} [{model_name}]: {entry['calls']} calls, {entry['errors']} errors, "
+            f"avg {average:.2f}s / max {entry['max_latency']:.2f}s, "
+            f"{entry['prompt_tokens']} prompt ({entry['cached_tokens']} cached) / "
+            f"{entry['output_tokens']} output tokens"
+        )
+
+
+###############################################################################
+# Usage attribution
+###############################################################################
+_usage_scope = contextvars.ContextVar('llm_usage_scope', default={})
+_usage_sinks = []
+
+
+@contextmanager
+def usage_scope(**fields):
+    """
+    Attribute the model calls made inside the block to e.g. organization_id, topic_id or
+    endpoint. Nested scopes extend the outer one; None values are ignored.
+    """
+    scope = dict(_usage_scope.get())
+    scope.update({name: value for name, value in fields.items() if value is not None})
+    token = _usage_scope.set(scope)
+    try:
+        yield
+    finally:
+        _usage_scope.reset(token)
+
+
+def current_usage_scope():
+    return dict(_usage_scope.get())
+
+
+def submit_in_scope(executor, fn, *args, **kwargs):
+    """executor.submit() that carries the caller's usage scope into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def add_usage_sink(sink):
+    """Register sink(record), called once per model call (after retries) with its usage record."""
+    if sink not in _usage_sinks:
+        _usage_sinks.append(sink)
+
+
+def _emit_usage(caller, model_name, latency, attempts, response=None, error=None):
+    if not _usage_sinks:
+        return
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    record = dict(
+        current_usage_scope(),
+        caller=caller,
+        model=model_name,
+        latency=latency,
+        retries=max(0, attempts - 1),
+        success=error is None,
+        prompt_tokens=getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+        output_tokens=getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+        cached_tokens=getattr(usage_metadata, 'cached_content_token_count', 0) or 0,
+    )
+    for sink in _usage_sinks:
+        try:
+            sink(record)
+        except Exception as e:
+            logging.warning(f"LLM usage sink failed: {e}")
+
+
+###############################################################################
+# Context caching
+###############################################################################
+_context_cache_lock = threading.Lock()
+# (model, key) -> {'digest', 'cached_content' (None after a failed creation or while
+# 'creating'), 'creating', 'expires_at'}
+_context_caches = {}
+_cached_models = {}
+
+
+def _cache_model_name(model_name):
+    return model_name if model_name.startswith('models/') else f"models/{model_name}"
+
+
+def get_context_cache(context, model=DEFAULT_MODEL, ttl=DEFAULT_CONTEXT_TTL, key=None):
+    """
+    Provider-side cached content holding the prompt prefix `context` for `model`.
+
+    Entries are registered under `key` (e.g. the summary a chat context was built from) or,
+    without a key, under the hash of `context`, and are reused until `ttl` seconds have passed
+    or the context under a key changes (the superseded cache is then deleted). Returns None
+    when caching isn't available, the context is below CONTEXT_CACHE_MIN_TOKENS, creating the
+    cache failed, or another thread is still creating it. The provider call is made outside
+    the registry lock, so a slow creation only affects callers of the same entry.
+    """
+    if genai_caching is None or (len(context) + 3) // 4 < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    # Recordings are keyed by the full prompt, and stand-in endpoints have no cache API
+    if llm_replay.LLM_MODE != 'live' or API_ENDPOINT:
+        return None
+
+    digest = hashlib.sha256(context.encode('utf-8')).hexdigest()
+    registry_key = (model, key or digest)
+    now = time.monotonic()
+
+    with _context_cache_lock:
+        for stale_key in [k for k, entry in _context_caches.items() if entry['expires_at'] <= now]:
+            stale = _context_caches.pop(stale_key)
+            if stale['cached_content'] is not None:
+                _cached_models.pop(stale['cached_content'].name, None)
+
+        entry = _context_caches.get(registry_key)
+        if entry is not None and entry['digest'] == digest:
+            # While another thread creates it, this caller sends the context inline
+            return entry['cached_content']
+
+        superseded = entry['cached_content'] if entry is not None else None
+        if superseded is not None:
+            _cached_models.pop(superseded.name, None)
+        reservation = {'digest': digest, 'cached_content': None, 'creating': True, 'expires_at': float('inf')}
+        _context_caches[registry_key] = reservation
+
+    if superseded is not None:
+        try:
+            superseded.delete()
+            logging.info(f"Deleted superseded context cache {superseded.name} for {key or digest[:12]} [{model}]")
+        except Exception as e:
+            logging.warning(f"Could not delete superseded context cache {superseded.name}: {e}")
+
+    get_model(model)  # configures the SDK
+    try:
+        cached_content = genai_caching.CachedContent.create(
+            model=_cache_model_name(model),
+            display_name=f"{key or 'context'}-{digest[:12]}"[:128],
+            contents=[context],
+            ttl=timedelta(seconds=ttl),
+        )
+        # Expire locally a little before the provider does
+        expires_at = now + max(0, ttl - 60)
+        logging.info(f"Created context cache {cached_content.name} for {key or digest[:12]} [{model}]")
+    except Exception as e:
+        logging.warning(f"Context cache creation failed for {key or digest[:12]} [{model}], sending inline: {e}")
+        cached_content = None
+        expires_at = now + CONTEXT_CACHE_RETRY_SECONDS
+
+    with _context_cache_lock:
+        # A newer context under the same key may have replaced the reservation meanwhile
+        if _context_caches.get(registry_key) is reservation:
+            reservation.update(cached_content=cached_content, creating=False, expires_at=expires_at)
+    return cached_content
+
+
+def invalidate_context_cache(cached_content):
+    """Forget a cached content handle (e.g. after the provider reports it expired)."""
+    with _context_cache_lock:
+        for registry_key, entry in list(_context_caches.items()):
+            if entry['cached_content'] is cached_content:
+                del _context_caches[registry_key]
+        _cached_models.pop(cached_content.name, None)
+
+
+def _model_for_cached_content(cached_content):
+    with _context_cache_lock:
+        model = _cached_models.get(cached_content.name)
+    if model is None:
+        model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+        with _context_cache_lock:
+            model = _cached_models.setdefault(cached_content.name, model)
+    return model
+
+
+def is_stale_cache_error(error):
+    """The cached content referenced by a request no longer exists (expired or deleted)."""
+    if google_exceptions is None:
+        return False
+    return isinstance(error, (
+        google_exceptions.NotFound,
+        google_exceptions.PermissionDenied,
+        google_exceptions.FailedPrecondition,
+    ))
+
+
+###############################################################################
+# Generation
+###############################################################################
+def is_retryable_error(error):
+    """Throttling, server-side and timeout errors are retried; bad requests are not."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if google_exceptions is not None:
+        return isinstance(error, (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        ))
+    return False
+
+
+def generate(prompt, model=DEFAULT_MODEL, generation_config=None, safety_settings=None,
+             timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, caller="default",
+             context=None, context_key=None, context_ttl=DEFAULT_CONTEXT_TTL,
+             route=None, deadline=None, hedge_after=None):
+    """
+    Send `prompt` to Gemini and return the raw response.
+    Transient errors are retried up to `retries` attempts with exponential backoff.
+
+    `context` is a long prefix that stays the same across calls (instructions, organization
+    profile, topic context). It is sent as cached content (see get_context_cache) when
+    possible, and prepended to `prompt` otherwise.
+
+    With `route` (a key of MODEL_ROUTES) the model is picked per call instead of `model`:
+    by input size and `deadline` (seconds), failing over to the next candidate on throttling
+    and timeouts, and, with `hedge_after` (seconds), racing a second request on the next
+    candidate when the first hasn't answered by then.
+    """
+    def call(model_name, call_timeout, call_retries):
+        return _generate_with_model(
+            prompt, model_name, generation_config, safety_settings, call_timeout, call_retries,
+            caller, context, context_key, context_ttl
+        )
+
+    if route is None:
+        return call(model, timeout, retries)
+
+    input_tokens = (len(llm_replay.prompt_text(prompt)) + len(context or '') + 3) // 4
+    return _generate_routed(call, route, input_tokens, timeout, retries, caller, deadline, hedge_after)
+
+
+def _generate_with_model(prompt, model, generation_config, safety_settings, timeout, retries,
+                         caller, context, context_key, context_ttl):
+    kwargs = {'request_options': {'timeout': timeout}}
+    if generation_config is not None:
+        kwargs['generation_config'] = generation_config
+    if safety_settings is not None:
+        kwargs['safety_settings'] = safety_settings
+
+    if context:
+        cached_content = get_context_cache(context, model, context_ttl, context_key)
+        if cached_content is not None:
+            try:
+                return _generate(_model_for_cached_content(cached_content), model, prompt, kwargs, retries, caller)
+            except Exception as e:
+                if not is_stale_cache_error(e):
+                    raise
+                logging.warning(f"Context cache {cached_content.name} is gone, sending context inline: {e}")
+                invalidate_context_cache(cached_content)
+        prompt = context + prompt
+
+    if llm_replay.LLM_MODE == 'replay':
+        return _replay(prompt, model, caller)
+
+    return _generate(get_model(model), model, prompt, kwargs, retries, caller)
+
+
+###############################################################################
+# Routing, failover and hedging
+###############################################################################
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+
+
+def expected_latency(candidate, input_tokens):
+    return candidate['base_latency'] + candidate['seconds_per_1k_tokens'] * input_tokens / 1000
+
+
+def choose_models(route, input_tokens, deadline=None):
+    """
+    Candidates of `route` that can take `input_tokens`, in route order. With a deadline the
+    candidates expected to finish in time come first, the rest follow fastest first.
+    """
+    if route not in MODEL_ROUTES:
+        raise ValueError(f"Unknown model route: {route}")
+    candidates = [c for c in MODEL_ROUTES[route] if input_tokens <= c['max_input_tokens']]
+    if not candidates:
+        raise ValueError(f"Input of ~{input_tokens} tokens is too large for every model of route '{route}'")
+    if deadline is None:
+        return candidates
+    in_time = [c for c in candidates if expected_latency(c, input_tokens) <= deadline]
+    late = sorted((c for c in candidates if c not in in_time), key=lambda c: expected_latency(c, input_tokens))
+    return in_time + late
+
+
+def _generate_routed(call, route, input_tokens, timeout, retries, caller, deadline=None, hedge_after=None):
+    started = time.monotonic()
+    candidates = [c['model'] for c in choose_models(route, input_tokens, deadline)]
+    last_error = None
+
+    index = 0
+    while index < len(candidates):
+        model = candidates[index]
+        is_last = index == len(candidates) - 1
+        call_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0 and last_error is not None:
+                break
+            call_timeout = max(1, min(timeout, remaining))
+        # Only the last candidate waits out backoff; the others fail over on the first error
+        call_retries = retries if is_last else 1
+        next_index = index + 1
+
+        try:
+            if hedge_after is not None and not is_last:
+                return _generate_hedged(call, model, candidates[index + 1], call_timeout, hedge_after, caller)
+            return call(model, call_timeout, call_retries)
+        except HedgeFailed as e:
+            # The hedge was the next candidate; don't call it again
+            next_index = index + 2
+            error = e.primary_error
+            if next_index >= len(candidates) or not is_retryable_error(error):
+                raise error from e.hedge_error
+        except Exception as e:
+            error = e
+            if is_last or not is_retryable_error(error):
+                raise
+        logging.warning(f"LLM {caller}: {model} failed ({error}), failing over to {candidates[next_index]}")
+        last_error = error
+        index = next_index
+
+    raise last_error
+
+
+class HedgeFailed(Exception):
+    """Both the primary and the hedge request of a hedged call failed."""
+
+    def __init__(self, primary_error, hedge_error):
+        super().__init__(f"{primary_error}; hedge: {hedge_error}")
+        self.primary_error = primary_error
+        self.hedge_error = hedge_error
+
+
+def _generate_hedged(call, model, hedge_model, timeout, hedge_after, caller):
+    """
+    Run `model`; if it hasn't answered after `hedge_after` seconds, race `hedge_model` against
+    it. Raises HedgeFailed when both were sent and failed.
+    """
+    primary = submit_in_scope(_hedge_executor, call, model, timeout, 1)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    logging.info(f"LLM {caller}: {model} slower than {hedge_after}s, hedging with {hedge_model}")
+    hedge = submit_in_scope(_hedge_executor, call, hedge_model, timeout, 1)
+    pending = {primary, hedge}
+    errors = {}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                # The losing request can't be cancelled once sent; it finishes in the background
+                return future.result()
+            except Exception as e:
+                errors[future] = e
+    logging.warning(
+        f"LLM {caller}: {model} failed ({errors[primary]}) and so did hedge {hedge_model} ({errors[hedge]})"
+    )
+    raise HedgeFailed(errors[primary], errors[hedge])
+
+
+def _replay(prompt, model, caller):
+    start = time.perf_counter()
+    try:
+        response = llm_replay.replay_response(model, prompt)
+    except Exception as e:
+        _record_usage(caller, model, time.perf_counter() - start, error=e)
+        _emit_usage(caller, model, time.perf_counter() - start, 1, error=e)
+        raise
+    _record_usage(caller, model, time.perf_counter() - start, response)
+    _emit_usage(caller, model, time.perf_counter() - start, 1, response)
+    return response
+
+
+def _generate(model_instance, model, prompt, kwargs, retries, caller):
+    call_start = time.perf_counter()
+    attempts = 0
+    try:
+        for attempt in Retrying(
+            stop=stop_after_attempt(max(1, retries)),
+            wait=wait_exponential(multiplier=1, min=2, max=30),
+            retry=retry_if_exception(is_retryable_error),
+            reraise=True,
+        ):
+            with attempt:
+                attempts += 1
+                rate_limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    response = model_instance.generate_content(prompt, **kwargs)
+                except Exception as e:
+                    _record_usage(caller, model, time.perf_counter() - start, error=e)
+                    raise
+                latency = time.perf_counter() - start
+                _record_usage(caller, model, latency, response)
+    except Exception as e:
+        _emit_usage(caller, model, time.perf_counter() - call_start, attempts, error=e)
+        raise
+    _emit_usage(caller, model, time.perf_counter() - call_start, attempts, response)
+    if llm_replay.LLM_MODE == 'record':
+        llm_replay.record_response(model, prompt, response, latency, caller)
+    return response
+
+
+###############################################################################
+# Streaming
+###############################################################################
+def generate_stream(prompt, model=DEFAULT_MODEL, generation_config=None, safety_settings=None,
+                    timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, caller="default",
+                    context=None, context_key=None, context_ttl=DEFAULT_CONTEXT_TTL,
+                    route=None, deadline=None):
+    """
+    Like generate(), but yields the response text chunk by chunk as Gemini produces it.
+
+    Retries and route failover only happen before the first chunk; once text has been
+    yielded an error is raised to the caller. There is no hedging: a stream that has
+    started answering is already past the slow part.
+    """
+    if route is None:
+        candidates = [model]
+    else:
+        input_tokens = (len(llm_replay.prompt_text(prompt)) + len(context or '') + 3) // 4
+        candidates = [c['model'] for c in choose_models(route, input_tokens, deadline)]
+
+    for index, model_name in enumerate(candidates):
+        is_last = index == len(candidates) - 1
+        # As in _generate_routed, only the last candidate waits out backoff
+        attempts = max(1, retries) if is_last else 1
+        for attempt in range(1, attempts + 1):
+            started = False
+            try:
+                for text in _stream_with_model(prompt, model_name, generation_config, safety_settings,
+                                               timeout, caller, context, context_key, context_ttl):
+                    started = True
+                    yield text
+                return
+            except Exception as e:
+                if started or not is_retryable_error(e):
+                    raise
+                if attempt < attempts:
+                    time.sleep(min(30, 2 ** attempt))
+                    continue
+                if is_last:
+                    raise
+                logging.warning(f"LLM {caller}: {model_name} failed ({e}), failing over to {candidates[index + 1]}")
+
+
+def _stream_with_model(prompt, model, generation_config, safety_settings, timeout,
+                       caller, context, context_key, context_ttl):
+    kwargs = {'request_options': {'timeout': timeout}}
+    if generation_config is not None:
+        kwargs['generation_config'] = generation_config
+    if safety_settings is not None:
+        kwargs['safety_settings'] = safety_settings
+
+    if context:
+        cached_content = get_context_cache(context, model, context_ttl, context_key)
+        if cached_content is not None:
+            started = False
+            try:
+                for text in _stream(_model_for_cached_content(cached_content), model, prompt, kwargs, caller):
+                    started = True
+                    yield text
+                return
+            except Exception as e:
+                if started or not is_stale_cache_error(e):
+                    raise
+                logging.warning(f"Context cache {cached_content.name} is gone, sending context inline: {e}")
+                invalidate_context_cache(cached_content)
+        prompt = context + prompt
+
+    if llm_replay.LLM_MODE == 'replay':
+        text = response_text(_replay(prompt, model, caller))
+        if text:
+            yield text
+        return
+
+    yield from _stream(get_model(model), model, prompt, kwargs, caller)
+
+
+def _stream(model_instance, model, prompt, kwargs, caller):
+    rate_limiter.acquire()
+    start = time.perf_counter()
+    texts = []
+    last_chunk = None
+    try:
+        for chunk in model_instance.generate_content(prompt, stream=True, **kwargs):
+            # Usage metadata is complete on the last chunk
+            last_chunk = chunk
+            text = response_text(chunk)
+            if text:
+                texts.append(text)
+                yield text
+    except (Exception, GeneratorExit) as e:
+        # GeneratorExit: the consumer stopped reading (e.g. the client disconnected)
+        latency = time.perf_counter() - start
+        _record_usage(caller, model, latency, last_chunk, error=e if isinstance(e, Exception) else 'stream closed')
+        _emit_usage(caller, model, latency, 1, last_chunk, error=e)
+        raise
+
+    latency = time.perf_counter() - start
+    _record_usage(caller, model, latency, last_chunk)
+    _emit_usage(caller, model, latency, 1, last_chunk)
+    if llm_replay.LLM_MODE == 'record':
+        usage_metadata = getattr(last_chunk, 'usage_metadata', None)
+        llm_replay.record_response(model, prompt, llm_replay.fake_response(
+            ''.join(texts),
+            prompt_token_count=getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+            candidates_token_count=getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+        ), latency, caller)
+
+
+def embed(texts, model=EMBEDDING_MODEL, task_type='retrieval_document', timeout=DEFAULT_TIMEOUT,
+          retries=DEFAULT_RETRIES, caller="embed"):
+    """Embedding vectors (lists of floats) of `texts`, EMBED_BATCH_SIZE texts per request."""
+    if llm_replay.LLM_MODE == 'replay':
+        raise llm_replay.ReplayMissError("Embeddings are not recorded; use local embeddings in replay mode")
+
+    _configure_sdk()
+    vectors = []
+    for offset in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[offset:offset + EMBED_BATCH_SIZE]
+        call_start = time.perf_counter()
+        attempts = 0
+        try:
+            for attempt in Retrying(
+                stop=stop_after_attempt(max(1, retries)),
+                wait=wait_exponential(multiplier=1, min=2, max=30),
+                retry=retry_if_exception(is_retryable_error),
+                reraise=True,
+            ):
+                with attempt:
+                    attempts += 1
+                    rate_limiter.acquire()
+                    start = time.perf_counter()
+                    try:
+                        result = genai.embed_content(
+                            model=model, content=batch, task_type=task_type,
+                            request_options={'timeout': timeout}
+                        )
+                    except Exception as e:
+                        _record_usage(caller, model, time.perf_counter() - start, error=e)
+                        raise
+                    _record_usage(caller, model, time.perf_counter() - start)
+        except Exception as e:
+            _emit_usage(caller, model, time.perf_counter() - call_start, attempts, error=e)
+            raise
+        _emit_usage(caller, model, time.perf_counter() - call_start, attempts)
+        vectors.extend(result['embedding'])
+    return vectors
+
+
+def count_tokens(contents, model=DEFAULT_MODEL, timeout=DEFAULT_TIMEOUT, caller="count_tokens"):
+    """Exact token count of `contents` for `model` (one API call, paced by the rate limiter)."""
+    if llm_replay.LLM_MODE == 'replay':
+        return llm_replay.replay_token_count(model, contents)
+
+    model_instance = get_model(model)
+    rate_limiter.acquire()
+    start = time.perf_counter()
+    try:
+        response = model_instance.count_tokens(contents, request_options={'timeout': timeout})
+    except Exception as e:
+        _record_usage(caller, model, time.perf_counter() - start, error=e)
+        raise
+    _record_usage(caller, model, time.perf_counter() - start)
+    if llm_replay.LLM_MODE == 'record':
+        llm_replay.record_token_count(model, contents, response.total_tokens)
+    return response.total_tokens
+
+
+def response_text(response):
+    """Text of the first candidate, falling back to response.text; None if there is none."""
+    candidates = getattr(response, 'candidates', None)
+    if candidates:
+        content = getattr(candidates[0], 'content', None)
+        parts = getattr(content, 'parts', None)
+        if parts:
+            return parts[0].text
+    try:
+        return response.text
+    except (AttributeError, ValueError):
+        return None
+
+
+def generate_text(prompt, model=DEFAULT_MODEL, **kwargs):
+    """generate() returning the stripped response text."""
+    text = response_text(generate(prompt, model=model, **kwargs))
+    if text is None:
+        raise ValueError("Gemini API returned unexpected response format - no text found")
+    return text.strip()
+
+
+###############################################################################
+# Structured output
+###############################################################################
+class StructuredOutputError(ValueError):
+    """The model's response was not valid JSON; `text` holds the raw response."""
+    def __init__(self, message, text=None):
+        super().__init__(message)
+        self.text = text
+
+
+def json_generation_config(schema, **config):
+    """Generation config for Gemini's JSON mode constrained to `schema` (OpenAPI subset)."""
+    return dict(config, response_mime_type='application/json', response_schema=schema)
+
+
+def parse_json(text):
+    """
+    Parse a JSON-mode response with a single json.loads. Responses generated under a schema
+    don't need extraction or repair; anything that doesn't parse is a StructuredOutputError.
+    """
+    if not text:
+        raise StructuredOutputError("Gemini API returned an empty JSON response", text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(
+            f"Invalid JSON from Gemini at line {e.lineno}, column {e.colno}: {e.msg}", text
+        )
+
+
+def generate_json(prompt, schema, model=DEFAULT_MODEL, generation_config=None, **kwargs):
+    """generate() in JSON mode constrained to `schema`, returning the parsed object."""
+    config = json_generation_config(schema, **(generation_config or {}))
+    return parse_json(response_text(generate(prompt, model=model, generation_config=config, **kwargs)))
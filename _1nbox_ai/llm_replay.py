@@ -0,0 +1,172 @@
+"""
+Record/replay stand-in for Gemini, for deterministic offline pipeline runs.
+
+LLM_MODE selects how the gateway (llm.py) serves model calls:
+  - 'live' (default): call Gemini,
+  - 'record': call Gemini and save every prompt/response pair under LLM_RECORD_DIR,
+  - 'replay': serve saved responses without network access; a prompt that was never recorded
+    raises ReplayMissError. LLM_REPLAY_LATENCY is either 'recorded' (sleep as long as the
+    original call took) or a fixed number of seconds.
+
+Recordings are one JSON file per (model, prompt), so a recorded runnews/runclusternews run
+replays identically as long as the articles (and therefore the prompts) are the same. The
+`runfakegemini` command serves the same recordings over a Gemini-compatible HTTP endpoint
+for load tests (point the SDK at it with GEMINI_API_ENDPOINT).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from types import SimpleNamespace
+
+LLM_MODE = os.environ.get('LLM_MODE', 'live').lower()
+LLM_RECORD_DIR = os.environ.get('LLM_RECORD_DIR', 'llm_recordings')
+LLM_REPLAY_LATENCY = os.environ.get('LLM_REPLAY_LATENCY', 'recorded')
+
+MODES = ('live', 'record', 'replay')
+
+
+class ReplayMissError(LookupError):
+    """Replay mode found no recording for a prompt."""
+
+
+def prompt_text(prompt):
+    """Text a prompt is keyed by: strings as-is, anything else (contents lists) as JSON."""
+    if isinstance(prompt, str):
+        return prompt
+    return json.dumps(prompt, sort_keys=True, default=str)
+
+
+def recording_key(model, prompt, kind='generate'):
+    model = model[len('models/'):] if model.startswith('models/') else model
+    payload = json.dumps([kind, model, prompt_text(prompt)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def recording_path(key, record_dir=None):
+    return os.path.join(record_dir or LLM_RECORD_DIR, f"{key}.json")
+
+
+def load_recording(key, record_dir=None):
+    try:
+        with open(recording_path(key, record_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_recording(key, recording, record_dir=None):
+    record_dir = record_dir or LLM_RECORD_DIR
+    os.makedirs(record_dir, exist_ok=True)
+    # Write then rename so concurrent workers never read a partial file
+    path = recording_path(key, record_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(recording, f)
+    os.replace(tmp_path, path)
+
+
+def _finish_reason_name(finish_reason):
+    if finish_reason is None:
+        return None
+    return getattr(finish_reason, 'name', str(finish_reason))
+
+
+def record_response(model, prompt, response, latency, caller):
+    """Save a live generate_content response."""
+    candidates = getattr(response, 'candidates', None) or []
+    candidate = candidates[0] if candidates else None
+    parts = getattr(getattr(candidate, 'content', None), 'parts', None) or []
+    usage_metadata = getattr(response, 'usage_metadata', None)
+
+    save_recording(recording_key(model, prompt), {
+        'model': model,
+        'caller': caller,
+        'prompt': prompt_text(prompt),
+        'text': parts[0].text if parts else None,
+        'finish_reason': _finish_reason_name(getattr(candidate, 'finish_reason', None)),
+        'prompt_token_count': getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+        'candidates_token_count': getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+        'latency': latency,
+        'recorded_at': time.time(),
+    })
+
+
+def record_token_count(model, contents, total_tokens):
+    save_recording(recording_key(model, contents, 'count_tokens'), {
+        'model': model,
+        'total_tokens': total_tokens,
+    })
+
+
+def _sleep_like(recording):
+    if LLM_REPLAY_LATENCY == 'recorded':
+        delay = recording.get('latency') or 0
+    else:
+        delay = float(LLM_REPLAY_LATENCY)
+    if delay > 0:
+        time.sleep(delay)
+
+
+def fake_response(text, finish_reason='STOP', prompt_token_count=0, candidates_token_count=0):
+    """Object with the attributes the gateway and its callers read from a GenerateContentResponse."""
+    candidate = SimpleNamespace(
+        content=SimpleNamespace(parts=[SimpleNamespace(text=text)] if text is not None else []),
+        finish_reason=finish_reason,
+    )
+    return SimpleNamespace(
+        candidates=[candidate],
+        text=text,
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_token_count,
+            candidates_token_count=candidates_token_count,
+            cached_content_token_count=0,
+        ),
+    )
+
+
+def replay_response(model, prompt):
+    """Recorded response for (model, prompt), after the configured synthetic latency."""
+    key = recording_key(model, prompt)
+    recording = load_recording(key)
+    if recording is None:
+        raise ReplayMissError(f"No recording for {model} prompt {key[:12]} in {LLM_RECORD_DIR}")
+    _sleep_like(recording)
+    return fake_response(
+        recording.get('text'),
+        recording.get('finish_reason') or 'STOP',
+        recording.get('prompt_token_count', 0),
+        recording.get('candidates_token_count', 0),
+    )
+
+
+def replay_token_count(model, contents):
+    """Recorded token count, or the chars/4 estimate when the count was never recorded."""
+    recording = load_recording(recording_key(model, contents, 'count_tokens'))
+    if recording is not None:
+        return recording['total_tokens']
+    return (len(prompt_text(contents)) + 3) // 4
+
+
+def sample_from_schema(schema):
+    """Minimal value matching a response schema (OpenAPI subset), for unrecorded JSON-mode prompts."""
+    schema_type = str(schema.get('type', 'STRING')).upper()
+    if schema.get('enum'):
+        return schema['enum'][0]
+    if schema_type == 'OBJECT':
+        return {name: sample_from_schema(value) for name, value in schema.get('properties', {}).items()}
+    if schema_type == 'ARRAY':
+        return [sample_from_schema(schema.get('items', {}))]
+    if schema_type == 'INTEGER':
+        return 1
+    if schema_type == 'NUMBER':
+        return 0.5
+    if schema_type == 'BOOLEAN':
+        return True
+    return "Lorem ipsum dolor sit amet."
+
+
+if LLM_MODE not in MODES:
+    logging.warning(f"Unknown LLM_MODE '{LLM_MODE}', using 'live'")
+    LLM_MODE = 'live'
@@ -0,0 +1,84 @@
+"""
+Persist per-call LLM usage to the LLMUsage table.
+
+llm.py reports every model call (caller, model, tokens, latency, retries, outcome and the
+organization/topic/endpoint of the current llm.usage_scope()) to record_usage(). Records are
+buffered and bulk-inserted by a single background writer thread, so request and worker threads
+never wait on the database. Commands call flush() before they exit.
+"""
+import os
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+from . import llm
+
+LLM_USAGE_TRACKING = os.environ.get('LLM_USAGE_TRACKING', 'true').lower() == 'true'
+FLUSH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 10
+
+_lock = threading.Lock()
+_buffer = []
+_wake = threading.Event()
+_writer = None
+
+
+def record_usage(record):
+    """Usage sink registered with llm.add_usage_sink()."""
+    global _writer
+    with _lock:
+        _buffer.append(record)
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name='llm-usage-writer', daemon=True)
+            _writer.start()
+        if len(_buffer) >= FLUSH_SIZE:
+            _wake.set()
+
+
+def _writer_loop():
+    while True:
+        _wake.wait(FLUSH_INTERVAL_SECONDS)
+        _wake.clear()
+        flush()
+        close_old_connections()
+
+
+def flush():
+    """Write the buffered records; returns how many were written."""
+    from .models import LLMUsage
+
+    with _lock:
+        records = list(_buffer)
+        _buffer.clear()
+    if not records:
+        return 0
+
+    try:
+        LLMUsage.objects.bulk_create([
+            LLMUsage(
+                caller=str(record.get('caller', ''))[:64],
+                model=str(record.get('model', ''))[:64],
+                organization_id=record.get('organization_id'),
+                topic_id=record.get('topic_id'),
+                endpoint=str(record.get('endpoint', ''))[:255],
+                prompt_tokens=record.get('prompt_tokens', 0),
+                output_tokens=record.get('output_tokens', 0),
+                cached_tokens=record.get('cached_tokens', 0),
+                latency_ms=int(record.get('latency', 0) * 1000),
+                retries=record.get('retries', 0),
+                success=record.get('success', True),
+            )
+            for record in records
+        ])
+    except Exception as e:
+        logging.error(f"Failed to store {len(records)} LLM usage records: {str(e)}")
+        return 0
+    return len(records)
+
+
+def enable():
+    """Start recording usage (called from the app config when LLM_USAGE_TRACKING is on)."""
+    llm.add_usage_sink(record_usage)
+    atexit.register(flush)
@@ -1,23 +1,29 @@
 from django.core.management.base import BaseCommand
 from ...news import (
     get_articles_from_rss,
-    extract_significant_words,
-    sort_words_by_rarity,
-    cluster_articles,
-    merge_clusters,
-    apply_minimum_articles_and_reassign,
-    merge_clusters_by_percentage,
-    get_openai_response,
+    select_recent_articles,
+    collect_articles_within_budget,
+    llm_cluster_view,
+    DEFAULT_MAX_ARTICLES,
+    run_clustering_pipeline,
+    run_online_clustering,
+    summarize_clusters,
+    cleanup_cluster_summary_cache,
+    DEFAULT_SUMMARY_WORKERS,
     get_final_summary,
+    assign_cluster_ids,
     calculate_cluster_difference,
+    reusable_cluster_summaries,
     calculate_summary_difference,
     clean_clusters_for_storage,
-    parse_json_with_repair
 )
 from ...models import Topic, Organization, Summary
+from ...llm import configure_rate_limit, log_usage_summary, usage_scope, DEFAULT_REQUESTS_PER_MINUTE
+from ...llm_usage import flush as flush_llm_usage
+from ...chat_context import warm_chat_context
+from ...retrieval import update_topic_index
 import traceback
 import logging
-from collections import Counter
 from datetime import datetime, timedelta
 import pytz
 import json
@@ -46,6 +52,13 @@ class Command(BaseCommand):
         parser.add_argument('--sentences_final_summary', type=int, default=3, help='Amount of sentences per topic in the final summary')
         parser.add_argument('--title_only', action='store_true', help='If set, clustering will only use article titles')
         parser.add_argument('--all_words', action='store_true', help='If set, clustering will include all words, not just capitalized ones')
+        parser.add_argument('--clustering_mode', choices=['greedy', 'density'], default='greedy', help="Clustering engine: 'greedy' common-word matching or 'density' TF-IDF + HDBSCAN")
+        parser.add_argument('--online', action='store_true', help='If set, keep cluster state per topic and only assign new articles each run (incremental clustering)')
+        parser.add_argument('--max_articles', type=int, default=DEFAULT_MAX_ARTICLES, help='Maximum number of (most recent) articles clustered per topic')
+        parser.add_argument('--large_topic', action='store_true', help='Lift the article cap: stream articles within a memory budget and cluster them with the density engine')
+        parser.add_argument('--memory_budget_mb', type=int, default=256, help='Approximate memory budget for collected articles in --large_topic mode')
+        parser.add_argument('--summary_workers', type=int, default=DEFAULT_SUMMARY_WORKERS, help='Maximum number of cluster summaries generated concurrently')
+        parser.add_argument('--requests_per_minute', type=int, default=DEFAULT_REQUESTS_PER_MINUTE, help='Gemini request rate limit shared by all summary workers (0 disables)')
         parser.add_argument('--cleanup', action='store_true', help='If set, will cleanup old summaries (30+ days)')
 
     def handle(self, *args, **options):
@@ -57,6 +70,8 @@ class Command(BaseCommand):
                 self.cleanup_old_summaries()
             
             # Process all topics
+            configure_rate_limit(options['requests_per_minute'])
+            
             self.process_all_topics(
                 days_back=options['days'],
                 common_word_threshold=options['common_word_threshold'],
@@ -67,9 +82,17 @@ class Command(BaseCommand):
                 final_merge_percentage=options['final_merge_percentage'],
                 sentences_final_summary=options['sentences_final_summary'],
                 title_only=options['title_only'],
-                all_words=options['all_words']
+                all_words=options['all_words'],
+                clustering_mode=options['clustering_mode'],
+                online=options['online'],
+                max_articles=options['max_articles'],
+                large_topic=options['large_topic'],
+                memory_budget_mb=options['memory_budget_mb'],
+                summary_workers=options['summary_workers']
             )
             
+            log_usage_summary()
+            flush_llm_usage()
             self.stdout.write(self.style.SUCCESS('Cluster news processing completed successfully.'))
         except Exception as e:
             self.stderr.write(self.style.ERROR('Error during cluster news processing:'))
@@ -90,12 +113,17 @@ class Command(BaseCommand):
         else:
             logging.info("No old summaries to delete")
         
+        # Cached cluster summaries only matter while their articles are inside the window
+        cleanup_cluster_summary_cache(days=3)
+        
         logging.info("==== Finished cleanup ====")
 
     def process_all_topics(self, days_back=1, common_word_threshold=2, top_words_to_consider=3,
                           merge_threshold=2, min_articles=3, join_percentage=0.5,
                           final_merge_percentage=0.5, sentences_final_summary=3, 
-                          title_only=False, all_words=False):
+                          title_only=False, all_words=False, clustering_mode='greedy', online=False,
+                          max_articles=DEFAULT_MAX_ARTICLES, large_topic=False, memory_budget_mb=256,
+                          summary_workers=DEFAULT_SUMMARY_WORKERS):
         
         logging.info("==== Starting process_all_topics ====")
         
@@ -107,19 +135,26 @@ class Command(BaseCommand):
             
             for topic in organization.topics.all():
                 try:
-                    self.process_topic(
-                        topic, 
-                        days_back, 
-                        common_word_threshold, 
-                        top_words_to_consider,
-                        merge_threshold, 
-                        min_articles, 
-                        join_percentage,
-                        final_merge_percentage, 
-                        sentences_final_summary, 
-                        title_only, 
-                        all_words
-                    )
+                    with usage_scope(organization_id=organization.id, topic_id=topic.id):
+                        self.process_topic(
+                            topic, 
+                            days_back, 
+                            common_word_threshold, 
+                            top_words_to_consider,
+                            merge_threshold, 
+                            min_articles, 
+                            join_percentage,
+                            final_merge_percentage, 
+                            sentences_final_summary, 
+                            title_only, 
+                            all_words,
+                            clustering_mode,
+                            online,
+                            max_articles,
+                            large_topic,
+                            memory_budget_mb,
+                            summary_workers
+                        )
                 except Exception as e:
                     logging.error(f"❌ Failed to process topic {topic.name}: {str(e)}")
                     logging.error(traceback.format_exc())
@@ -130,7 +165,9 @@ class Command(BaseCommand):
     def process_topic(self, topic, days_back=1, common_word_threshold=2, top_words_to_consider=3,
                      merge_threshold=2, min_articles=3, join_percentage=0.5,
                      final_merge_percentage=0.5, sentences_final_summary=3, 
-                     title_only=False, all_words=False):
+                     title_only=False, all_words=False, clustering_mode='greedy', online=False,
+                     max_articles=DEFAULT_MAX_ARTICLES, large_topic=False, memory_budget_mb=256,
+                     summary_workers=DEFAULT_SUMMARY_WORKERS):
         
         try:
             logging.info(f"📰 Starting processing for topic: {topic.name}")
@@ -141,78 +178,69 @@ class Command(BaseCommand):
                 return
             
             # Step 1: Fetch articles from RSS (last 24 hours)
-            all_articles = []
-            failed_sources = []
-            successful_sources = []
-            
-            for url in topic.sources:
-                try:
-                    articles = get_articles_from_rss(url, days_back)
-                    if articles:
-                        all_articles.extend(articles)
-                        successful_sources.append(url)
-                        logging.info(f"✅ Retrieved {len(articles)} articles from {url}")
-                    else:
-                        failed_sources.append((url, "No articles retrieved"))
-                except Exception as e:
-                    logging.error(f"❌ Error fetching RSS from {url}: {str(e)}")
-                    failed_sources.append((url, str(e)))
-                    continue
+            if large_topic:
+                # Memory-bounded streaming collection of compact records; no article cap
+                all_articles, collection_stats = collect_articles_within_budget(
+                    topic.sources, days_back, memory_budget_mb
+                )
+                if clustering_mode == 'greedy' and not online:
+                    logging.info("Large-topic mode: using density clustering instead of greedy matching")
+                    clustering_mode = 'density'
+            else:
+                all_articles = []
+                failed_sources = []
+                successful_sources = []
+                
+                for url in topic.sources:
+                    try:
+                        articles = get_articles_from_rss(url, days_back)
+                        if articles:
+                            all_articles.extend(articles)
+                            successful_sources.append(url)
+                            logging.info(f"✅ Retrieved {len(articles)} articles from {url}")
+                        else:
+                            failed_sources.append((url, "No articles retrieved"))
+                    except Exception as e:
+                        logging.error(f"❌ Error fetching RSS from {url}: {str(e)}")
+                        failed_sources.append((url, str(e)))
+                        continue
             
             if not all_articles:
                 logging.warning(f"No articles found for topic {topic.name}, skipping")
                 return
             
-            # Cap articles at 777
-            all_articles = all_articles[:777]
+            if not large_topic:
+                # Keep the most recent articles rather than whichever feeds were listed first
+                all_articles = select_recent_articles(all_articles, max_articles)
             number_of_articles = len(all_articles)
             logging.info(f"📊 Total articles collected: {number_of_articles}")
             
-            # Step 2: Extract significant words
-            word_counts = Counter()
-            for article in all_articles:
-                try:
-                    if title_only:
-                        article['significant_words'] = extract_significant_words(
-                            article['title'], title_only=True, all_words=all_words
-                        )
-                    else:
-                        title_words = extract_significant_words(
-                            article['title'], title_only=False, all_words=all_words
-                        )
-                        content_words = extract_significant_words(
-                            article['content'], title_only=False, all_words=all_words
-                        )
-                        article['significant_words'] = title_words + [
-                            w for w in content_words if w not in title_words
-                        ]
-                    word_counts.update(article['significant_words'])
-                except Exception as e:
-                    logging.error(f"Error extracting words: {str(e)}")
-                    continue
-            
-            # Sort words by rarity
-            for article in all_articles:
-                try:
-                    article['significant_words'] = sort_words_by_rarity(
-                        article['significant_words'], word_counts
-                    )
-                except Exception as e:
-                    logging.error(f"Error sorting words: {str(e)}")
-                    continue
-            
-            # Step 3: Cluster articles
+            # Step 2 + 3: Extract significant words and cluster articles
             try:
-                clusters = cluster_articles(
-                    all_articles, common_word_threshold, top_words_to_consider, title_only
-                )
-                merged_clusters = merge_clusters(clusters, merge_threshold)
-                clusters_with_min_articles = apply_minimum_articles_and_reassign(
-                    merged_clusters, min_articles, join_percentage
-                )
-                final_clusters = merge_clusters_by_percentage(
-                    clusters_with_min_articles, final_merge_percentage
-                )
+                if online:
+                    final_clusters = run_online_clustering(
+                        topic,
+                        all_articles,
+                        days_back,
+                        common_word_threshold,
+                        top_words_to_consider,
+                        min_articles,
+                        title_only,
+                        all_words
+                    )
+                else:
+                    final_clusters = run_clustering_pipeline(
+                        all_articles,
+                        common_word_threshold,
+                        top_words_to_consider,
+                        merge_threshold,
+                        min_articles,
+                        join_percentage,
+                        final_merge_percentage,
+                        title_only,
+                        all_words,
+                        clustering_mode
+                    )
                 
                 logging.info(f"🔗 Generated {len(final_clusters)} clusters for topic {topic.name}")
                 
@@ -225,27 +253,41 @@ class Command(BaseCommand):
                 topic,
                 final_clusters,
                 number_of_articles,
-                sentences_final_summary
+                sentences_final_summary,
+                large_topic,
+                summary_workers
             )
             
         except Exception as e:
             logging.error(f"Critical error processing topic {topic.name}: {str(e)}")
             logging.error(traceback.format_exc())
 
-    def conditionally_generate_summaries(self, topic, current_clusters, number_of_articles, sentences_final_summary):
+    def conditionally_generate_summaries(self, topic, current_clusters, number_of_articles, sentences_final_summary,
+                                         large_topic=False, summary_workers=DEFAULT_SUMMARY_WORKERS):
         """
         Check if clusters changed >40%, generate cluster summaries if needed.
         Then check if cluster summaries changed >40%, generate final summary if needed.
+        In large-topic mode only a bounded, relevance/recency-ranked subset of each cluster is summarized.
+        Cluster summaries are generated concurrently (up to summary_workers) in cluster order.
         """
         try:
             # Get the last Summary record for comparison
             last_summary = Summary.objects.filter(topic=topic).order_by('-created_at').first()
             
+            # Give clusters stable ids by article overlap: match against the previous run first,
+            # falling back to the last saved summary
+            if isinstance(topic.current_clusters, list) and topic.current_clusters:
+                registry_clusters = topic.current_clusters
+            else:
+                registry_clusters = last_summary.clusters if last_summary and last_summary.clusters else []
+            assign_cluster_ids(current_clusters, registry_clusters)
+            
             # If no previous summary, generate everything
             if not last_summary:
                 logging.info(f"No previous summary found for {topic.name}, generating new summary")
                 self.generate_and_save_full_summary(
-                    topic, current_clusters, number_of_articles, sentences_final_summary
+                    topic, current_clusters, number_of_articles, sentences_final_summary, large_topic,
+                    summary_workers
                 )
                 return
             
@@ -266,16 +308,20 @@ class Command(BaseCommand):
             # Clusters changed enough, generate new cluster summaries
             logging.info(f"✅ Clusters changed >40%, generating new cluster summaries")
             
-            new_cluster_summaries = []
+            # Stories whose membership barely changed keep their previous summary
+            reusable = reusable_cluster_summaries(
+                current_clusters, previous_clusters, last_summary.cluster_summaries
+            )
+            
             for i, cluster in enumerate(current_clusters):
-                try:
-                    logging.info(f"Summarizing cluster {i+1}/{len(current_clusters)}: {', '.join(cluster['common_words'])}")
-                    summary_text = get_openai_response(cluster)
-                    new_cluster_summaries.append(summary_text)
-                except Exception as e:
-                    logging.error(f"Error summarizing cluster: {str(e)}")
-                    # Use a placeholder
-                    new_cluster_summaries.append(f"Error generating summary for cluster: {', '.join(cluster['common_words'])}")
+                if reusable[i]:
+                    logging.info(f"♻️  Reusing summary for cluster {i+1}/{len(current_clusters)} ({cluster['cluster_id']})")
+            
+            new_cluster_summaries = summarize_clusters(
+                [llm_cluster_view(cluster) for cluster in current_clusters] if large_topic else current_clusters,
+                max_workers=summary_workers,
+                precomputed=reusable
+            )
             
             # Check if cluster summaries changed enough for new final summary
             previous_cluster_summaries = last_summary.cluster_summaries if last_summary.cluster_summaries else []
@@ -293,16 +339,13 @@ class Command(BaseCommand):
             logging.info(f"✅ Cluster summaries changed >40%, generating new final summary")
             
             try:
-                final_summary_json = get_final_summary(
+                final_summary_data = get_final_summary(
                     new_cluster_summaries,
                     sentences_final_summary,
                     topic.prompt if topic.prompt else None,
                     topic.organization.description if topic.organization.description else ""
                 )
                 
-                # Parse JSON with repair logic
-                final_summary_data = parse_json_with_repair(final_summary_json)
-                
                 logging.info(f"✅ Successfully generated final summary")
                 
             except Exception as e:
@@ -333,6 +376,8 @@ class Command(BaseCommand):
                 # Update topic's current_clusters
                 topic.current_clusters = cleaned_clusters
                 topic.save(update_fields=['current_clusters'])
+                warm_chat_context(new_summary, topic)
+                update_topic_index(topic, new_summary)
                 
                 logging.info(f"💾 Successfully saved new summary for topic {topic.name} (ID: {new_summary.id})")
                 
@@ -343,30 +388,24 @@ class Command(BaseCommand):
             logging.error(f"Error in conditionally_generate_summaries: {str(e)}")
             logging.error(traceback.format_exc())
 
-    def generate_and_save_full_summary(self, topic, clusters, number_of_articles, sentences_final_summary):
+    def generate_and_save_full_summary(self, topic, clusters, number_of_articles, sentences_final_summary,
+                                       large_topic=False, summary_workers=DEFAULT_SUMMARY_WORKERS):
         """Generate both cluster summaries and final summary (for first run)"""
         try:
-            # Generate cluster summaries
-            cluster_summaries = []
-            for i, cluster in enumerate(clusters):
-                try:
-                    logging.info(f"Summarizing cluster {i+1}/{len(clusters)}: {', '.join(cluster['common_words'])}")
-                    summary_text = get_openai_response(cluster)
-                    cluster_summaries.append(summary_text)
-                except Exception as e:
-                    logging.error(f"Error summarizing cluster: {str(e)}")
-                    cluster_summaries.append(f"Error generating summary for cluster: {', '.join(cluster['common_words'])}")
+            # Generate cluster summaries concurrently, in cluster order
+            cluster_summaries = summarize_clusters(
+                [llm_cluster_view(cluster) for cluster in clusters] if large_topic else clusters,
+                max_workers=summary_workers
+            )
             
             # Generate final summary
             try:
-                final_summary_json = get_final_summary(
+                final_summary_data = get_final_summary(
                     cluster_summaries,
                     sentences_final_summary,
                     topic.prompt if topic.prompt else None,
                     topic.organization.description if topic.organization.description else ""
                 )
-                
-                final_summary_data = parse_json_with_repair(final_summary_json)
                 logging.info(f"✅ Successfully generated final summary")
                 
             except Exception as e:
@@ -395,6 +434,8 @@ class Command(BaseCommand):
             # Update topic's current_clusters
             topic.current_clusters = cleaned_clusters
             topic.save(update_fields=['current_clusters'])
+            warm_chat_context(new_summary, topic)
+            update_topic_index(topic, new_summary)
             
             logging.info(f"💾 Successfully saved first summary for topic {topic.name} (ID: {new_summary.id})")
             
@@ -0,0 +1,229 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...news import (
+    get_articles_from_rss,
+    select_recent_articles,
+    run_clustering_pipeline,
+    is_miscellaneous_cluster,
+    DEFAULT_MAX_ARTICLES
+)
+from ...models import Topic
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import itertools
+import statistics
+import traceback
+import logging
+import time
+import json
+import os
+
+# Parameters that can be swept, with the type used to parse their comma-separated values
+SWEEP_PARAMETERS = [
+    ('common_word_threshold', int),
+    ('top_words_to_consider', int),
+    ('merge_threshold', int),
+    ('min_articles', int),
+    ('join_percentage', float),
+    ('final_merge_percentage', float),
+    ('clustering_mode', str),
+]
+
+# Corpus shared by the pool workers; loaded once per worker by the initializer
+_corpus = None
+
+
+def _init_worker(corpus_path):
+    global _corpus
+    logging.disable(logging.INFO)
+    _corpus = load_corpus(corpus_path)['articles']
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    if isinstance(corpus, list):
+        corpus = {'articles': corpus}
+    if not corpus.get('articles'):
+        raise ValueError(f"Corpus {path} contains no articles")
+    return corpus
+
+
+def parse_values(raw, cast):
+    return [cast(value.strip()) for value in str(raw).split(',') if value.strip()]
+
+
+def evaluate_setting(params, title_only=False, all_words=False, repeat=1):
+    """Run the clustering pipeline on the worker's corpus and measure the result."""
+    runtimes = []
+    clusters = []
+    for _ in range(repeat):
+        # Fresh article dicts so word extraction from a previous run can't leak into this one
+        articles = [dict(article) for article in _corpus]
+        start = time.perf_counter()
+        clusters = run_clustering_pipeline(
+            articles,
+            params['common_word_threshold'],
+            params['top_words_to_consider'],
+            params['merge_threshold'],
+            params['min_articles'],
+            params['join_percentage'],
+            params['final_merge_percentage'],
+            title_only,
+            all_words,
+            params['clustering_mode']
+        )
+        runtimes.append(time.perf_counter() - start)
+
+    total = len(_corpus)
+    sizes = sorted(
+        (len(cluster['articles']) for cluster in clusters if not is_miscellaneous_cluster(cluster)),
+        reverse=True
+    )
+    miscellaneous = sum(len(cluster['articles']) for cluster in clusters if is_miscellaneous_cluster(cluster))
+
+    return {
+        'params': params,
+        'runtime': statistics.median(runtimes),
+        'clusters': len(sizes),
+        'misc_share': miscellaneous / total if total else 0.0,
+        'largest_share': sizes[0] / total if sizes and total else 0.0,
+        'size_min': sizes[-1] if sizes else 0,
+        'size_median': statistics.median(sizes) if sizes else 0,
+        'size_max': sizes[0] if sizes else 0,
+        'sizes': sizes,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Sweep clustering parameters over a recorded article corpus and report speed and cluster quality'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', required=True, help='Path of the recorded corpus JSON file')
+        parser.add_argument('--record', action='store_true', help='Fetch the articles of --topic_id and save them to --corpus instead of sweeping')
+        parser.add_argument('--topic_id', type=int, help='Topic whose sources are recorded (with --record)')
+        parser.add_argument('--days', type=int, default=1, help='Number of days to look back when recording')
+        parser.add_argument('--max_articles', type=int, default=DEFAULT_MAX_ARTICLES, help='Maximum number of (most recent) articles recorded')
+        parser.add_argument('--common_word_threshold', default='2', help='Comma-separated values to sweep')
+        parser.add_argument('--top_words_to_consider', default='3', help='Comma-separated values to sweep')
+        parser.add_argument('--merge_threshold', default='2', help='Comma-separated values to sweep')
+        parser.add_argument('--min_articles', default='3', help='Comma-separated values to sweep')
+        parser.add_argument('--join_percentage', default='0.5', help='Comma-separated values to sweep')
+        parser.add_argument('--final_merge_percentage', default='0.5', help='Comma-separated values to sweep')
+        parser.add_argument('--clustering_mode', default='greedy', help="Comma-separated values to sweep ('greedy', 'density')")
+        parser.add_argument('--title_only', action='store_true', help='If set, clustering will only use article titles')
+        parser.add_argument('--all_words', action='store_true', help='If set, clustering will include all words, not just capitalized ones')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per setting; the median runtime is reported')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+        parser.add_argument('--sort', choices=['runtime', 'misc_share', 'clusters'], default='misc_share', help='Column used to order the report')
+        parser.add_argument('--output', help='Optional path to write the full results as JSON')
+
+    def handle(self, *args, **options):
+        if options['record']:
+            self.record_corpus(options)
+            return
+
+        try:
+            corpus = load_corpus(options['corpus'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load corpus: {e}")
+
+        grid_values = []
+        for name, cast in SWEEP_PARAMETERS:
+            try:
+                values = parse_values(options[name], cast)
+            except ValueError:
+                raise CommandError(f"Invalid value list for --{name}: {options[name]}")
+            if not values:
+                raise CommandError(f"--{name} needs at least one value")
+            grid_values.append(values)
+
+        for mode in parse_values(options['clustering_mode'], str):
+            if mode not in ('greedy', 'density'):
+                raise CommandError(f"Unknown clustering mode: {mode}")
+
+        names = [name for name, _ in SWEEP_PARAMETERS]
+        grid = [dict(zip(names, combination)) for combination in itertools.product(*grid_values)]
+
+        self.stdout.write(
+            f"Sweeping {len(grid)} settings over {len(corpus['articles'])} articles "
+            f"with {options['workers']} workers..."
+        )
+
+        results = []
+        with ProcessPoolExecutor(
+            max_workers=max(1, options['workers']),
+            initializer=_init_worker,
+            initargs=(options['corpus'],)
+        ) as executor:
+            futures = {
+                executor.submit(evaluate_setting, params, options['title_only'], options['all_words'], max(1, options['repeat'])): params
+                for params in grid
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Setting {futures[future]} failed: {e}"))
+                    self.stderr.write(self.style.ERROR(traceback.format_exc()))
+
+        results.sort(key=lambda result: result[options['sort']])
+        self.print_report(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'corpus': options['corpus'],
+                    'articles': len(corpus['articles']),
+                    'title_only': options['title_only'],
+                    'all_words': options['all_words'],
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def print_report(self, results):
+        header = (
+            f"{'cwt':>4} {'top':>4} {'mrg':>4} {'min':>4} {'join':>5} {'fmrg':>5} {'mode':>8} | "
+            f"{'time(s)':>8} {'clusters':>8} {'misc%':>6} {'top%':>6} {'min/med/max':>14}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            p = result['params']
+            distribution = f"{result['size_min']}/{result['size_median']:g}/{result['size_max']}"
+            self.stdout.write(
+                f"{p['common_word_threshold']:>4} {p['top_words_to_consider']:>4} {p['merge_threshold']:>4} "
+                f"{p['min_articles']:>4} {p['join_percentage']:>5} {p['final_merge_percentage']:>5} "
+                f"{p['clustering_mode']:>8} | {result['runtime']:>8.2f} {result['clusters']:>8} "
+                f"{result['misc_share']:>6.1%} {result['largest_share']:>6.1%} {distribution:>14}"
+            )
+
+    def record_corpus(self, options):
+        if not options['topic_id']:
+            raise CommandError("--record requires --topic_id")
+        try:
+            topic = Topic.objects.get(id=options['topic_id'])
+        except Topic.DoesNotExist:
+            raise CommandError(f"Topic {options['topic_id']} not found")
+
+        all_articles = []
+        for url in topic.sources:
+            try:
+                articles = get_articles_from_rss(url, options['days'])
+                all_articles.extend(articles or [])
+                self.stdout.write(f"Retrieved {len(articles or [])} articles from {url}")
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Error fetching RSS from {url}: {e}"))
+
+        all_articles = select_recent_articles(all_articles, options['max_articles'])
+        for article in all_articles:
+            article.pop('significant_words', None)
+
+        with open(options['corpus'], 'w', encoding='utf-8') as f:
+            json.dump({
+                'topic': topic.name,
+                'recorded_at': datetime.utcnow().isoformat(),
+                'days_back': options['days'],
+                'articles': all_articles,
+            }, f)
+
+        self.stdout.write(self.style.SUCCESS(f"Recorded {len(all_articles)} articles to {options['corpus']}"))
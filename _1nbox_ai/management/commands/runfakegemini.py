@@ -0,0 +1,150 @@
+from django.core.management.base import BaseCommand
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ...llm_replay import (
+    LLM_RECORD_DIR,
+    recording_key,
+    load_recording,
+    sample_from_schema,
+)
+import threading
+import random
+import json
+import time
+import re
+
+# POST /v1beta/models/<model>:generateContent (or :countTokens)
+ROUTE = re.compile(r'^/v1(?:beta)?/models/(?P<model>[^/:]+):(?P<method>generateContent|countTokens)$')
+
+
+def request_prompt(body):
+    """Prompt text of a REST request, matching how llm_replay keys SDK prompts."""
+    contents = body.get('contents') or body.get('generateContentRequest', {}).get('contents') or []
+    texts = [part.get('text', '') for content in contents for part in content.get('parts', [])]
+    if len(texts) == 1:
+        return texts[0]
+    return contents
+
+
+class Command(BaseCommand):
+    help = 'Serve recorded (or synthetic) Gemini responses over a local Gemini-compatible HTTP endpoint for load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+        parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+        parser.add_argument('--record_dir', default=LLM_RECORD_DIR, help='Directory of recordings made with LLM_MODE=record')
+        parser.add_argument('--latency', default='recorded', help="Response delay in seconds, or 'recorded' to replay the original latency")
+        parser.add_argument('--jitter', type=float, default=0.0, help='Random extra delay of up to this many seconds')
+        parser.add_argument('--error_rate', type=float, default=0.0, help='Share of requests answered with 429 to exercise retries')
+        parser.add_argument('--strict', action='store_true', help='Answer unrecorded prompts with 404 instead of synthetic text')
+
+    def handle(self, *args, **options):
+        stats = {'requests': 0, 'recorded': 0, 'synthetic': 0, 'errors': 0}
+        stats_lock = threading.Lock()
+        command = self
+
+        def count(field):
+            with stats_lock:
+                stats['requests'] += 1
+                stats[field] += 1
+
+        def delay_for(recording):
+            if options['latency'] == 'recorded':
+                delay = (recording or {}).get('latency') or 0
+            else:
+                delay = float(options['latency'])
+            return delay + random.uniform(0, options['jitter'])
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                match = ROUTE.match(self.path.split('?', 1)[0])
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except json.JSONDecodeError:
+                    self.send_json(400, {'error': {'code': 400, 'message': 'Invalid JSON body', 'status': 'INVALID_ARGUMENT'}})
+                    return
+                if not match:
+                    self.send_json(404, {'error': {'code': 404, 'message': f'Unknown path {self.path}', 'status': 'NOT_FOUND'}})
+                    return
+
+                if random.random() < options['error_rate']:
+                    count('errors')
+                    self.send_json(429, {'error': {'code': 429, 'message': 'Synthetic rate limit', 'status': 'RESOURCE_EXHAUSTED'}})
+                    return
+
+                model, method = match.group('model'), match.group('method')
+                prompt = request_prompt(body)
+
+                if method == 'countTokens':
+                    recording = load_recording(recording_key(model, prompt, 'count_tokens'), options['record_dir'])
+                    total = recording['total_tokens'] if recording else (len(json.dumps(prompt)) + 3) // 4
+                    count('recorded' if recording else 'synthetic')
+                    self.send_json(200, {'totalTokens': total})
+                    return
+
+                recording = load_recording(recording_key(model, prompt), options['record_dir'])
+                if recording is None and options['strict']:
+                    count('errors')
+                    self.send_json(404, {'error': {'code': 404, 'message': 'No recording for prompt', 'status': 'NOT_FOUND'}})
+                    return
+
+                if recording is not None:
+                    text = recording.get('text') or ''
+                    finish_reason = recording.get('finish_reason') or 'STOP'
+                    usage = {
+                        'promptTokenCount': recording.get('prompt_token_count', 0),
+                        'candidatesTokenCount': recording.get('candidates_token_count', 0),
+                    }
+                    count('recorded')
+                else:
+                    generation_config = body.get('generationConfig') or {}
+                    if generation_config.get('responseSchema'):
+                        text = json.dumps(sample_from_schema(generation_config['responseSchema']))
+                    else:
+                        text = "Synthetic response from runfakegemini."
+                    finish_reason = 'STOP'
+                    usage = {'promptTokenCount': (len(str(prompt)) + 3) // 4, 'candidatesTokenCount': (len(text) + 3) // 4}
+                    count('synthetic')
+
+                time.sleep(delay_for(recording))
+                usage['totalTokenCount'] = usage['promptTokenCount'] + usage['candidatesTokenCount']
+                self.send_json(200, {
+                    'candidates': [{
+                        'content': {'role': 'model', 'parts': [{'text': text}]},
+                        'finishReason': finish_reason,
+                        'index': 0,
+                    }],
+                    'usageMetadata': usage,
+                    'modelVersion': model,
+                })
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        endpoint = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake Gemini endpoint listening on {endpoint} (recordings: {options['record_dir']})"
+        ))
+        self.stdout.write(f"Point the app at it with GEMINI_API_ENDPOINT={endpoint}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            command.stdout.write(
+                f"Served {stats['requests']} requests: {stats['recorded']} recorded, "
+                f"{stats['synthetic']} synthetic, {stats['errors']} errors"
+            )
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from ...genie_jobs import (
+    GENIE_JOB_THREADS,
+    requeue_stale,
+    work,
+    poll_loop,
+    poll_due_research,
+)
+import threading
+import logging
+import time
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class Command(BaseCommand):
+    help = 'Run queued Genie analyses and poll their Deep Research (see genie_jobs); use --once from cron to drain the queue and exit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=GENIE_JOB_THREADS, help='Analyses run concurrently')
+        parser.add_argument('--poll_interval', type=float, default=5, help='Seconds between queue checks when idle')
+        parser.add_argument('--once', action='store_true', help='Run the pending analyses, then exit')
+
+    def handle(self, *args, **options):
+        requeue_stale()
+        stop_event = threading.Event()
+
+        if options['once']:
+            checked = poll_due_research()
+            self.stdout.write(f"Checked {checked} running Deep Research tasks")
+        else:
+            # The single Deep Research poller of this worker
+            threading.Thread(
+                target=poll_loop,
+                kwargs={'stop_event': stop_event},
+                name='deep-research-poller',
+                daemon=True,
+            ).start()
+
+        workers = [
+            threading.Thread(
+                target=work,
+                kwargs={
+                    'poll_interval': options['poll_interval'],
+                    'stop_when_idle': options['once'],
+                    'stop_event': stop_event,
+                },
+                name=f'genie-worker-{i+1}',
+                daemon=True,
+            )
+            for i in range(max(1, options['threads']))
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Genie job worker started with {len(workers)} threads")
+
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(options['poll_interval'])
+                if not options['once']:
+                    requeue_stale()
+        except KeyboardInterrupt:
+            # Running analyses are left 'processing' and requeued once they time out
+            stop_event.set()
+            self.stdout.write("Stopping after the running analyses...")
+            for worker in workers:
+                worker.join()
+
+        self.stdout.write(self.style.SUCCESS("Genie job worker stopped"))
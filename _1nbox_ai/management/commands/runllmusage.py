@@ -0,0 +1,114 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ...models import LLMUsage
+from collections import defaultdict
+from datetime import timedelta
+import json
+import math
+
+GROUP_FIELDS = {
+    'organization': 'organization__name',
+    'topic': 'topic__name',
+    'caller': 'caller',
+    'model': 'model',
+    'endpoint': 'endpoint',
+}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list (q in 0-100)."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def aggregate_usage(rows, group_by):
+    """Group LLMUsage value rows by `group_by` and compute counts, token totals and latency percentiles."""
+    groups = defaultdict(lambda: {
+        'calls': 0, 'errors': 0, 'retries': 0,
+        'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0, 'latencies': [],
+    })
+    for row in rows:
+        key = tuple(row[GROUP_FIELDS[field]] or '-' for field in group_by)
+        group = groups[key]
+        group['calls'] += 1
+        group['errors'] += 0 if row['success'] else 1
+        group['retries'] += row['retries']
+        group['prompt_tokens'] += row['prompt_tokens']
+        group['output_tokens'] += row['output_tokens']
+        group['cached_tokens'] += row['cached_tokens']
+        group['latencies'].append(row['latency_ms'])
+
+    results = []
+    for key, group in groups.items():
+        latencies = sorted(group.pop('latencies'))
+        results.append(dict(
+            group,
+            group=dict(zip(group_by, key)),
+            p50_ms=percentile(latencies, 50),
+            p95_ms=percentile(latencies, 95),
+            max_ms=latencies[-1] if latencies else 0,
+        ))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Report LLM calls, tokens and p50/p95 latency per organization, topic and call site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Number of days to report on')
+        parser.add_argument('--group_by', nargs='+', choices=list(GROUP_FIELDS), default=['organization', 'caller'], help='Fields to group by')
+        parser.add_argument('--sort', choices=['tokens', 'calls', 'p95'], default='tokens', help='Column used to order the report')
+        parser.add_argument('--limit', type=int, default=50, help='Maximum number of rows shown')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--prune_days', type=int, help='Delete usage records older than this many days instead of reporting')
+
+    def handle(self, *args, **options):
+        if options['prune_days'] is not None:
+            if options['prune_days'] < 1:
+                raise CommandError("--prune_days must be at least 1")
+            cutoff = timezone.now() - timedelta(days=options['prune_days'])
+            deleted, _ = LLMUsage.objects.filter(created_at__lt=cutoff).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} LLM usage records older than {options['prune_days']} days"))
+            return
+
+        group_by = list(dict.fromkeys(options['group_by']))
+        since = timezone.now() - timedelta(days=options['days'])
+        rows = LLMUsage.objects.filter(created_at__gte=since).values(
+            *[GROUP_FIELDS[field] for field in group_by],
+            'success', 'retries', 'prompt_tokens', 'output_tokens', 'cached_tokens', 'latency_ms',
+        ).iterator()
+
+        results = aggregate_usage(rows, group_by)
+        sort_keys = {
+            'tokens': lambda result: result['prompt_tokens'] + result['output_tokens'],
+            'calls': lambda result: result['calls'],
+            'p95': lambda result: result['p95_ms'],
+        }
+        results.sort(key=sort_keys[options['sort']], reverse=True)
+        results = results[:options['limit']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        if not results:
+            self.stdout.write(f"No LLM usage recorded in the last {options['days']:g} days")
+            return
+
+        group_width = max(len(' / '.join(group_by)), *(len(' / '.join(map(str, r['group'].values()))) for r in results))
+        group_width = min(group_width, 60)
+        header = (
+            f"{' / '.join(group_by):<{group_width}} | {'calls':>6} {'errors':>6} {'retries':>7} "
+            f"{'p50 ms':>7} {'p95 ms':>7} {'prompt tok':>11} {'cached tok':>11} {'output tok':>11}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            label = ' / '.join(str(value) for value in result['group'].values())[:group_width]
+            self.stdout.write(
+                f"{label:<{group_width}} | {result['calls']:>6} {result['errors']:>6} {result['retries']:>7} "
+                f"{result['p50_ms']:>7} {result['p95_ms']:>7} {result['prompt_tokens']:>11} "
+                f"{result['cached_tokens']:>11} {result['output_tokens']:>11}"
+            )
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from ...news import process_all_topics
+from ...llm import log_usage_summary
+from ...llm_usage import flush as flush_llm_usage
 import traceback
 
 class Command(BaseCommand):
@@ -16,6 +18,13 @@ class Command(BaseCommand):
         parser.add_argument('--sentences_final_summary', type=int, default=3, help='Amount of sentences per topic in the final summary')
         parser.add_argument('--title_only', action='store_true', help='If set, clustering will only use article titles')
         parser.add_argument('--all_words', action='store_true', help='If set, clustering will include all words, not just capitalized ones')
+        parser.add_argument('--clustering_mode', choices=['greedy', 'density'], default='greedy', help="Clustering engine: 'greedy' common-word matching or 'density' TF-IDF + HDBSCAN")
+        parser.add_argument('--max_articles', type=int, default=777, help='Maximum number of (most recent) articles clustered per topic')
+        parser.add_argument('--large_topic', action='store_true', help='Lift the article cap: stream articles within a memory budget and cluster them with the density engine')
+        parser.add_argument('--memory_budget_mb', type=int, default=256, help='Approximate memory budget for collected articles in --large_topic mode')
+        parser.add_argument('--batch', action='store_true', help='Generate all final summaries as one batch job instead of one call per topic')
+        parser.add_argument('--batch_backend', choices=['gemini', 'local'], default='gemini', help="Batch backend: the Gemini Batch API or a 'local' stand-in that runs the batch file through the regular API")
+        parser.add_argument('--batch_dir', default=None, help='Directory for batch request/result files (default: ./batches)')
         parser.add_argument('--force', action='store_true', help='Force processing for ALL organizations, bypassing time checks (use for testing)')
 
     def handle(self, *args, **options):
@@ -34,8 +43,17 @@ class Command(BaseCommand):
                 sentences_final_summary=options['sentences_final_summary'],
                 title_only=options['title_only'],
                 all_words=options['all_words'],
-                force=options['force']
+                force=options['force'],
+                clustering_mode=options['clustering_mode'],
+                max_articles=options['max_articles'],
+                large_topic=options['large_topic'],
+                memory_budget_mb=options['memory_budget_mb'],
+                batch=options['batch'],
+                batch_backend=options['batch_backend'],
+                batch_dir=options['batch_dir']
             )
+            log_usage_summary()
+            flush_llm_usage()
             self.stdout.write(self.style.SUCCESS('News processing completed successfully.'))
         except Exception as e:
             self.stderr.write(self.style.ERROR('Error during news processing:'))
@@ -0,0 +1,12 @@
+from . import llm
+
+
+class LLMUsageScopeMiddleware:
+    """Attribute the model calls made while handling a request to its endpoint (see llm.usage_scope)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with llm.usage_scope(endpoint=request.path):
+            return self.get_response(request)
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0007_add_deep_research_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='cluster_state',
+            field=models.JSONField(blank=True, default=dict, null=True),
+        ),
+    ]
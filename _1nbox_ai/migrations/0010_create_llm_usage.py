@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0009_create_cluster_summary_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('caller', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=64)),
+                ('endpoint', models.CharField(blank=True, default='', max_length=255)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('cached_tokens', models.IntegerField(default=0)),
+                ('latency_ms', models.IntegerField(default=0)),
+                ('retries', models.SmallIntegerField(default=0)),
+                ('success', models.BooleanField(default=True)),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_usage', to='_1nbox_ai.organization')),
+                ('topic', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_usage', to='_1nbox_ai.topic')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0010_create_llm_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicVectorIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding_model', models.CharField(max_length=64)),
+                ('dimensions', models.IntegerField(default=0)),
+                ('passages', models.JSONField(blank=True, default=list)),
+                ('vectors', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('summary', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='_1nbox_ai.summary')),
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='vector_index', to='_1nbox_ai.topic')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0011_create_topic_vector_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genieanalysis',
+            name='questionnaire_answers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='genieanalysis',
+            name='topic_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='genieanalysis',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
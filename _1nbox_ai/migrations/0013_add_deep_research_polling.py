@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0012_add_genie_job_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='genieanalysis',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('researching', 'Waiting for Deep Research'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='genieanalysis',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='genieanalysis',
+            name='poll_attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
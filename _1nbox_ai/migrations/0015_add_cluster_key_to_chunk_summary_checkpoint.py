@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_1nbox_ai', '0014_create_chunk_summary_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunksummarycheckpoint',
+            name='cluster_key',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+    ]
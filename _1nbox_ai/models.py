@@ -78,6 +78,7 @@ class Topic(models.Model):
         related_name='topics'
     )
     current_clusters = models.JSONField(default=dict, blank=True, null=True)
+    cluster_state = models.JSONField(default=dict, blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
     
     def __str__(self):
@@ -105,6 +106,91 @@ class Summary(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+class ClusterSummaryCache(models.Model):
+    # sha256 of the cluster's sorted article links, the prompt version and the model
+    key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField()
+    article_count = models.IntegerField(default=0)
+    prompt_version = models.IntegerField(default=1)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Cluster summary {self.key[:12]} ({self.article_count} articles)"
+
+    class Meta:
+        ordering = ['-last_used_at']
+
+class ChunkSummaryCheckpoint(models.Model):
+    # sha256 of the chunk prompt, the prompt version, the summary route and its model
+    key = models.CharField(max_length=64, unique=True)
+    # cluster_summary_cache_key of the cluster the chunk belongs to, so a cluster's
+    # checkpoints are loaded with one query before its chunks are summarized
+    cluster_key = models.CharField(max_length=64, db_index=True, default='')
+    summary = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Chunk checkpoint {self.key[:12]}"
+
+class LLMUsage(models.Model):
+    # One row per model call made through llm.py (see llm_usage)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    caller = models.CharField(max_length=64)
+    model = models.CharField(max_length=64)
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='llm_usage'
+    )
+    topic = models.ForeignKey(
+        Topic,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='llm_usage'
+    )
+    endpoint = models.CharField(max_length=255, blank=True, default='')
+    prompt_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(default=0)
+    latency_ms = models.IntegerField(default=0)
+    retries = models.SmallIntegerField(default=0)
+    success = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.caller} [{self.model}] {self.latency_ms}ms ({self.created_at})"
+
+    class Meta:
+        ordering = ['-created_at']
+
+class TopicVectorIndex(models.Model):
+    # Embedded passages of the topic's latest summary, used to pick chat and Q&A context (see retrieval)
+    topic = models.OneToOneField(
+        Topic,
+        on_delete=models.CASCADE,
+        related_name='vector_index'
+    )
+    summary = models.ForeignKey(
+        Summary,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    embedding_model = models.CharField(max_length=64)
+    dimensions = models.IntegerField(default=0)
+    # [{'key', 'kind', 'text', 'title', 'link'}], aligned with the rows of `vectors`
+    passages = models.JSONField(default=list, blank=True)
+    # float32 row-major matrix of L2-normalized embeddings
+    vectors = models.BinaryField(default=bytes)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Vector index for {self.topic.name} ({len(self.passages)} passages)"
+
 class Comment(models.Model):
     comment = models.TextField()
     writer = models.ForeignKey(
@@ -189,6 +275,7 @@ class GenieAnalysis(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('processing', 'Processing'),
+        ('researching', 'Waiting for Deep Research'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
@@ -224,7 +311,14 @@ class GenieAnalysis(models.Model):
     deep_research_results = models.TextField(blank=True, null=True)
     results = models.JSONField(default=dict, blank=True, null=True)
     sources = models.JSONField(default=list, blank=True, null=True)
+    # Inputs of the analysis job, run in the background by genie_jobs
+    questionnaire_answers = models.JSONField(default=list, blank=True)
+    topic_ids = models.JSONField(default=list, blank=True)
+    # Deep Research polling state while 'researching' (see genie_jobs.poll_due_research)
+    next_poll_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    poll_attempts = models.IntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
     completed_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
@@ -6,18 +6,34 @@ from django.core.management.base import BaseCommand
 import re
 import os
 from collections import Counter
-from .models import Topic, Organization, Summary, Comment
+from .models import Topic, Organization, Summary, Comment, ClusterSummaryCache, ChunkSummaryCheckpoint
+from .clustering import (
+    cluster_articles_density,
+    update_online_clusters,
+    strip_html,
+    parse_datetime_safe,
+    select_recent_articles,
+    DEFAULT_MAX_ARTICLES,
+)
 import json
 import ast
 import requests
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
 from bs4 import BeautifulSoup 
-from google import generativeai as genai
+from . import llm
+from . import summary_batch
+from .chat_context import warm_chat_context
+from .retrieval import update_topic_index
+from .bubbles import normalize_rss_url
 
 import requests
 from contextlib import contextmanager
 import signal
+import heapq
+import math
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # List of insignificant words to exclude
 INSIGNIFICANT_WORDS = set([
@@ -328,34 +344,64 @@ def print_clusters(clusters):
             print()
         print()
 
+###############################################################################
+# Token accounting
+###############################################################################
+# 'estimate' uses a character-based estimate; 'exact' calibrates it with one Gemini
+# count_tokens call per cluster
+TOKEN_COUNT_MODE = os.environ.get('TOKEN_COUNT_MODE', 'estimate')
+
 @time_function
 def estimate_tokens(text):
-    return len(text.split())
+    # Gemini tokenizers average about 4 characters per token on English news text
+    return (len(text) + 3) // 4
+
+def article_prompt_fragment(article):
+    """The article as rendered into the cluster prompt; built once and cached on the article."""
+    fragment = article.get('_prompt_fragment')
+    if fragment is None:
+        fragment = (
+            f"Title: {article['title']}\n"
+            f"URL: {article['link']}\n"
+            f"Summary: {article['summary']}\n"
+            f"Content: {article['content']}\n\n"
+        )
+        article['_prompt_fragment'] = fragment
+    return fragment
+
+def article_tokens(article):
+    """Token count of the article's prompt fragment; computed once and cached on the article."""
+    tokens = article.get('_prompt_tokens')
+    if tokens is None:
+        tokens = estimate_tokens(article_prompt_fragment(article))
+        article['_prompt_tokens'] = tokens
+    return tokens
 
 @time_function
-def calculate_cluster_tokens(cluster):
-    total_tokens = 0
-    for article in cluster['articles']:
-        total_tokens += estimate_tokens(article['title'])
-        total_tokens += estimate_tokens(article['summary'])
-        total_tokens += estimate_tokens(article['content'])
-    return total_tokens
-
-def parse_datetime_safe(date_str):
-    """Parse a datetime string and ensure it's timezone-aware (UTC if naive)"""
-    from datetime import timezone
-    if not date_str:
-        return datetime.min.replace(tzinfo=timezone.utc)
+def calibrate_article_tokens(articles, model):
+    """
+    Replace the estimated token counts of not-yet-calibrated articles with exact ones:
+    a single count_tokens call over all their fragments, spread in proportion to the
+    estimates. Keeps the estimates if the call fails.
+    """
+    pending = [article for article in articles if not article.get('_prompt_tokens_exact')]
+    if not pending:
+        return
+    estimated = sum(article_tokens(article) for article in pending)
     try:
-        # Try to parse with timezone info
-        dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        # If it's naive, make it UTC-aware
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt
-    except (ValueError, AttributeError):
-        # Fallback to minimum datetime if parsing fails
-        return datetime.min.replace(tzinfo=timezone.utc)
+        exact = llm.count_tokens(''.join(article_prompt_fragment(article) for article in pending), model=model)
+    except Exception as e:
+        logging.warning(f"Token counting failed, keeping estimates: {str(e)}")
+        return
+    ratio = exact / max(1, estimated)
+    for article in pending:
+        article['_prompt_tokens'] = math.ceil(article['_prompt_tokens'] * ratio)
+        article['_prompt_tokens_exact'] = True
+    logging.info(f"Calibrated {len(pending)} articles: {exact} tokens (estimated {estimated})")
+
+@time_function
+def calculate_cluster_tokens(cluster):
+    return sum(article_tokens(article) for article in cluster['articles'])
 
 @time_function
 def limit_cluster_content(cluster, max_tokens=100000):
@@ -373,13 +419,7 @@ def limit_cluster_content(cluster, max_tokens=100000):
     header_tokens = estimate_tokens(cluster_headers)
     
     # Calculate total tokens for the entire cluster
-    total_tokens = header_tokens
-    for article in cluster['articles']:
-        article_content = f"Title: {article['title']}\n"
-        article_content += f"URL: {article['link']}\n"
-        article_content += f"Summary: {article['summary']}\n"
-        article_content += f"Content: {article['content']}\n\n"
-        total_tokens += estimate_tokens(article_content)
+    total_tokens = header_tokens + calculate_cluster_tokens(cluster)
     
     print(f"Estimated total tokens for cluster: {total_tokens}")
     
@@ -401,16 +441,11 @@ def limit_cluster_content(cluster, max_tokens=100000):
                             reverse=True)
     
     for article in sorted_articles:
-        article_content = f"Title: {article['title']}\n"
-        article_content += f"URL: {article['link']}\n"
-        article_content += f"Summary: {article['summary']}\n"
-        article_content += f"Content: {article['content']}\n\n"
-        
-        article_tokens = estimate_tokens(article_content)
+        tokens = article_tokens(article)
         
-        if current_tokens + article_tokens <= available_tokens:
+        if current_tokens + tokens <= available_tokens:
             limited_articles.append(article)
-            current_tokens += article_tokens
+            current_tokens += tokens
         else:
             break
     
@@ -420,138 +455,434 @@ def limit_cluster_content(cluster, max_tokens=100000):
         'articles': limited_articles
     }
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+DEFAULT_SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))
+
+###############################################################################
+# Cluster summary prompt and cache
+###############################################################################
+# Summaries are generated through this llm.MODEL_ROUTES route; on throttling or timeouts
+# calls fail over to the route's next model
+SUMMARY_ROUTE = os.environ.get('SUMMARY_ROUTE', 'bulk')
+
+def summary_model():
+    """First candidate of SUMMARY_ROUTE, where one model is needed: token counts, batch jobs and cache keys."""
+    return llm.MODEL_ROUTES[SUMMARY_ROUTE][0]['model']
+
+# Response schema of the final summary; Gemini's JSON mode guarantees output in this shape
+FINAL_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "title": {"type": "STRING"},
+                    "content": {"type": "STRING"},
+                },
+                "required": ["title", "content"],
+            },
+        },
+        "questions": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "prompt": {"type": "STRING"},
+    },
+    "required": ["summary", "questions"],
+}
+
+# Bump CLUSTER_SUMMARY_PROMPT_VERSION whenever the prompt or model changes so cached
+# summaries produced by the old prompt are no longer reused.
+CLUSTER_SUMMARY_PROMPT_VERSION = 2
+CLUSTER_SUMMARY_PROMPT = (
+    "You are a News Facts Summarizer. I will give you some articles, and I want you to tell me "
+    "all the facts from each of the articles in a small but fact-dense summary "
+    "including all the dates, names and key factors to provide full context on the events. "
+    "Also, I want you to add the corresponding url next to every line you put in the summary in parentheses. "
+    "Finally, It is required to add a general summary of the cluster with 3-4 sentences about "
+    "what is happening, the context and the overall big picture of the events in the articles."
+)
+
+def cluster_summary_cache_key(cluster):
+    """Hash of the cluster's sorted article links plus the prompt version and model."""
+    links = sorted(article.get('link', '') for article in cluster.get('articles', []))
+    payload = json.dumps([CLUSTER_SUMMARY_PROMPT_VERSION, summary_model(), links])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_failed_summary(summary):
+    return not summary or 'Error generating' in summary or summary.startswith('Error:')
+
+def get_cached_cluster_summaries(keys):
+    """Cached summaries for the given keys as {key: summary}; marks the hits as used."""
+    if not keys:
+        return {}
+    hits = dict(ClusterSummaryCache.objects.filter(key__in=keys).values_list('key', 'summary'))
+    if hits:
+        ClusterSummaryCache.objects.filter(key__in=list(hits)).update(last_used_at=datetime.now(pytz.utc))
+    return hits
+
+def store_cluster_summaries(entries):
+    """Persist (key, summary, article_count) tuples, skipping failed summaries."""
+    rows = [
+        ClusterSummaryCache(
+            key=key,
+            summary=summary,
+            article_count=article_count,
+            prompt_version=CLUSTER_SUMMARY_PROMPT_VERSION,
+        )
+        for key, summary, article_count in entries
+        if not is_failed_summary(summary)
+    ]
+    if rows:
+        ClusterSummaryCache.objects.bulk_create(rows, ignore_conflicts=True)
+
+###############################################################################
+# Chunk checkpoints
+###############################################################################
+# Every successful chunk call (a sub-chunk of a cluster, a map batch or a reduce group) is
+# checkpointed in the database under a hash of its prompt, so when a cluster fails and is
+# summarized again - later in the run or by the next cron run, in another process - only the
+# failed chunks are re-sent. summarize_clusters loads and stores the checkpoints of its
+# clusters on the calling thread; the worker threads only read and fill a dict of them.
+CHUNK_CHECKPOINT_TTL = int(os.environ.get('CHUNK_CHECKPOINT_TTL', 6 * 3600))
+# Rounds over the still-missing chunks of a cluster, on top of the gateway's own retries
+CHUNK_RETRY_ROUNDS = int(os.environ.get('CHUNK_RETRY_ROUNDS', 2))
+CHUNK_RETRY_BACKOFF = 5  # seconds before the second round, doubled after each round
+
+class ChunkSummaryError(Exception):
+    """Some chunks of a cluster could not be summarized; the others are checkpointed."""
+
+def chunk_checkpoint_key(prompt):
+    payload = json.dumps([CLUSTER_SUMMARY_PROMPT_VERSION, SUMMARY_ROUTE, summary_model(), prompt])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_chunk_checkpoints(cluster_keys):
+    """Chunk checkpoints younger than CHUNK_CHECKPOINT_TTL of the given clusters as {cluster_key: {key: summary}}."""
+    cutoff = datetime.now(pytz.utc) - timedelta(seconds=CHUNK_CHECKPOINT_TTL)
+    checkpoints = {cluster_key: {} for cluster_key in cluster_keys}
+    rows = ChunkSummaryCheckpoint.objects.filter(
+        cluster_key__in=list(checkpoints), created_at__gte=cutoff
+    ).values_list('cluster_key', 'key', 'summary')
+    for cluster_key, key, summary in rows:
+        checkpoints[cluster_key][key] = summary
+    return checkpoints
+
+def store_chunk_checkpoints(cluster_key, checkpoints):
+    """Persist {key: summary} chunk checkpoints of a cluster, replacing expired rows with the same key."""
+    now = datetime.now(pytz.utc)
+    rows = [
+        ChunkSummaryCheckpoint(key=key, cluster_key=cluster_key, summary=summary, created_at=now)
+        for key, summary in checkpoints.items()
+    ]
+    if rows:
+        ChunkSummaryCheckpoint.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['cluster_key', 'summary', 'created_at'],
+        )
+
+def generate_chunk_summaries(prompts, caller, checkpoints=None):
+    """
+    Summarize the chunk prompts in order, reusing the results in `checkpoints` ({key: summary},
+    see chunk_checkpoint_key) and adding the new ones to it. Missing chunks are retried for up
+    to CHUNK_RETRY_ROUNDS rounds; returns (texts, errors) with None for the chunks that still
+    failed and their last error in `errors`.
+    """
+    if checkpoints is None:
+        checkpoints = {}
+    keys = [chunk_checkpoint_key(prompt) for prompt in prompts]
+    texts = [checkpoints.get(key) for key in keys]
+    errors = {}
+    reused = sum(text is not None for text in texts)
+    if reused:
+        logging.info(f"{caller}: {reused}/{len(prompts)} chunks checkpointed")
+
+    backoff = CHUNK_RETRY_BACKOFF
+    for round_number in range(1, CHUNK_RETRY_ROUNDS + 1):
+        pending = [i for i, text in enumerate(texts) if text is None]
+        if not pending:
+            break
+        if round_number > 1:
+            logging.info(f"{caller}: retrying {len(pending)} failed chunk(s) in {backoff}s")
+            time.sleep(backoff)
+            backoff *= 2
+        for i in pending:
+            try:
+                text = llm.response_text(llm.generate(prompts[i], route=SUMMARY_ROUTE, caller=caller))
+                if text is None:
+                    raise ValueError("Unexpected Gemini response format")
+            except Exception as e:
+                logging.error(f"{caller} chunk {i+1}/{len(prompts)} failed (round {round_number}): {str(e)}")
+                errors[i] = e
+                continue
+            texts[i] = text
+            errors.pop(i, None)
+            checkpoints[keys[i]] = text
+
+    return texts, errors
+
+def cleanup_cluster_summary_cache(days=3):
+    """Delete cached cluster summaries not used in the last `days` days."""
+    cutoff = datetime.now(pytz.utc) - timedelta(days=days)
+    deleted, _ = ClusterSummaryCache.objects.filter(last_used_at__lt=cutoff).delete()
+    logging.info(f"Deleted {deleted} cached cluster summaries unused since {cutoff}")
+    checkpoint_cutoff = datetime.now(pytz.utc) - timedelta(seconds=CHUNK_CHECKPOINT_TTL)
+    expired, _ = ChunkSummaryCheckpoint.objects.filter(created_at__lt=checkpoint_cutoff).delete()
+    logging.info(f"Deleted {expired} expired chunk checkpoints")
+    return deleted
+
+###############################################################################
+# Map-reduce summarization for oversized clusters
+###############################################################################
+MAP_REDUCE_BATCH_TOKENS = 100000  # article tokens per map call (fits the 124k single-call budget)
+MAP_REDUCE_FAN_IN = 5             # partial summaries merged per reduce call
+MAP_REDUCE_WORKERS = 4            # concurrent map/reduce calls per cluster
+
+CLUSTER_REDUCE_PROMPT = (
+    "You are a News Facts Summarizer. Below are partial fact summaries of the same news story, "
+    "each one covering a different set of articles. Merge them into a single small but fact-dense summary "
+    "that keeps all the distinct facts, dates, names and key factors, and removes repetitions. "
+    "Keep the corresponding url in parentheses next to every line. "
+    "Finally, It is required to add a general summary of the cluster with 3-4 sentences about "
+    "what is happening, the context and the overall big picture of the events."
+)
+
+def batch_articles_by_tokens(articles, max_tokens):
+    """Split articles into consecutive batches of at most max_tokens (a single larger article gets its own batch)."""
+    batches = []
+    current = []
+    current_tokens = 0
+    for article in articles:
+        tokens = article_tokens(article)
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(article)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def run_map_reduce_calls(prompts, caller, max_workers=MAP_REDUCE_WORKERS, checkpoints=None):
+    """Run prompts concurrently (checkpointed per prompt); returns the texts in order, with None for failed calls."""
+    if checkpoints is None:
+        checkpoints = {}
+
+    def call(prompt):
+        texts, errors = generate_chunk_summaries([prompt], caller, checkpoints)
+        if texts[0] is None:
+            raise errors[0]
+        return texts[0]
+
+    results = [None] * len(prompts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        futures = {llm.submit_in_scope(executor, call, prompt): i for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                logging.error(f"{caller} call {i+1}/{len(prompts)} failed: {str(e)}")
+    return results
+
 @time_function
-def get_openai_response(cluster, max_tokens=4000):
+def summarize_cluster_map_reduce(cluster, batch_tokens=MAP_REDUCE_BATCH_TOKENS,
+                                 fan_in=MAP_REDUCE_FAN_IN, max_workers=MAP_REDUCE_WORKERS,
+                                 checkpoints=None):
+    """
+    Summarize every article of an oversized cluster: the articles (newest first) are split
+    into token-bounded batches summarized in parallel (map), then the partial summaries are
+    merged `fan_in` at a time, level by level, until one remains (reduce). Latency grows
+    with the tree depth, log_fan_in(batches), not with the number of articles.
+    """
+    header = f"Common words: {', '.join(cluster['common_words'])}\n\n"
+    articles = sorted(
+        cluster['articles'],
+        key=lambda x: parse_datetime_safe(x.get('published')),
+        reverse=True
+    )
+    batches = batch_articles_by_tokens(articles, batch_tokens)
+    logging.info(f"Map-reduce: {len(articles)} articles in {len(batches)} batches")
+
+    partials = run_map_reduce_calls(
+        [
+            CLUSTER_SUMMARY_PROMPT + "\n\n" + header + ''.join(article_prompt_fragment(a) for a in batch)
+            for batch in batches
+        ],
+        "news.cluster_map", max_workers, checkpoints
+    )
+    partials = [partial for partial in partials if partial]
+    if not partials:
+        raise ValueError("All map-reduce batches failed")
+
+    depth = 0
+    while len(partials) > 1:
+        depth += 1
+        groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+        merge_groups = [i for i, group in enumerate(groups) if len(group) > 1]
+        reduced = run_map_reduce_calls(
+            [
+                CLUSTER_REDUCE_PROMPT + "\n\n" + header +
+                "\n\n".join(f"Partial summary {j+1}:\n{partial}" for j, partial in enumerate(groups[i]))
+                for i in merge_groups
+            ],
+            "news.cluster_reduce", max_workers, checkpoints
+        )
+        merged = dict(zip(merge_groups, reduced))
+        # A lone partial passes through; a failed reduce keeps its inputs so no coverage is lost
+        partials = [
+            merged.get(i) or "\n\n".join(group)
+            for i, group in enumerate(groups)
+        ]
+        logging.info(f"Map-reduce level {depth}: {len(partials)} partial summaries")
+
+    return partials[0]
+
+@time_function
+def get_openai_response(cluster, max_tokens=4000, checkpoints=None):
     """
     Generate cluster summaries using Gemini API (renamed from get_openai_response for compatibility).
+    Transient API errors are retried by the LLM gateway.
     """
     try:
-        # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-        gemini_key = os.environ.get('GEMINI_API_KEY') or os.environ.get('GEMINI_KEY')
-        if not gemini_key:
+        try:
+            llm.get_api_key()
+        except ValueError:
             logging.error("Gemini API key not found in environment variables")
             return "Error: Gemini API key not configured"
 
-        genai.configure(api_key=gemini_key)
-        model = genai.GenerativeModel("gemini-2.5-flash-lite")
+        if TOKEN_COUNT_MODE == 'exact':
+            calibrate_article_tokens(cluster['articles'], summary_model())
 
-        # Handle extremely large clusters
-        if calculate_cluster_tokens(cluster) > 300000:  # If cluster is extremely large
-            logging.warning(f"Cluster size exceeds 300k tokens, truncating to newest articles")
-            cluster['articles'] = sorted(
-                cluster['articles'],
-                key=lambda x: parse_datetime_safe(x.get('published')),
-                reverse=True
-            )[:10]  # Keep only the 10 newest articles
+        # Oversized clusters are summarized in full with map-reduce instead of dropping articles
+        if calculate_cluster_tokens(cluster) > MAP_REDUCE_BATCH_TOKENS:
+            logging.info(f"Cluster exceeds {MAP_REDUCE_BATCH_TOKENS} tokens, summarizing with map-reduce")
+            return summarize_cluster_map_reduce(cluster, checkpoints=checkpoints)
 
         # Limit cluster content to 124000 tokens before processing
         limited_cluster = limit_cluster_content(cluster, max_tokens=124000)
         
-        # Process in chunks if needed
-        if len(limited_cluster['articles']) < len(cluster['articles']) // 2:
-            logging.info("Processing large cluster in multiple chunks")
-            chunks = []
-            for i in range(0, len(cluster['articles']), 10):
-                chunk_cluster = {
-                    'common_words': cluster['common_words'],
-                    'articles': cluster['articles'][i:i+10]
-                }
-                chunk_limited = limit_cluster_content(chunk_cluster, max_tokens=124000)
-                chunks.append(process_cluster_chunk(chunk_limited, model, max_tokens))
-            
-            return "\n\n".join(chunks)
-        
-        return process_cluster_chunk(limited_cluster, model, max_tokens)
+        return process_cluster_chunk(limited_cluster, max_tokens, checkpoints)
 
     except Exception as e:
         logging.error(f"Error in get_openai_response (Gemini): {str(e)}")
-        raise  # Retry will handle this
+        raise
 
 @time_function
-def process_cluster_chunk(cluster, model, max_tokens):
+def process_cluster_chunk(cluster, max_tokens, checkpoints=None):
     cluster_content = f"Common words: {', '.join(cluster['common_words'])}\n\n"
     current_tokens = 0
     sub_clusters = []
     current_sub_cluster = []
 
     for article in cluster['articles']:
-        article_content = f"Title: {article['title']}\n"
-        article_content += f"URL: {article['link']}\n"
-        article_content += f"Summary: {article['summary']}\n"
-        article_content += f"Content: {article['content']}\n\n"
-        
-        article_tokens = estimate_tokens(article_content)
+        # Fragments and token counts are cached on the article by limit_cluster_content
+        tokens = article_tokens(article)
         
-        if current_tokens + article_tokens > max_tokens:
+        if current_sub_cluster and current_tokens + tokens > max_tokens:
             sub_clusters.append(current_sub_cluster)
             current_sub_cluster = []
             current_tokens = 0
         
-        current_sub_cluster.append(article_content)
-        current_tokens += article_tokens
+        current_sub_cluster.append(article_prompt_fragment(article))
+        current_tokens += tokens
 
     if current_sub_cluster:
         sub_clusters.append(current_sub_cluster)
 
-    summaries = []
-    for sub_cluster in sub_clusters:
-        sub_cluster_content = cluster_content + ''.join(sub_cluster)
-        
-        prompt = ("You are a News Facts Summarizer. I will give you some articles, and I want you to tell me "
-                  "all the facts from each of the articles in a small but fact-dense summary "
-                  "including all the dates, names and key factors to provide full context on the events. "
-                  "Also, I want you to add the corresponding url next to every line you put in the summary in parentheses. "
-                  "Finally, It is required to add a general summary of the cluster with 3-4 sentences about "
-                  "what is happening, the context and the overall big picture of the events in the articles.")
+    prompts = [
+        CLUSTER_SUMMARY_PROMPT + "\n\n" + cluster_content + ''.join(sub_cluster)
+        for sub_cluster in sub_clusters
+    ]
+    summaries, errors = generate_chunk_summaries(prompts, "news.cluster_summary", checkpoints)
+    if errors:
+        # Raised rather than joined into the summary so the cluster is not cached with a gap;
+        # the chunks that succeeded are checkpointed and are not re-sent on the next attempt
+        failed = ', '.join(str(i + 1) for i in sorted(errors))
+        raise ChunkSummaryError(
+            f"Chunk(s) {failed} of {len(prompts)} failed: {str(errors[min(errors)])}"
+        )
 
+    return ' '.join(summaries)
+
+@time_function
+def summarize_clusters(clusters, max_workers=DEFAULT_SUMMARY_WORKERS, precomputed=None, use_cache=True):
+    """
+    Summarize clusters concurrently with at most `max_workers` in flight (the shared rate
+    limiter paces the actual Gemini requests) and return the summaries in cluster order.
+
+    `precomputed` is an optional list aligned with `clusters`; truthy entries are kept
+    as-is and only the remaining clusters are sent. A failed cluster gets a placeholder.
+    With use_cache, clusters whose exact article membership was summarized before (see
+    cluster_summary_cache_key) reuse the stored text, and new summaries are stored.
+    """
+    summaries = list(precomputed) if precomputed else [None] * len(clusters)
+    pending = [i for i, summary in enumerate(summaries) if not summary]
+    if not pending:
+        return summaries
+
+    keys = {i: cluster_summary_cache_key(clusters[i]) for i in pending}
+    if use_cache:
+        cached = get_cached_cluster_summaries(list(keys.values()))
+        for i in pending:
+            if keys[i] in cached:
+                summaries[i] = cached[keys[i]]
+        pending = [i for i in pending if not summaries[i]]
+        logging.info(f"Cluster summary cache: {len(keys) - len(pending)} hits, {len(pending)} misses")
+        if not pending:
+            return summaries
+
+    try:
+        checkpoints = get_chunk_checkpoints([keys[i] for i in pending])
+    except Exception as e:
+        logging.warning(f"Chunk checkpoints unavailable: {str(e)}")
+        checkpoints = {}
+    # Per-cluster copies the workers fill in; whatever was added is stored below, even for failed clusters
+    cluster_checkpoints = {i: dict(checkpoints.get(keys[i], {})) for i in pending}
+
+    def summarize(i):
+        cluster = clusters[i]
+        logging.info(f"Summarizing cluster {i+1}/{len(clusters)}: {', '.join(cluster['common_words'])}")
+        return get_openai_response(cluster, checkpoints=cluster_checkpoints[i])
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+        futures = {llm.submit_in_scope(executor, summarize, i): i for i in pending}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                logging.error(f"Error summarizing cluster {i+1}: {str(e)}")
+                summaries[i] = f"Error generating summary for cluster: {', '.join(clusters[i]['common_words'])}"
+
+    # Stored from the calling thread so the worker threads never touch the database
+    for i in pending:
+        loaded = checkpoints.get(keys[i], {})
+        new_checkpoints = {key: text for key, text in cluster_checkpoints[i].items() if key not in loaded}
         try:
-            response = model.generate_content(prompt + "\n\n" + sub_cluster_content)
-            
-            # Extract text from response
-            if hasattr(response, 'candidates') and len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    if len(candidate.content.parts) > 0:
-                        summaries.append(candidate.content.parts[0].text)
-                        continue
-            
-            # Fallback to direct text attribute
-            if hasattr(response, 'text'):
-                summaries.append(response.text)
-            else:
-                logging.warning("Unexpected Gemini response format in cluster summary")
-                summaries.append("Error generating cluster summary")
+            store_chunk_checkpoints(keys[i], new_checkpoints)
         except Exception as e:
-            logging.error(f"Error generating cluster summary chunk: {str(e)}")
-            summaries.append(f"Error generating summary: {str(e)}")
+            logging.warning(f"Could not checkpoint the chunks of cluster {i+1}: {str(e)}")
 
-    return ' '.join(summaries)
+    if use_cache:
+        store_cluster_summaries(
+            (keys[i], summaries[i], len(clusters[i].get('articles', []))) for i in pending
+        )
+
+    return summaries
 
 @time_function
-def get_final_summary(
+def build_final_summary_prompt(
     cluster_summaries,
     sentences_final_summary,
     topic_prompt=None,
     organization_description=""
 ):
     """
-    Generates a final JSON-based summary of all cluster_summaries using Gemini API.  
-    If organization_description is present, instructs Gemini to add an 'Insight:' line 
-    at the end of a story's content if relevant to that organization.  
-    Returns the raw text response from Gemini (you typically parse it with extract_braces_content, then json.loads).
+    Prompt for the final JSON-based summary of all cluster_summaries. If organization_description
+    is present, instructs Gemini to add an 'Insight:' line at the end of a story's content if
+    relevant to that organization. Shared by get_final_summary and the batch mode.
     """
-    logging.info("Preparing to get final summary from Gemini for all cluster summaries")
-
-    # Support both GEMINI_API_KEY and GEMINI_KEY for backwards compatibility
-    gemini_key = os.environ.get('GEMINI_API_KEY') or os.environ.get('GEMINI_KEY')
-    if not gemini_key:
-        raise ValueError("Gemini API key not found in environment variables. Set GEMINI_API_KEY or GEMINI_KEY.")
-
-    genai.configure(api_key=gemini_key)
-    # Use gemini-2.5-flash-lite (cheapest smart model, generally available)
-    model = genai.GenerativeModel("gemini-2.5-flash-lite")
-
     all_summaries = "\n\n".join(cluster_summaries)
 
     base_prompt = (
@@ -629,10 +960,36 @@ def get_final_summary(
         "Make sure you follow the JSON structure exactly."
     )
 
+    return base_prompt
+
+@time_function
+def get_final_summary(
+    cluster_summaries,
+    sentences_final_summary,
+    topic_prompt=None,
+    organization_description=""
+):
+    """
+    Generates a final JSON-based summary of all cluster_summaries using Gemini API
+    (see build_final_summary_prompt) in JSON mode against FINAL_SUMMARY_SCHEMA.
+    Returns the parsed summary: {'summary': [{'title', 'content'}, ...], 'questions': [...]}.
+    """
+    logging.info("Preparing to get final summary from Gemini for all cluster summaries")
+
+    base_prompt = build_final_summary_prompt(
+        cluster_summaries, sentences_final_summary, topic_prompt, organization_description
+    )
+
     logging.debug("Sending final summary prompt to Gemini...")
 
     try:
-        response = model.generate_content(base_prompt)
+        response = llm.generate(
+            base_prompt,
+            route=SUMMARY_ROUTE,
+            generation_config=llm.json_generation_config(FINAL_SUMMARY_SCHEMA),
+            timeout=300,
+            caller="news.final_summary"
+        )
         
         # Check if response was blocked by safety filters
         if hasattr(response, 'candidates') and len(response.candidates) > 0:
@@ -650,11 +1007,11 @@ def get_final_summary(
             # Extract text from candidate
             if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
                 if len(candidate.content.parts) > 0:
-                    return candidate.content.parts[0].text
+                    return llm.parse_json(candidate.content.parts[0].text)
         
         # Fallback to direct text attribute
         if hasattr(response, 'text'):
-            return response.text
+            return llm.parse_json(response.text)
         
         # Last resort - try to get text from response
         logging.error(f"Unexpected Gemini response format: {type(response)}")
@@ -671,128 +1028,6 @@ def get_final_summary(
         raise
 
 
-@time_function
-def extract_braces_content(s):
-    start_index = s.find('{')
-    end_index = s.rfind('}')
-        
-    if start_index == -1 or end_index == -1:
-        # If there is no '{' or '}', return an empty string or handle as needed
-        return ""
-        
-    # Include the end_index in the slice by adding 1
-    return s[start_index:end_index + 1]
-
-
-def repair_json(json_string):
-    """
-    Attempts to repair common JSON issues from Gemini API responses.
-    Handles trailing commas, unescaped quotes, and other common issues.
-    """
-    import re
-    
-    if not json_string:
-        return json_string
-    
-    # Remove trailing commas before closing braces/brackets (most common issue)
-    json_string = re.sub(r',(\s*[}\]])', r'\1', json_string)
-    
-    # Fix smart quotes (replace with regular quotes)
-    json_string = json_string.replace('"', '"').replace('"', '"')
-    json_string = json_string.replace(''', "'").replace(''', "'")
-    
-    # Fix unescaped backslashes (but preserve escaped ones)
-    # This is a simplified approach - we'll handle newlines separately
-    json_string = re.sub(r'(?<!\\)\\(?!["\\/bfnrtu])', r'\\\\', json_string)
-    
-    # Try to fix unescaped newlines and tabs in string values
-    # We'll use a state machine to track if we're inside a string
-    result = []
-    in_string = False
-    escape_next = False
-    i = 0
-    
-    while i < len(json_string):
-        char = json_string[i]
-        
-        if escape_next:
-            result.append(char)
-            escape_next = False
-        elif char == '\\':
-            result.append(char)
-            escape_next = True
-        elif char == '"' and (i == 0 or json_string[i-1] != '\\'):
-            in_string = not in_string
-            result.append(char)
-        elif in_string:
-            # Inside a string value
-            if char == '\n':
-                # Escape newlines inside strings
-                result.append('\\n')
-            elif char == '\t':
-                # Escape tabs inside strings
-                result.append('\\t')
-            elif char == '\r':
-                # Escape carriage returns
-                result.append('\\r')
-            else:
-                result.append(char)
-        else:
-            # Outside string - keep as is
-            result.append(char)
-        
-        i += 1
-    
-    return ''.join(result)
-
-
-def parse_json_with_repair(json_string, max_retries=3):
-    """
-    Attempts to parse JSON, repairing it if necessary.
-    Returns parsed JSON or raises an exception if all attempts fail.
-    """
-    import json
-    
-    # First, extract JSON from any surrounding text
-    json_string = extract_braces_content(json_string)
-    
-    if not json_string:
-        raise ValueError("No JSON content found in response")
-    
-    last_error = None
-    
-    for attempt in range(max_retries):
-        try:
-            # Try parsing as-is first
-            return json.loads(json_string)
-        except json.JSONDecodeError as e:
-            last_error = e
-            logging.warning(f"JSON parse attempt {attempt + 1} failed: {str(e)}")
-            
-            if attempt < max_retries - 1:
-                # Try to repair the JSON
-                json_string = repair_json(json_string)
-                logging.info(f"Attempting JSON repair (attempt {attempt + 1})...")
-            else:
-                # Last attempt - log the problematic JSON for debugging
-                logging.error(f"Failed to parse JSON after {max_retries} attempts")
-                logging.error(f"JSON decode error: {str(e)}")
-                logging.error(f"Error position: line {e.lineno}, column {e.colno}")
-                # Log a snippet around the error
-                if e.lineno and e.colno:
-                    lines = json_string.split('\n')
-                    error_line_idx = e.lineno - 1
-                    if 0 <= error_line_idx < len(lines):
-                        error_line = lines[error_line_idx]
-                        start = max(0, e.colno - 50)
-                        end = min(len(error_line), e.colno + 50)
-                        logging.error(f"Problem area: ...{error_line[start:end]}...")
-                logging.error(f"Full JSON (first 2000 chars): {json_string[:2000]}")
-                raise
-    
-    # Should never reach here, but just in case
-    raise last_error
-
 @time_function
 def parse_input(input_string):
     # Safely evaluate the string to a dictionary
@@ -813,27 +1048,108 @@ def generate_cluster_hash(common_words):
 
 # Helper functions for cluster news system
 
+MISCELLANEOUS_CLUSTER_ID = 'miscellaneous'
+
+def is_miscellaneous_cluster(cluster):
+    return cluster.get('common_words') == ['Miscellaneous']
+
+@time_function
+def assign_cluster_ids(current_clusters, previous_clusters, min_overlap=0.5):
+    """
+    Cluster identity registry: give every current cluster a stable 'cluster_id'.
+
+    A current cluster inherits the id of the previous cluster it shares the most articles
+    with, measured as |A & B| / min(|A|, |B|) so that a story keeps its id while it grows or
+    while old articles expire. Matching is one-to-one (best overlaps first) and requires at
+    least `min_overlap`. Clusters that already carry an id known to the previous run (online
+    mode) keep it; unmatched clusters get a fresh id. Mutates and returns current_clusters.
+    """
+    previous_clusters = [c for c in (previous_clusters or []) if isinstance(c, dict)]
+    previous_links = []
+    link_index = {}
+    for idx, cluster in enumerate(previous_clusters):
+        links = set(a['link'] for a in cluster.get('articles', []) if a.get('link'))
+        previous_links.append(links)
+        for link in links:
+            link_index.setdefault(link, []).append(idx)
+
+    previous_ids = {
+        cluster.get('cluster_id'): idx
+        for idx, cluster in enumerate(previous_clusters)
+        if cluster.get('cluster_id')
+    }
+
+    used_previous = set()
+    used_current = set()
+
+    # Ids that survived from the previous run (e.g. online clustering state) win outright
+    for i, cluster in enumerate(current_clusters):
+        if is_miscellaneous_cluster(cluster):
+            cluster['cluster_id'] = MISCELLANEOUS_CLUSTER_ID
+            used_current.add(i)
+        elif cluster.get('cluster_id') in previous_ids:
+            used_previous.add(previous_ids[cluster['cluster_id']])
+            used_current.add(i)
+
+    candidates = []
+    for i, cluster in enumerate(current_clusters):
+        if i in used_current:
+            continue
+        links = set(a['link'] for a in cluster.get('articles', []) if a.get('link'))
+        shared = Counter()
+        for link in links:
+            for idx in link_index.get(link, ()):
+                shared[idx] += 1
+        for idx, count in shared.items():
+            if is_miscellaneous_cluster(previous_clusters[idx]):
+                continue
+            overlap = count / max(1, min(len(links), len(previous_links[idx])))
+            if overlap >= min_overlap:
+                candidates.append((overlap, count, i, idx))
+
+    for overlap, count, i, idx in sorted(candidates, reverse=True):
+        if i in used_current or idx in used_previous:
+            continue
+        previous_id = previous_clusters[idx].get('cluster_id') or uuid.uuid4().hex[:12]
+        current_clusters[i]['cluster_id'] = previous_id
+        used_current.add(i)
+        used_previous.add(idx)
+
+    for i, cluster in enumerate(current_clusters):
+        if i not in used_current and not cluster.get('cluster_id'):
+            cluster['cluster_id'] = uuid.uuid4().hex[:12]
+
+    return current_clusters
+
+def cluster_identity(cluster):
+    """Stable id from the registry when present, otherwise the legacy common-words hash."""
+    return cluster.get('cluster_id') or generate_cluster_hash(cluster['common_words'])
+
 @time_function
 def calculate_cluster_difference(current_clusters, previous_clusters):
     """
     Calculate how much the clusters changed.
     Returns a value between 0 (identical) and 1 (completely different).
-    Different common_words = different cluster identity.
+    Clusters are identified by their registry 'cluster_id' (see assign_cluster_ids); stored
+    clusters from before the registry existed fall back to a hash of their common_words.
     
     IMPORTANT: For existing clusters, only counts NEW articles added (not removals).
     We only want to regenerate summaries when there's NEW information, not less information.
     """
     if not previous_clusters:
         return 1.0  # No previous clusters, 100% different
-    
-    # Create cluster signatures based on common words (cluster identity)
+
+    # Legacy summaries have no ids; compare both sides by common-words hash in that case
+    use_ids = all(cluster.get('cluster_id') for cluster in previous_clusters)
+    identity = cluster_identity if use_ids else (lambda cluster: generate_cluster_hash(cluster['common_words']))
+
     current_sigs = {
-        generate_cluster_hash(cluster['common_words']): set(a['link'] for a in cluster['articles'])
+        identity(cluster): set(a['link'] for a in cluster['articles'])
         for cluster in current_clusters
     }
     
     previous_sigs = {
-        generate_cluster_hash(cluster['common_words']): set(a['link'] for a in cluster['articles'])
+        identity(cluster): set(a['link'] for a in cluster['articles'])
         for cluster in previous_clusters
     }
     
@@ -872,6 +1188,34 @@ def calculate_cluster_difference(current_clusters, previous_clusters):
     
     return change_percentage
 
+@time_function
+def reusable_cluster_summaries(current_clusters, previous_clusters, previous_summaries, new_article_threshold=0.40):
+    """
+    For each current cluster, return the previous summary text of the same story (matched by
+    cluster_id) if less than `new_article_threshold` of its articles are new, else None.
+    previous_summaries is aligned with previous_clusters, as stored on Summary.
+    """
+    previous_summaries = previous_summaries if isinstance(previous_summaries, list) else []
+    previous_by_id = {}
+    for cluster, summary_text in zip(previous_clusters or [], previous_summaries):
+        if cluster.get('cluster_id') and summary_text and not summary_text.startswith("Error generating summary"):
+            previous_by_id[cluster['cluster_id']] = (
+                set(a['link'] for a in cluster.get('articles', [])),
+                summary_text
+            )
+
+    reusable = []
+    for cluster in current_clusters:
+        match = previous_by_id.get(cluster.get('cluster_id'))
+        if not match:
+            reusable.append(None)
+            continue
+        previous_links, summary_text = match
+        current_links = set(a['link'] for a in cluster['articles'])
+        new_share = len(current_links - previous_links) / max(1, len(current_links))
+        reusable.append(summary_text if new_share < new_article_threshold else None)
+    return reusable
+
 @time_function
 def calculate_summary_difference(current_summaries, previous_summaries):
     """
@@ -919,9 +1263,117 @@ def clean_clusters_for_storage(clusters):
             ],
             "common_words": cluster.get("common_words", [])
         }
+        if cluster.get("cluster_id"):
+            cleaned_item["cluster_id"] = cluster["cluster_id"]
         cleaned_data.append(cleaned_item)
     return cleaned_data
 
+def extract_words_for_article(article, title_only=False, all_words=False):
+    """Significant words for one article: title words first, then new words from the content."""
+    if title_only:
+        return extract_significant_words(article['title'], title_only=True, all_words=all_words)
+    title_words = extract_significant_words(article['title'], title_only=False, all_words=all_words)
+    content_words = extract_significant_words(article['content'], title_only=False, all_words=all_words)
+    return title_words + [w for w in content_words if w not in title_words]
+
+@time_function
+def extract_article_words(articles, title_only=False, all_words=False):
+    """
+    Extract significant words for every article (stored on article['significant_words'])
+    and sort each article's words by rarity across the whole set.
+    """
+    word_counts = Counter()
+    for article in articles:
+        try:
+            article['significant_words'] = extract_words_for_article(article, title_only, all_words)
+            word_counts.update(article['significant_words'])
+        except Exception as e:
+            logging.error(f"Error processing words for article {article.get('title', 'Unknown')}: {str(e)}")
+            article['significant_words'] = []
+            continue
+
+    # Sort words by rarity for each article
+    for article in articles:
+        try:
+            article['significant_words'] = sort_words_by_rarity(
+                article['significant_words'], word_counts
+            )
+        except Exception as e:
+            logging.error(f"Error sorting words for article {article.get('title', 'Unknown')}: {str(e)}")
+            continue
+
+    return word_counts
+
+@time_function
+def run_clustering_pipeline(articles, common_word_threshold=2, top_words_to_consider=3,
+                            merge_threshold=2, min_articles=3, join_percentage=0.5,
+                            final_merge_percentage=0.5, title_only=False, all_words=False,
+                            clustering_mode='greedy'):
+    """
+    Extract significant words and cluster the articles.
+
+    clustering_mode:
+      - 'greedy':  common-word matching, merging and miscellaneous reassignment (default)
+      - 'density': TF-IDF + HDBSCAN (see clustering.cluster_articles_density), which scales
+                   to 10k+ articles; min_articles is used as the minimum cluster size
+    Both modes return [{'common_words': [...], 'articles': [...]}, ...].
+    """
+    extract_article_words(articles, title_only, all_words)
+
+    if clustering_mode == 'density':
+        return cluster_articles_density(
+            articles,
+            min_cluster_size=max(2, min_articles),
+            top_words=top_words_to_consider,
+            title_only=title_only,
+        )
+
+    if clustering_mode != 'greedy':
+        raise ValueError(f"Unknown clustering mode: {clustering_mode}")
+
+    clusters = cluster_articles(
+        articles, common_word_threshold, top_words_to_consider, title_only
+    )
+    merged_clusters = merge_clusters(clusters, merge_threshold)
+    clusters_with_min_articles = apply_minimum_articles_and_reassign(
+        merged_clusters, min_articles, join_percentage
+    )
+    return merge_clusters_by_percentage(
+        clusters_with_min_articles, final_merge_percentage
+    )
+
+@time_function
+def run_online_clustering(topic, articles, days_back=1, common_word_threshold=2,
+                          top_words_to_consider=3, min_articles=3, title_only=False, all_words=False):
+    """
+    Online clustering mode: only articles not already in topic.cluster_state get their words
+    extracted and assigned (see clustering.update_online_clusters); articles older than
+    `days_back` are expired. The updated state is saved back on the topic.
+    """
+    state = topic.cluster_state or {}
+    known_links = state.get('articles', {})
+
+    for article in articles:
+        if article.get('link') in known_links:
+            continue
+        try:
+            article['significant_words'] = extract_words_for_article(article, title_only, all_words)
+        except Exception as e:
+            logging.error(f"Error processing words for article {article.get('title', 'Unknown')}: {str(e)}")
+            article['significant_words'] = []
+
+    window_start = datetime.now(pytz.utc) - timedelta(days=days_back)
+    state, clusters = update_online_clusters(
+        state, articles, window_start,
+        common_word_threshold=common_word_threshold,
+        top_words_to_consider=top_words_to_consider,
+        min_articles=min_articles,
+    )
+
+    topic.cluster_state = state
+    topic.save(update_fields=['cluster_state'])
+    return clusters
+
 @contextmanager
 @time_function
 def timeout(seconds):
@@ -937,45 +1389,199 @@ def timeout(seconds):
         signal.alarm(0)
         signal.signal(signal.SIGALRM, original_handler)
 
+###############################################################################
+# Article selection and the large-topic (memory-bounded) pipeline
+###############################################################################
+def article_age_hours(article, now=None):
+    now = now or datetime.now(pytz.utc)
+    published = parse_datetime_safe(article.get('published'))
+    if published == datetime.min.replace(tzinfo=pytz.utc):
+        return None
+    return max(0.0, (now - published).total_seconds() / 3600)
+
 @time_function
-def process_topic(topic, days_back=1, common_word_threshold=2, top_words_to_consider=3,
-                 merge_threshold=2, min_articles=3, join_percentage=0.5,
-                 final_merge_percentage=0.5, sentences_final_summary=3, title_only=False, all_words=False):
+def select_articles_for_llm(cluster, limit=25, half_life_hours=12):
+    """
+    Rank a cluster's articles by relevance to the cluster and by recency, and return the
+    top `limit`. Relevance is the share of the cluster's most frequent words an article
+    contains; recency decays exponentially with the given half-life. Undated articles
+    (e.g. links extracted from Google News descriptions) get a neutral recency score.
+    """
+    articles = cluster.get('articles', [])
+    if len(articles) <= limit:
+        return list(articles)
+
+    word_counts = Counter()
+    for article in articles:
+        word_counts.update(article.get('significant_words', [])[:10])
+    core_words = set(word for word, _ in word_counts.most_common(10)) | set(cluster.get('common_words', []))
+
+    now = datetime.now(pytz.utc)
+
+    def score(article):
+        words = set(article.get('significant_words', []))
+        relevance = len(words & core_words) / max(1, len(core_words))
+        age = article_age_hours(article, now)
+        recency = 0.5 if age is None else math.pow(0.5, age / half_life_hours)
+        return relevance + recency
+
+    return sorted(articles, key=score, reverse=True)[:limit]
+
+def compact_article(article, max_content_chars=2000):
+    """
+    Compact record for large topics: HTML stripped and text truncated, keeping only the
+    fields the pipeline and storage need.
+    """
+    return {
+        'title': article.get('title', ''),
+        'link': article.get('link', ''),
+        'published': article.get('published'),
+        'summary': strip_html(article.get('summary', ''))[:500],
+        'content': strip_html(article.get('content', ''))[:max_content_chars],
+        'favicon': article.get('favicon', ''),
+    }
+
+def estimate_record_bytes(record):
+    # Rough in-memory cost of a compact record (string payloads plus dict/str overhead)
+    return 400 + sum(len(value) for value in record.values() if isinstance(value, str))
+
+@time_function
+def collect_articles_within_budget(sources, days_back=1, memory_budget_mb=256, max_content_chars=2000):
+    """
+    Stream articles from every source into compact records while staying under a fixed
+    memory budget. Each feed is compacted as soon as it is fetched and its raw entries are
+    dropped; when the budget is exceeded the oldest records are evicted first.
+
+    Returns (articles, stats) where stats has seen / kept / evicted / failed_sources.
+    """
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    records = {}
+    heap = []  # (timestamp, sequence, link) -> oldest first
+    total_bytes = 0
+    seen = 0
+    evicted = 0
+    sequence = 0
+    failed_sources = []
+
+    for url in sources:
+        try:
+            with timeout(60):
+                raw_articles = get_articles_from_rss(url, days_back)
+        except TimeoutError:
+            logging.error(f"Timeout processing source {url}")
+            failed_sources.append((url, "Timeout"))
+            continue
+        except Exception as e:
+            logging.error(f"Error fetching RSS from {url}: {str(e)}")
+            failed_sources.append((url, str(e)))
+            continue
+
+        if not raw_articles:
+            failed_sources.append((url, "No articles retrieved"))
+            continue
+
+        for raw in raw_articles:
+            seen += 1
+            link = raw.get('link')
+            if not link or link in records:
+                continue
+            record = compact_article(raw, max_content_chars)
+            records[link] = record
+            total_bytes += estimate_record_bytes(record)
+            sequence += 1
+            heapq.heappush(heap, (parse_datetime_safe(record['published']).timestamp(), sequence, link))
+
+            while total_bytes > budget_bytes and heap:
+                _, _, oldest_link = heapq.heappop(heap)
+                oldest = records.pop(oldest_link)
+                total_bytes -= estimate_record_bytes(oldest)
+                evicted += 1
+        del raw_articles
+
+    stats = {
+        'seen': seen,
+        'kept': len(records),
+        'evicted': evicted,
+        'bytes': total_bytes,
+        'failed_sources': failed_sources,
+    }
+    logging.info(
+        f"Large-topic collection: {seen} seen, {len(records)} kept, {evicted} evicted, "
+        f"~{total_bytes / (1024 * 1024):.1f} MB of {memory_budget_mb} MB budget"
+    )
+    return list(records.values()), stats
+
+@time_function
+def llm_cluster_view(cluster, limit=25):
+    """Copy of a cluster restricted to the articles selected for the LLM."""
+    view = dict(cluster)
+    view['articles'] = select_articles_for_llm(cluster, limit)
+    return view
+
+@time_function
+def prepare_topic(topic, days_back=1, common_word_threshold=2, top_words_to_consider=3,
+                  merge_threshold=2, min_articles=3, join_percentage=0.5,
+                  final_merge_percentage=0.5, title_only=False, all_words=False,
+                  clustering_mode='greedy', max_articles=DEFAULT_MAX_ARTICLES, large_topic=False,
+                  memory_budget_mb=256, llm_articles_per_cluster=25):
+    """
+    Fetch and cluster one topic and build the cluster summaries for its final summary prompt.
+    Returns {'clusters', 'cluster_summaries', 'number_of_articles'}, or None if the topic
+    has nothing to summarize.
+
+    By default at most `max_articles` articles (the most recent) are clustered. With
+    large_topic=True there is no cap: articles are streamed into compact records within
+    `memory_budget_mb`, clustered with the density engine, and only the
+    `llm_articles_per_cluster` most relevant/recent articles of each cluster go to the LLM.
+    """
 
     try:
         logging.info(f"Starting processing for topic: {topic.name}")
         logging.info(f"Title-only mode: {title_only}")
         logging.info(f"All-words mode: {all_words}")
+        logging.info(f"Clustering mode: {clustering_mode}")
 
         # Validate topic configuration
         if not topic.sources:
             logging.warning(f"Topic {topic.name} has no sources, skipping")
             return
 
-        # Initialize article collection
-        all_articles = []
-        failed_sources = []
-        successful_sources = []
+        if large_topic:
+            # Memory-bounded streaming collection of compact records; no article cap
+            all_articles, collection_stats = collect_articles_within_budget(
+                topic.sources, days_back, memory_budget_mb
+            )
+            failed_sources = collection_stats['failed_sources']
+            failed_urls = set(url for url, _ in failed_sources)
+            successful_sources = [url for url in topic.sources if url not in failed_urls]
+            if clustering_mode == 'greedy':
+                logging.info("Large-topic mode: using density clustering instead of greedy matching")
+                clustering_mode = 'density'
+        else:
+            # Initialize article collection
+            all_articles = []
+            failed_sources = []
+            successful_sources = []
         
-        # Process each RSS source with timeout and error handling
-        for url in topic.sources:
-            try:
-                with timeout(60):  # 60-second timeout per source
-                    articles = get_articles_from_rss(url, days_back)
-                    if articles:
-                        all_articles.extend(articles)
-                        successful_sources.append(url)
-                        logging.info(f"Successfully retrieved {len(articles)} articles from {url}")
-                    else:
-                        failed_sources.append((url, "No articles retrieved"))
-            except TimeoutError:
-                logging.error(f"Timeout processing source {url}")
-                failed_sources.append((url, "Timeout"))
-                continue
-            except Exception as e:
-                logging.error(f"Error fetching RSS from {url}: {str(e)}")
-                failed_sources.append((url, str(e)))
-                continue
+            # Process each RSS source with timeout and error handling
+            for url in topic.sources:
+                try:
+                    with timeout(60):  # 60-second timeout per source
+                        articles = get_articles_from_rss(url, days_back)
+                        if articles:
+                            all_articles.extend(articles)
+                            successful_sources.append(url)
+                            logging.info(f"Successfully retrieved {len(articles)} articles from {url}")
+                        else:
+                            failed_sources.append((url, "No articles retrieved"))
+                except TimeoutError:
+                    logging.error(f"Timeout processing source {url}")
+                    failed_sources.append((url, "Timeout"))
+                    continue
+                except Exception as e:
+                    logging.error(f"Error fetching RSS from {url}: {str(e)}")
+                    failed_sources.append((url, str(e)))
+                    continue
 
         # Log source processing results
         logging.info(f"Successfully processed {len(successful_sources)} sources for topic {topic.name}")
@@ -990,61 +1596,24 @@ def process_topic(topic, days_back=1, common_word_threshold=2, top_words_to_cons
         number_of_articles = len(all_articles)
         logging.info(f"Total articles collected: {number_of_articles}")
         
-        # Cap the total number of articles
-        all_articles = all_articles[:777]
-        number_of_articles = len(all_articles)
-        logging.info(f"⚠️ Article list trimmed to 777 max. Final count: {number_of_articles}")
+        if not large_topic:
+            # Cap the total number of articles, keeping the most recent ones
+            all_articles = select_recent_articles(all_articles, max_articles)
+            number_of_articles = len(all_articles)
+            logging.info(f"Article list capped at {max_articles} most recent. Final count: {number_of_articles}")
 
         try:
-            # Extract and count significant words with memory management
-            word_counts = Counter()
-            for article in all_articles:
-                try:
-                    if title_only:
-                        article['significant_words'] = extract_significant_words(
-                            article['title'], title_only=True, all_words=all_words
-                        )
-                    else:
-                        title_words = extract_significant_words(
-                            article['title'], title_only=False, all_words=all_words
-                        )
-                        content_words = extract_significant_words(
-                            article['content'], title_only=False, all_words=all_words
-                        )
-                        article['significant_words'] = title_words + [
-                            w for w in content_words if w not in title_words
-                        ]
-                    word_counts.update(article['significant_words'])
-                except Exception as e:
-                    logging.error(f"Error processing words for article {article.get('title', 'Unknown')}: {str(e)}")
-                    continue
-
-            # Sort words by rarity for each article
-            for article in all_articles:
-                try:
-                    article['significant_words'] = sort_words_by_rarity(
-                        article['significant_words'], word_counts
-                    )
-                except Exception as e:
-                    logging.error(f"Error sorting words for article {article.get('title', 'Unknown')}: {str(e)}")
-                    continue
-
-            # Cluster articles with error handling
+            # Extract words and cluster articles with error handling
             try:
-                clusters = cluster_articles(
-                    all_articles, common_word_threshold, top_words_to_consider, title_only
-                )
-                merged_clusters = merge_clusters(clusters, merge_threshold)
-                clusters_with_min_articles = apply_minimum_articles_and_reassign(
-                    merged_clusters, min_articles, join_percentage
-                )
-                final_clusters = merge_clusters_by_percentage(
-                    clusters_with_min_articles, final_merge_percentage
+                final_clusters = run_clustering_pipeline(
+                    all_articles, common_word_threshold, top_words_to_consider,
+                    merge_threshold, min_articles, join_percentage,
+                    final_merge_percentage, title_only, all_words, clustering_mode
                 )
 
                 logging.info(f"Generated {len(final_clusters)} clusters for topic {topic.name}")
-                print_clusters(final_clusters)
-
+                if not large_topic:
+                    print_clusters(final_clusters)
 
             except Exception as e:
                 logging.error(f"Error in clustering process for topic {topic.name}: {str(e)}")
@@ -1054,101 +1623,299 @@ def process_topic(topic, days_back=1, common_word_threshold=2, top_words_to_cons
                 f"Cluster with common words: {', '.join(cluster['common_words'])}\n\n" +
                 "\n\n".join(
                     f"Title: {article['title']}\nURL: {article['link']}\nSummary: {article.get('summary', '')}"
-                    for article in cluster['articles']
+                    for article in (
+                        select_articles_for_llm(cluster, llm_articles_per_cluster)
+                        if large_topic else cluster['articles']
+                    )
                 )
                 for cluster in final_clusters
             ]
 
-            # Generate final summary with error handling
-            try:
-                final_summary_json = get_final_summary(
-                    cluster_summaries,
-                    sentences_final_summary,
-                    topic.prompt if topic.prompt else None,
-                    topic.organization.description if topic.organization.description else ""
-                )
+            return {
+                'clusters': final_clusters,
+                'cluster_summaries': cluster_summaries,
+                'number_of_articles': number_of_articles,
+            }
 
-                logging.info("----------- LOGGING SUMMARY GENERATION -----------")
-                logging.info(f"Organization description: {topic.organization.description}")
-                logging.info(f"Raw Gemini response (first 500 chars): {final_summary_json[:500]}...")
+        except Exception as e:
+            logging.error(f"Error in main processing loop for topic {topic.name}: {str(e)}")
 
-                # Parse JSON with repair logic
-                final_summary_data = parse_json_with_repair(final_summary_json)
+    except Exception as e:
+        logging.error(f"Critical error processing topic {topic.name}: {str(e)}")
+        # Could add notification system here for critical errors
 
-                logging.info(f"Successfully parsed summary JSON: {json.dumps(final_summary_data, indent=2)}")
+    return None
 
-            except Exception as e:
-                import traceback
-                error_trace = traceback.format_exc()
-                logging.error(f"Error generating final summary for {topic.name}: {str(e)}")
-                logging.error(f"Error type: {type(e).__name__}")
-                logging.error(f"Full traceback:\n{error_trace}")
-                
-                # Log more details about the error
-                if "GEMINI_KEY" in str(e) or "API key" in str(e):
-                    logging.error("⚠️ GEMINI_KEY environment variable is missing or invalid!")
-                elif "rate limit" in str(e).lower() or "quota" in str(e).lower():
-                    logging.error("⚠️ Gemini API rate limit or quota exceeded!")
-                elif "model" in str(e).lower():
-                    logging.error("⚠️ Gemini model error - check if 'gemini-2.5-flash-lite' is available!")
-                
-                final_summary_data = {
-                    "summary": [{"title": "Error", "content": f"Failed to generate summary: {str(e)}"}],
-                    "questions": ["What happened?", "Why did it happen?", "What's next?"],
-                }
+@time_function
+def save_topic_summary(topic, prepared, final_summary_data=None, error=None):
+    """
+    Create the Summary of a prepared topic (see prepare_topic) from its parsed final summary.
+    If generating the final summary failed, pass the exception as `error` to store the usual
+    placeholder summary instead.
+    """
+    try:
+        # Handle final summary errors
+        try:
+            if error is not None:
+                raise error
 
-            # Extract questions and clean clusters
-            questions = json.dumps(final_summary_data.get('questions', []))
-
-            # Clean clusters to prevent overwhelming the database
-            cleaned_data = []
-            for item in final_clusters:
-                cleaned_item = {
-                    "articles": [
-                        {
-                            "title": article["title"],
-                            "link": article["link"],
-                            "favicon": article["favicon"]
-                        }
-                        for article in item.get("articles", [])
-                    ],
-                    "common_words": item.get("common_words", [])
-                }
-                cleaned_data.append(cleaned_item)
+            logging.info("----------- LOGGING SUMMARY GENERATION -----------")
+            logging.info(f"Organization description: {topic.organization.description}")
+            logging.info(f"Final summary JSON: {json.dumps(final_summary_data, indent=2)}")
 
-            # Create the summary in the database with error handling
-            try:
-                new_summary = Summary.objects.create(
-                    topic=topic,
-                    final_summary=final_summary_data,
-                    clusters=cleaned_data,
-                    cluster_summaries=cluster_summaries,
-                    number_of_articles=number_of_articles,
-                    questions=questions
-                )
-                logging.info(f"Successfully created summary for topic {topic.name}")
-                print(f"SUMMARY for {topic.name} created:")
-                print(final_summary_data)
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            logging.error(f"Error generating final summary for {topic.name}: {str(e)}")
+            logging.error(f"Error type: {type(e).__name__}")
+            logging.error(f"Full traceback:\n{error_trace}")
+            
+            # Log more details about the error
+            if "GEMINI_KEY" in str(e) or "API key" in str(e):
+                logging.error("⚠️ GEMINI_KEY environment variable is missing or invalid!")
+            elif "rate limit" in str(e).lower() or "quota" in str(e).lower():
+                logging.error("⚠️ Gemini API rate limit or quota exceeded!")
+            elif "model" in str(e).lower():
+                logging.error(f"⚠️ Gemini model error - check if '{summary_model()}' is available!")
+            
+            final_summary_data = {
+                "summary": [{"title": "Error", "content": f"Failed to generate summary: {str(e)}"}],
+                "questions": ["What happened?", "Why did it happen?", "What's next?"],
+            }
+
+        # Extract questions and clean clusters
+        questions = json.dumps(final_summary_data.get('questions', []))
+
+        # Clean clusters to prevent overwhelming the database
+        cleaned_data = []
+        for item in prepared['clusters']:
+            cleaned_item = {
+                "articles": [
+                    {
+                        "title": article["title"],
+                        "link": article["link"],
+                        "favicon": article["favicon"]
+                    }
+                    for article in item.get("articles", [])
+                ],
+                "common_words": item.get("common_words", [])
+            }
+            cleaned_data.append(cleaned_item)
 
-            except Exception as e:
-                logging.error(f"Database error creating summary for {topic.name}: {str(e)}")
-                # Could implement a retry mechanism here if needed
+        # Create the summary in the database with error handling
+        try:
+            new_summary = Summary.objects.create(
+                topic=topic,
+                final_summary=final_summary_data,
+                clusters=cleaned_data,
+                cluster_summaries=prepared['cluster_summaries'],
+                number_of_articles=prepared['number_of_articles'],
+                questions=questions
+            )
+            logging.info(f"Successfully created summary for topic {topic.name}")
+            warm_chat_context(new_summary, topic)
+            update_topic_index(topic, new_summary)
+            print(f"SUMMARY for {topic.name} created:")
+            print(final_summary_data)
 
         except Exception as e:
-            logging.error(f"Error in main processing loop for topic {topic.name}: {str(e)}")
+            logging.error(f"Database error creating summary for {topic.name}: {str(e)}")
+            # Could implement a retry mechanism here if needed
 
     except Exception as e:
-        logging.error(f"Critical error processing topic {topic.name}: {str(e)}")
-        # Could add notification system here for critical errors
+        logging.error(f"Error saving summary for topic {topic.name}: {str(e)}")
+
+###############################################################################
+# Cross-organization dedup: identical topic work is computed once per run
+###############################################################################
+def topic_pipeline_key(topic, **params):
+    """
+    Content address of a topic's prepare_topic result: its normalized source set plus the
+    fetch/clustering parameters. Topics of different organizations with the same sources share it.
+    """
+    sources = sorted(set(normalize_rss_url(url) for url in (topic.sources or []) if url))
+    payload = json.dumps({'sources': sources, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def final_summary_key(pipeline_key, sentences_final_summary, topic_prompt=None, organization_description=""):
+    """
+    Content address of a final summary: the prepared clusters it is built from plus everything
+    that is topic/org specific in the prompt (the topic prompt and the organization description,
+    which drives the insight lines).
+    """
+    description_hash = hashlib.sha256((organization_description or "").encode('utf-8')).hexdigest()
+    payload = json.dumps([pipeline_key, sentences_final_summary, topic_prompt or "", description_hash])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def prepare_topic_shared(topic, prepared_results, **params):
+    """prepare_topic() through the run's store of results by topic_pipeline_key."""
+    pipeline_key = topic_pipeline_key(topic, **params)
+    if pipeline_key in prepared_results:
+        logging.info(f"♻️ Reusing clusters of a topic with identical sources for {topic.name}")
+    else:
+        prepared_results[pipeline_key] = prepare_topic(topic, **params)
+    return pipeline_key, prepared_results[pipeline_key]
+
+
+def summarize_prepared_topic(topic, prepared, pipeline_key, sentences_final_summary, final_summaries):
+    """
+    Generate (or reuse from `final_summaries`, keyed by final_summary_key) the final summary of a
+    prepared topic and save its Summary.
+    """
+    topic_prompt = topic.prompt if topic.prompt else None
+    organization_description = topic.organization.description if topic.organization.description else ""
+    summary_key = final_summary_key(pipeline_key, sentences_final_summary, topic_prompt, organization_description)
+
+    final_summary_data = final_summaries.get(summary_key)
+    if final_summary_data is not None:
+        logging.info(f"♻️ Reusing final summary of an identical topic for {topic.name}")
+    else:
+        try:
+            final_summary_data = get_final_summary(
+                prepared['cluster_summaries'],
+                sentences_final_summary,
+                topic_prompt,
+                organization_description
+            )
+        except Exception as e:
+            save_topic_summary(topic, prepared, error=e)
+            return
+        final_summaries[summary_key] = final_summary_data
+
+    save_topic_summary(topic, prepared, final_summary_data)
+
+
+@time_function
+def process_topic(topic, days_back=1, common_word_threshold=2, top_words_to_consider=3,
+                 merge_threshold=2, min_articles=3, join_percentage=0.5,
+                 final_merge_percentage=0.5, sentences_final_summary=3, title_only=False, all_words=False,
+                 clustering_mode='greedy', max_articles=DEFAULT_MAX_ARTICLES, large_topic=False,
+                 memory_budget_mb=256, llm_articles_per_cluster=25, prepared_results=None, final_summaries=None):
+    """
+    Fetch, cluster and summarize one topic and save a Summary
+    (prepare_topic -> get_final_summary -> save_topic_summary).
+
+    `prepared_results` and `final_summaries` are the run's stores of shared results (see
+    process_all_topics); topics with identical inputs reuse them instead of recomputing.
+    """
+    try:
+        with llm.usage_scope(organization_id=topic.organization_id, topic_id=topic.id):
+            pipeline_key, prepared = prepare_topic_shared(
+                topic,
+                {} if prepared_results is None else prepared_results,
+                days_back=days_back,
+                common_word_threshold=common_word_threshold,
+                top_words_to_consider=top_words_to_consider,
+                merge_threshold=merge_threshold,
+                min_articles=min_articles,
+                join_percentage=join_percentage,
+                final_merge_percentage=final_merge_percentage,
+                title_only=title_only,
+                all_words=all_words,
+                clustering_mode=clustering_mode,
+                max_articles=max_articles,
+                large_topic=large_topic,
+                memory_budget_mb=memory_budget_mb,
+                llm_articles_per_cluster=llm_articles_per_cluster
+            )
+            if not prepared:
+                return
+
+            summarize_prepared_topic(
+                topic, prepared, pipeline_key, sentences_final_summary,
+                {} if final_summaries is None else final_summaries
+            )
     finally:
         logging.info(f"Finished processing topic: {topic.name}")
 
+
+@time_function
+def run_batched_final_summaries(batched_topics, sentences_final_summary, final_summaries,
+                                backend='gemini', batch_dir=None):
+    """
+    Generate the final summaries of prepared topics as one batch job and save them.
+    `batched_topics` holds (topic, prepared, pipeline_key); topics with the same
+    final_summary_key share one batch request.
+    """
+    prompts = {}
+    for topic, prepared, pipeline_key in batched_topics:
+        topic_prompt = topic.prompt if topic.prompt else None
+        organization_description = topic.organization.description if topic.organization.description else ""
+        summary_key = final_summary_key(pipeline_key, sentences_final_summary, topic_prompt, organization_description)
+        if summary_key not in prompts and summary_key not in final_summaries:
+            prompts[summary_key] = build_final_summary_prompt(
+                prepared['cluster_summaries'],
+                sentences_final_summary,
+                topic_prompt,
+                organization_description
+            )
+
+    try:
+        results = summary_batch.run_summary_batch(
+            prompts, summary_model(), backend, batch_dir, response_schema=FINAL_SUMMARY_SCHEMA
+        )
+    except Exception as e:
+        logging.error(f"❌ Final summary batch failed, falling back to synchronous calls: {str(e)}")
+        results = {}
+
+    for summary_key, (text, error) in results.items():
+        if text is None:
+            logging.warning(f"Batch result {summary_key[:12]} failed ({error}), retrying synchronously")
+            continue
+        try:
+            final_summaries[summary_key] = llm.parse_json(text)
+        except ValueError as e:
+            logging.warning(f"Batch result {summary_key[:12]} is not valid JSON ({e}), retrying synchronously")
+
+    # Topics without a usable batch result get a synchronous call in summarize_prepared_topic
+    for topic, prepared, pipeline_key in batched_topics:
+        try:
+            with llm.usage_scope(organization_id=topic.organization_id, topic_id=topic.id):
+                summarize_prepared_topic(topic, prepared, pipeline_key, sentences_final_summary, final_summaries)
+        finally:
+            logging.info(f"Finished processing topic: {topic.name}")
+
+
 @time_function
 def process_all_topics(days_back=1, common_word_threshold=2, top_words_to_consider=3,
                       merge_threshold=2, min_articles=3, join_percentage=0.5,
-                      final_merge_percentage=0.5, sentences_final_summary=3, title_only=False, all_words=False, force=False):
+                      final_merge_percentage=0.5, sentences_final_summary=3, title_only=False, all_words=False, force=False,
+                      clustering_mode='greedy', max_articles=DEFAULT_MAX_ARTICLES, large_topic=False,
+                      memory_budget_mb=256, batch=False, batch_backend='gemini', batch_dir=None):
+    """
+    Summarize every topic of every active organization.
+
+    Work is content-addressed within the run: topics whose sources and parameters match share
+    one fetch/cluster/cluster-summary result (topic_pipeline_key), and topics that also share
+    the topic prompt and organization description share the final summary (final_summary_key).
+    Each topic still gets its own Summary.
+
+    With batch=True topics are only prepared (fetched and clustered) in the loop; all final
+    summary prompts are then sent as one batch job (see summary_batch) and the Summaries are
+    saved once the results are in. Topics without a batch result fall back to a synchronous call.
+    """
     
     logging.info("==== Starting process_all_topics ====")
+    prepare_params = dict(
+        days_back=days_back,
+        common_word_threshold=common_word_threshold,
+        top_words_to_consider=top_words_to_consider,
+        merge_threshold=merge_threshold,
+        min_articles=min_articles,
+        join_percentage=join_percentage,
+        final_merge_percentage=final_merge_percentage,
+        title_only=title_only,
+        all_words=all_words,
+        clustering_mode=clustering_mode,
+        max_articles=max_articles,
+        large_topic=large_topic,
+        memory_budget_mb=memory_budget_mb,
+    )
+    prepared_results = {}  # topic_pipeline_key -> prepare_topic result
+    final_summaries = {}  # final_summary_key -> parsed final summary
+    batched_topics = []
     
     # Get all active organizations (no time check - process all every time)
     active_organizations = Organization.objects.exclude(plan='inactive')
@@ -1177,14 +1944,32 @@ def process_all_topics(days_back=1, common_word_threshold=2, top_words_to_consid
             logging.error(f"❌ Error deleting old summaries for {organization.name}: {str(e)}")
 
         for topic in organization.topics.all():
+            if batch:
+                try:
+                    with llm.usage_scope(organization_id=topic.organization_id, topic_id=topic.id):
+                        pipeline_key, prepared = prepare_topic_shared(topic, prepared_results, **prepare_params)
+                    if prepared:
+                        batched_topics.append((topic, prepared, pipeline_key))
+                except Exception as e:
+                    logging.error(f"❌ Failed to prepare topic {topic.name}: {str(e)}")
+                continue
+
             try:
-                process_topic(topic, days_back, common_word_threshold, top_words_to_consider,
-                              merge_threshold, min_articles, join_percentage,
-                              final_merge_percentage, sentences_final_summary, title_only, all_words)
+                process_topic(topic, sentences_final_summary=sentences_final_summary,
+                              prepared_results=prepared_results, final_summaries=final_summaries,
+                              **prepare_params)
             except Exception as e:
                 logging.error(f"❌ Failed to process topic {topic.name}: {str(e)}")
                 continue
 
+    if batch:
+        run_batched_final_summaries(batched_topics, sentences_final_summary, final_summaries,
+                                    batch_backend, batch_dir)
+
+    logging.info(
+        f"Shared work: {len(prepared_results)} distinct topic pipelines, "
+        f"{len(final_summaries)} distinct final summaries"
+    )
     logging.info("==== Finished process_all_topics ====")
 
     # Log total time per function
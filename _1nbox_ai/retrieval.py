@@ -0,0 +1,203 @@
+"""
+Per-topic vector index for picking chat and Q&A context.
+
+When a summary lands, its cluster summaries (split into passages) and every article title are
+embedded and stored as one TopicVectorIndex per topic: passages as JSON and their normalized
+vectors as a float32 matrix. Passages whose text was already in the previous index reuse
+their vectors, so an update only embeds what is new. A question is answered with the top-k
+passages by cosine similarity (a brute-force matrix product, which stays well under a
+millisecond for the few thousand passages a topic has) instead of the whole summary.
+
+Embeddings come from Gemini (llm.embed). Without it (RETRIEVAL_EMBEDDINGS=hashing, record/
+replay runs, or when the embedding call fails) a local signed feature-hashing embedding is
+used; the index records which one built it and queries use the same.
+"""
+import os
+import re
+import hashlib
+import logging
+
+from django.utils import timezone
+
+from . import llm
+from . import llm_replay
+from .models import TopicVectorIndex
+
+# numpy is only needed for retrieval; without it callers fall back to the full summary context
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RETRIEVAL_EMBEDDINGS = os.environ.get('RETRIEVAL_EMBEDDINGS', 'gemini').lower()
+HASHING_DIMENSIONS = 1024
+HASHING_MODEL = f"hashing-{HASHING_DIMENSIONS}"
+# Cluster summaries are split on paragraph boundaries into passages of about this size
+PASSAGE_CHARS = 1500
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def passage_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def split_passages(text, max_chars=PASSAGE_CHARS):
+    """Split text into passages of whole paragraphs, each at most max_chars (unless one paragraph is longer)."""
+    passages = []
+    current = ""
+    for paragraph in PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+def summary_passages(summary):
+    """Indexable passages of a summary: cluster summary passages and one per distinct article."""
+    passages = []
+    for cluster_summary in summary.cluster_summaries or []:
+        if not isinstance(cluster_summary, str) or cluster_summary.startswith('Error generating'):
+            continue
+        for text in split_passages(cluster_summary):
+            passages.append({'kind': 'cluster', 'text': text})
+
+    seen_links = set()
+    for cluster in summary.clusters or []:
+        for article in cluster.get('articles', []):
+            title = article.get('title', '')
+            link = article.get('link', '')
+            if not title or link in seen_links:
+                continue
+            seen_links.add(link)
+            passages.append({'kind': 'article', 'text': title, 'title': title, 'link': link})
+
+    for passage in passages:
+        passage['key'] = passage_key(passage['text'])
+    return passages
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def hashing_embed(texts):
+    """Signed feature hashing of lowercased word tokens; deterministic across processes."""
+    matrix = np.zeros((len(texts), HASHING_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in TOKEN_RE.findall(text.lower()):
+            digest = hashlib.md5(token.encode('utf-8')).digest()
+            column = int.from_bytes(digest[:4], 'little') % HASHING_DIMENSIONS
+            matrix[row, column] += 1 if digest[4] & 1 else -1
+    return _normalize(matrix)
+
+
+def embed_texts(texts, embedding_model, task_type):
+    """Normalized float32 embedding matrix of texts."""
+    if embedding_model == HASHING_MODEL:
+        return hashing_embed(texts)
+    vectors = llm.embed(texts, model=embedding_model, task_type=task_type, caller=f"retrieval.{task_type}")
+    return _normalize(np.asarray(vectors, dtype=np.float32))
+
+
+def default_embedding_model():
+    if RETRIEVAL_EMBEDDINGS == 'hashing' or llm_replay.LLM_MODE != 'live':
+        return HASHING_MODEL
+    return llm.EMBEDDING_MODEL
+
+
+def index_matrix(index):
+    if not index.dimensions:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.frombuffer(bytes(index.vectors), dtype=np.float32).reshape(-1, index.dimensions)
+
+
+def update_topic_index(topic, summary):
+    """(Re)build the topic's index from `summary`, reusing the vectors of unchanged passages."""
+    if np is None or summary is None:
+        return None
+
+    passages = summary_passages(summary)
+    embedding_model = default_embedding_model()
+
+    existing = TopicVectorIndex.objects.filter(topic=topic).first()
+    reusable = {}
+    if existing is not None and existing.embedding_model == embedding_model:
+        matrix = index_matrix(existing)
+        reusable = {passage['key']: matrix[i] for i, passage in enumerate(existing.passages)}
+
+    missing = [i for i, passage in enumerate(passages) if passage['key'] not in reusable]
+    try:
+        new_vectors = embed_texts([passages[i]['text'] for i in missing], embedding_model, 'retrieval_document') if missing else None
+    except Exception as e:
+        logging.warning(f"Embedding {len(missing)} passages of {topic.name} failed, using local embeddings: {str(e)}")
+        embedding_model = HASHING_MODEL
+        reusable = {}
+        missing = list(range(len(passages)))
+        new_vectors = hashing_embed([passage['text'] for passage in passages])
+
+    new_rows = dict(zip(missing, new_vectors)) if missing else {}
+    rows = [new_rows[i] if i in new_rows else reusable[passage['key']] for i, passage in enumerate(passages)]
+    matrix = np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+
+    index, _ = TopicVectorIndex.objects.update_or_create(
+        topic=topic,
+        defaults={
+            'summary': summary,
+            'embedding_model': embedding_model,
+            'dimensions': matrix.shape[1] if rows else 0,
+            'passages': passages,
+            'vectors': matrix.tobytes(),
+            'updated_at': timezone.now(),
+        }
+    )
+    logging.info(
+        f"Vector index for {topic.name}: {len(passages)} passages, "
+        f"{len(missing)} embedded with {embedding_model}"
+    )
+    return index
+
+
+def search_topic(topic, query, limits, summary_id=None):
+    """
+    Most relevant passages of the topic's index for `query` as {kind: [passage, ...]}, at
+    most limits[kind] per kind, best first. The index is built on first use, or rebuilt when
+    it is older than `summary_id`. Returns None when retrieval is unavailable.
+    """
+    if np is None:
+        return None
+    try:
+        index = TopicVectorIndex.objects.filter(topic=topic).first()
+        if index is None or (summary_id is not None and index.summary_id != summary_id):
+            index = update_topic_index(topic, topic.summaries.first())
+        if index is None or not index.passages:
+            return None
+
+        matrix = index_matrix(index)
+        query_vector = embed_texts([query], index.embedding_model, 'retrieval_query')[0]
+    except Exception as e:
+        logging.warning(f"Retrieval for {topic.name} unavailable: {str(e)}")
+        return None
+
+    scores = matrix @ query_vector
+    kinds = np.array([passage['kind'] for passage in index.passages])
+    results = {}
+    for kind, limit in limits.items():
+        candidates = np.flatnonzero(kinds == kind)
+        if limit <= 0 or not len(candidates):
+            results[kind] = []
+            continue
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        results[kind] = [dict(index.passages[i], score=float(scores[i])) for i in candidates]
+    return results
@@ -0,0 +1,183 @@
+"""
+Batch inference for the final summaries of a runnews run.
+
+Instead of one synchronous generate_content call per topic, every final-summary prompt of
+the run is written to a JSONL batch file (one {"key", "request"} line per topic), submitted
+as a single job and the responses are read back by key:
+  - 'gemini' submits the file through the Gemini Batch API (google-genai files/batches),
+    which is billed at the batch discount and not subject to the interactive rate limit,
+  - 'local' is a stand-in that runs the same file through the shared gateway with a small
+    thread pool and writes the results in the Batch API output format, for development and
+    for environments without batch access.
+"""
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import llm
+
+BATCH_POLL_SECONDS = int(os.environ.get('BATCH_POLL_SECONDS', 30))
+BATCH_TIMEOUT_SECONDS = int(os.environ.get('BATCH_TIMEOUT_SECONDS', 24 * 3600))
+BATCH_LOCAL_WORKERS = 4
+
+COMPLETED_STATES = {
+    'JOB_STATE_SUCCEEDED',
+    'JOB_STATE_FAILED',
+    'JOB_STATE_CANCELLED',
+    'JOB_STATE_EXPIRED',
+}
+
+
+def write_batch_file(prompts, path, response_schema=None):
+    """Write {key: prompt} as Batch API request lines, in JSON mode if a schema is given."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, prompt in prompts.items():
+            request = {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+            if response_schema is not None:
+                request['generationConfig'] = {
+                    'responseMimeType': 'application/json',
+                    'responseSchema': response_schema,
+                }
+            f.write(json.dumps({'key': key, 'request': request}) + '\n')
+
+
+def parse_batch_line(record):
+    """Return (text, error) for one Batch API output line."""
+    if record.get('error'):
+        return None, str(record['error'])
+
+    candidates = (record.get('response') or {}).get('candidates') or []
+    if not candidates:
+        return None, "No candidates in batch response"
+
+    candidate = candidates[0]
+    finish_reason = candidate.get('finishReason') or candidate.get('finish_reason')
+    if finish_reason in ('SAFETY', 'RECITATION'):
+        return None, f"Response blocked ({finish_reason})"
+
+    parts = (candidate.get('content') or {}).get('parts') or []
+    text = ''.join(part.get('text', '') for part in parts)
+    if not text:
+        return None, "Batch response contained no text"
+    return text, None
+
+
+def read_batch_results(path):
+    """Read a Batch API output file into {key: (text, error)}."""
+    results = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.error(f"Skipping malformed batch output line: {e}")
+                continue
+            results[record.get('key')] = parse_batch_line(record)
+    return results
+
+
+def run_gemini_batch(input_path, output_path, model, display_name):
+    """Submit `input_path` as a Gemini batch job, wait for it and download the results."""
+    client = llm.get_client()
+
+    uploaded = client.files.upload(
+        file=input_path,
+        config={'display_name': display_name, 'mime_type': 'jsonl'},
+    )
+    job = client.batches.create(model=model, src=uploaded.name, config={'display_name': display_name})
+    logging.info(f"Submitted batch job {job.name} ({display_name})")
+
+    deadline = time.monotonic() + BATCH_TIMEOUT_SECONDS
+    while job.state.name not in COMPLETED_STATES:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch job {job.name} did not finish within {BATCH_TIMEOUT_SECONDS}s")
+        time.sleep(BATCH_POLL_SECONDS)
+        job = client.batches.get(name=job.name)
+        logging.info(f"Batch job {job.name}: {job.state.name}")
+
+    if job.state.name != 'JOB_STATE_SUCCEEDED':
+        raise RuntimeError(f"Batch job {job.name} ended in state {job.state.name}: {getattr(job, 'error', None)}")
+
+    content = client.files.download(file=job.dest.file_name)
+    with open(output_path, 'wb') as f:
+        f.write(content)
+
+
+def _local_response(request, model):
+    generation_config = None
+    schema = request['request'].get('generationConfig', {}).get('responseSchema')
+    if schema is not None:
+        generation_config = llm.json_generation_config(schema)
+    try:
+        response = llm.generate(request['request']['contents'][0]['parts'][0]['text'],
+                                model=model, generation_config=generation_config,
+                                timeout=300, caller="news.final_summary_batch")
+    except Exception as e:
+        return {'key': request['key'], 'error': {'message': str(e)}}
+
+    finish_reason = None
+    if getattr(response, 'candidates', None):
+        finish_reason = getattr(response.candidates[0], 'finish_reason', None)
+        finish_reason = getattr(finish_reason, 'name', finish_reason)
+
+    return {
+        'key': request['key'],
+        'response': {'candidates': [{
+            'content': {'parts': [{'text': llm.response_text(response) or ''}]},
+            'finishReason': finish_reason,
+        }]},
+    }
+
+
+def run_local_batch(input_path, output_path, model, max_workers=BATCH_LOCAL_WORKERS):
+    """Run a batch file through the gateway and write the results in Batch API format."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        responses = list(executor.map(lambda request: _local_response(request, model), requests))
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for response in responses:
+            f.write(json.dumps(response) + '\n')
+
+
+def run_summary_batch(prompts, model, backend='gemini', batch_dir=None, response_schema=None):
+    """
+    Generate all `prompts` ({key: prompt}) as one batch and return {key: (text, error)}.
+    With `response_schema` every request runs in JSON mode against that schema.
+    Keys missing from the result were not answered; callers fall back to synchronous calls.
+    """
+    if not prompts:
+        return {}
+
+    batch_dir = batch_dir or os.path.join(os.getcwd(), 'batches')
+    os.makedirs(batch_dir, exist_ok=True)
+    display_name = f"final-summaries-{time.strftime('%Y%m%d-%H%M%S')}"
+    input_path = os.path.join(batch_dir, f"{display_name}.jsonl")
+    output_path = os.path.join(batch_dir, f"{display_name}.results.jsonl")
+
+    write_batch_file(prompts, input_path, response_schema)
+    logging.info(f"Wrote {len(prompts)} final summary requests to {input_path} ({backend} backend)")
+
+    start = time.perf_counter()
+    if backend == 'gemini':
+        run_gemini_batch(input_path, output_path, model, display_name)
+    elif backend == 'local':
+        run_local_batch(input_path, output_path, model)
+    else:
+        raise ValueError(f"Unknown batch backend: {backend}")
+
+    results = read_batch_results(output_path)
+    failed = sum(1 for _, error in results.values() if error)
+    logging.info(
+        f"Batch {display_name} finished in {time.perf_counter() - start:.1f}s: "
+        f"{len(results) - failed} succeeded, {failed} failed, "
+        f"{len(prompts) - len(results)} missing"
+    )
+    return results
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from . import clustering
+from . import llm
+from . import news
+from . import summary_batch
+
+
+def make_articles(groups=4, per_group=10, words_per_group=15):
+    """Articles whose titles draw from disjoint per-group vocabularies (groups * words_per_group terms)."""
+    articles = []
+    for group in range(groups):
+        vocabulary = [f"topic{group}word{i}" for i in range(words_per_group)]
+        for i in range(per_group):
+            title = ' '.join(vocabulary[(i + k) % words_per_group] for k in range(5))
+            articles.append({
+                'title': title,
+                'link': f"https://example.com/{group}/{i}",
+                'published': f"2024-01-01T{i % 24:02d}:00:00+00:00",
+                'significant_words': title.split()[:3],
+            })
+    return articles
+
+
+@unittest.skipIf(clustering.TfidfVectorizer is None or clustering.hdbscan is None, "density clustering dependencies not installed")
+class DensityClusteringTests(SimpleTestCase):
+    def test_small_vocabulary_skips_svd(self):
+        # 40 titles over 60 terms: fewer terms than svd_components, so HDBSCAN gets the sparse matrix
+        articles = make_articles()
+        clusters = clustering.cluster_articles_density(articles, title_only=True)
+        self.assertEqual(sum(len(cluster['articles']) for cluster in clusters), len(articles))
+
+
+@unittest.skipIf(clustering.TfidfVectorizer is None or clustering.scipy_linkage is None, "hierarchical clustering dependencies not installed")
+class ClusterHierarchyTests(SimpleTestCase):
+    def test_article_with_all_terms_pruned(self):
+        # With 50+ articles min_df=2 prunes the unique words, leaving an all-zero TF-IDF row
+        articles = make_articles(groups=8, per_group=10)
+        articles.append({'title': 'xylophone zeppelin quasar', 'link': 'https://example.com/unique'})
+        hierarchy = clustering.build_cluster_hierarchy(articles, title_only=True)
+        self.assertEqual(len(hierarchy['linkage']), len(hierarchy['articles']) - 1)
+
+    def test_keeps_most_recent_articles(self):
+        articles = make_articles(groups=2, per_group=10)
+        with mock.patch.object(clustering, 'HIERARCHY_MAX_ARTICLES', 6):
+            hierarchy = clustering.build_cluster_hierarchy(articles, title_only=True)
+        newest = sorted(articles, key=lambda a: a['published'], reverse=True)[:6]
+        self.assertEqual({a['link'] for a in hierarchy['articles']}, {a['link'] for a in newest})
+
+
+class RoutedGenerationTests(SimpleTestCase):
+    routes = {'test': [
+        {'model': name, 'max_input_tokens': 1000, 'base_latency': 1.0, 'seconds_per_1k_tokens': 0.0}
+        for name in ('primary', 'hedge', 'fallback')
+    ]}
+
+    def test_failed_hedge_is_not_called_again(self):
+        calls = []
+
+        def call(model, timeout, retries):
+            calls.append(model)
+            if model == 'primary':
+                time.sleep(0.05)
+            if model != 'fallback':
+                raise TimeoutError(model)
+            return 'ok'
+
+        with mock.patch.dict(llm.MODEL_ROUTES, self.routes):
+            result = llm._generate_routed(call, 'test', 10, timeout=5, retries=1, caller='test', hedge_after=0.01)
+        self.assertEqual(result, 'ok')
+        self.assertEqual(sorted(calls), ['fallback', 'hedge', 'primary'])
+
+
+def make_cluster(links, common_words=None, cluster_id=None):
+    cluster = {
+        'common_words': common_words or [f"word{links[0]}"],
+        'articles': [{'title': f"Article {link}", 'link': f"https://example.com/{link}"} for link in links],
+    }
+    if cluster_id:
+        cluster['cluster_id'] = cluster_id
+    return cluster
+
+
+class ClusterIdentityTests(SimpleTestCase):
+    def test_id_carried_across_growing_cluster(self):
+        previous = [make_cluster([1, 2, 3], cluster_id='story')]
+        current = news.assign_cluster_ids([make_cluster([1, 2, 3, 4, 5, 6, 7, 8])], previous)
+        self.assertEqual(current[0]['cluster_id'], 'story')
+
+    def test_id_carried_while_articles_expire(self):
+        previous = [make_cluster([1, 2, 3, 4, 5, 6], cluster_id='story')]
+        current = news.assign_cluster_ids([make_cluster([5, 6, 7])], previous)
+        self.assertEqual(current[0]['cluster_id'], 'story')
+
+    def test_matching_is_one_to_one(self):
+        previous = [make_cluster([1, 2, 3, 4, 5, 6], cluster_id='story')]
+        current = news.assign_cluster_ids(
+            [make_cluster([1, 2, 10]), make_cluster([3, 4, 5, 6])],
+            previous
+        )
+        self.assertEqual(current[1]['cluster_id'], 'story')
+        self.assertNotEqual(current[0]['cluster_id'], 'story')
+        self.assertTrue(current[0]['cluster_id'])
+
+    def test_unrelated_cluster_gets_fresh_id(self):
+        previous = [make_cluster([1, 2, 3], cluster_id='story')]
+        current = news.assign_cluster_ids([make_cluster([7, 8, 9])], previous)
+        self.assertNotEqual(current[0]['cluster_id'], 'story')
+
+    def test_miscellaneous_cluster(self):
+        previous = [make_cluster([1, 2, 3], common_words=['Miscellaneous'], cluster_id='miscellaneous')]
+        current = news.assign_cluster_ids(
+            [make_cluster([1, 2, 3]), make_cluster([4, 5], common_words=['Miscellaneous'])],
+            previous
+        )
+        self.assertEqual(current[1]['cluster_id'], news.MISCELLANEOUS_CLUSTER_ID)
+        # A story is never matched to the previous miscellaneous bucket
+        self.assertNotEqual(current[0]['cluster_id'], news.MISCELLANEOUS_CLUSTER_ID)
+
+    def test_difference_uses_ids(self):
+        previous = [make_cluster([1, 2, 3], common_words=['old', 'words'], cluster_id='story')]
+        current = news.assign_cluster_ids([make_cluster([1, 2, 3], common_words=['new', 'words'])], previous)
+        self.assertEqual(news.calculate_cluster_difference(current, previous), 0.0)
+
+    def test_difference_falls_back_to_legacy_hash(self):
+        previous = [make_cluster([1, 2, 3], common_words=['same', 'words'])]
+        current = [make_cluster([1, 2, 3], common_words=['words', 'same'], cluster_id='story')]
+        self.assertEqual(news.calculate_cluster_difference(current, previous), 0.0)
+        renamed = [make_cluster([1, 2, 3], common_words=['other', 'words'], cluster_id='story')]
+        self.assertEqual(news.calculate_cluster_difference(renamed, previous), 1.0)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = 0.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.clock += seconds
+
+        patches = [
+            mock.patch.object(llm.time, 'monotonic', lambda: self.clock),
+            mock.patch.object(llm.time, 'sleep', sleep),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_capacity_defaults_to_ten_seconds_of_quota(self):
+        self.assertEqual(llm.TokenBucket(600).capacity, 100)
+        self.assertEqual(llm.TokenBucket(3).capacity, 1)
+        self.assertEqual(llm.TokenBucket(600, burst=5).capacity, 5)
+
+    def test_burst_then_waits_for_refill(self):
+        bucket = llm.TokenBucket(60, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_refill_is_capped_at_capacity(self):
+        bucket = llm.TokenBucket(60, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock += 60
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_configure_resets_capacity_and_rate(self):
+        bucket = llm.TokenBucket(60, burst=1)
+        bucket.acquire()
+        bucket.configure(120, burst=4)
+        self.assertEqual(bucket.capacity, 4)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(self.sleeps, [0.5])
+
+    def test_non_positive_rate_disables_limiting(self):
+        bucket = llm.TokenBucket(0)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+
+
+class BatchResultTests(SimpleTestCase):
+    def test_text_parts_are_joined(self):
+        record = {'key': 'a', 'response': {'candidates': [
+            {'finishReason': 'STOP', 'content': {'parts': [{'text': '{"summary": '}, {'text': '[]}'}]}}
+        ]}}
+        self.assertEqual(summary_batch.parse_batch_line(record), ('{"summary": []}', None))
+
+    def test_error_line(self):
+        text, error = summary_batch.parse_batch_line({'key': 'a', 'error': {'code': 429, 'message': 'quota'}})
+        self.assertIsNone(text)
+        self.assertIn('quota', error)
+
+    def test_no_candidates(self):
+        text, error = summary_batch.parse_batch_line({'key': 'a', 'response': {}})
+        self.assertIsNone(text)
+        self.assertTrue(error)
+
+    def test_blocked_finish(self):
+        for finish_reason in ('SAFETY', 'RECITATION'):
+            record = {'key': 'a', 'response': {'candidates': [
+                {'finishReason': finish_reason, 'content': {'parts': [{'text': 'partial'}]}}
+            ]}}
+            text, error = summary_batch.parse_batch_line(record)
+            self.assertIsNone(text)
+            self.assertIn(finish_reason, error)
+
+    def test_empty_parts(self):
+        record = {'key': 'a', 'response': {'candidates': [{'finishReason': 'STOP', 'content': {'parts': []}}]}}
+        text, error = summary_batch.parse_batch_line(record)
+        self.assertIsNone(text)
+        self.assertTrue(error)
+
+    def test_read_skips_blank_and_malformed_lines(self):
+        lines = [
+            json.dumps({'key': 'ok', 'response': {'candidates': [{'content': {'parts': [{'text': 'done'}]}}]}}),
+            '',
+            '{"key": "broken", ',
+            json.dumps({'key': 'failed', 'error': 'boom'}),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'output.jsonl')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            results = summary_batch.read_batch_results(path)
+        self.assertEqual(set(results), {'ok', 'failed'})
+        self.assertEqual(results['ok'], ('done', None))
+        self.assertEqual(results['failed'], (None, 'boom'))
@@ -55,6 +55,7 @@ urlpatterns = [
     path('notify_mentioned_users/', views.notify_mentioned_users),
 
     path('get_bubbles/', views.get_bubbles),
+    path('get_bubbles/hierarchy/', views.get_bubbles_hierarchy),
 
     path('get_organization_for_payment/', views.get_pricing_organization_data),
     path('subscriptions/create/', views.create_subscription),
@@ -64,6 +65,7 @@ urlpatterns = [
     path('chat/conversations/', chat_views.conversations),
     path('chat/conversations/<int:conversation_id>/', chat_views.conversation_detail),
     path('chat/conversations/<int:conversation_id>/messages/', chat_views.send_message),
+    path('chat/conversations/<int:conversation_id>/messages/stream/', chat_views.send_message_stream),
     path('chat/document-types/', chat_views.document_types),
 
     # Bites API
@@ -24,7 +24,8 @@ from django.template.loader import render_to_string
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 
-from .bubbles import process_feeds_and_cluster
+from .bubbles import get_bubbles_json, get_cached_hierarchy
+from .clustering import cut_cluster_hierarchy
 
 
 @csrf_exempt
@@ -1874,7 +1875,8 @@ def get_bubbles(request):
       "join_percentage": 0.5,
       "final_merge_percentage": 0.5,
       "title_only": false,
-      "all_words": false
+      "all_words": false,
+      "clustering_mode": "greedy"   // or "density" (TF-IDF + HDBSCAN)
     }
 
     Returns JSON containing:
@@ -1882,6 +1884,9 @@ def get_bubbles(request):
       "clusters": [...],
       "failed_sources": [...]
     }
+
+    Results are cached per (normalized URL set, parameters) for a short TTL and identical
+    concurrent requests share one computation; the X-Cache header reports HIT or MISS.
     """
     if request.method == "POST":
         try:
@@ -1900,10 +1905,13 @@ def get_bubbles(request):
             final_merge_percentage = data.get("final_merge_percentage", 0.5)
             title_only = data.get("title_only", False)
             all_words = data.get("all_words", False)
+            clustering_mode = data.get("clustering_mode", "greedy")
+            if clustering_mode not in ("greedy", "density"):
+                return JsonResponse({"error": "clustering_mode must be 'greedy' or 'density'."}, status=400)
 
-            # Call the clustering workflow
-            result = process_feeds_and_cluster(
-                rss_urls=rss_urls,
+            # Call the clustering workflow (or serve the cached result)
+            payload, cache_hit = get_bubbles_json(
+                rss_urls,
                 days_back=days_back,
                 common_word_threshold=common_word_threshold,
                 top_words_to_consider=top_words_to_consider,
@@ -1912,10 +1920,99 @@ def get_bubbles(request):
                 join_percentage=join_percentage,
                 final_merge_percentage=final_merge_percentage,
                 title_only=title_only,
+                all_words=all_words,
+                clustering_mode=clustering_mode
+            )
+
+            response = HttpResponse(payload, content_type="application/json", status=200)
+            response["X-Cache"] = "HIT" if cache_hit else "MISS"
+            return response
+
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON."}, status=400)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Only POST method is allowed."}, status=405)
+
+@ratelimit(key='ip', rate='10/m', block=True)
+@csrf_exempt
+def get_bubbles_hierarchy(request):
+    """
+    Multi-resolution clustering for the Bubbles canvas. Receives a JSON POST with:
+    {
+      "rss_urls": ["http://...", "http://..."],
+      "days_back": 2,
+      "title_only": false,
+      "all_words": false,
+      "threshold": 0.7,             // optional cosine distance (0-2) to cut at
+      "min_articles": 3,
+      "top_words_to_consider": 3
+    }
+
+    The dendrogram is computed once per article set and cached, so changing granularity
+    never re-fetches or re-clusters.
+
+    Without "threshold" returns the hierarchy to be cut client-side:
+    {
+      "articles": [{"title", "link", "favicon", "significant_words"}, ...],
+      "linkage": [[left, right, distance, size], ...],   // scipy convention
+      "failed_sources": [...]
+    }
+    With "threshold" returns the cut in the get_bubbles shape:
+    {
+      "clusters": [...],
+      "failed_sources": [...],
+      "threshold": 0.7
+    }
+    """
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            rss_urls = data.get("rss_urls", [])
+            if not rss_urls:
+                return JsonResponse({"error": "No 'rss_urls' provided."}, status=400)
+
+            days_back = data.get("days_back", 1)
+            title_only = data.get("title_only", False)
+            all_words = data.get("all_words", False)
+            threshold = data.get("threshold")
+            min_articles = data.get("min_articles", 3)
+            top_words_to_consider = data.get("top_words_to_consider", 3)
+
+            hierarchy, cache_hit = get_cached_hierarchy(
+                rss_urls,
+                days_back=days_back,
+                title_only=title_only,
                 all_words=all_words
             )
 
-            return JsonResponse(result, safe=False, status=200)
+            if threshold is None:
+                response = JsonResponse(hierarchy, status=200)
+            else:
+                try:
+                    threshold = float(threshold)
+                except (TypeError, ValueError):
+                    return JsonResponse({"error": "'threshold' must be a number."}, status=400)
+
+                clusters = cut_cluster_hierarchy(hierarchy, threshold, min_articles, top_words_to_consider)
+                response = JsonResponse({
+                    "clusters": [
+                        {
+                            "articles": [
+                                {"title": art["title"], "link": art["link"], "favicon": art["favicon"]}
+                                for art in cluster["articles"]
+                            ],
+                            "common_words": cluster["common_words"]
+                        }
+                        for cluster in clusters
+                    ],
+                    "failed_sources": hierarchy.get("failed_sources", []),
+                    "threshold": threshold
+                }, status=200)
+
+            response["X-Cache"] = "HIT" if cache_hit else "MISS"
+            return response
 
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON."}, status=400)